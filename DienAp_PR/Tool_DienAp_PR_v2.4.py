@@ -1,10 +1,24 @@
 # -*- coding: utf-8 -*-
 import sys, io
 
-if sys.stdout is not None:
-    sys.stdout = io.TextIOWrapper(sys.stdout.detach(), encoding='utf-8', errors='replace')
-if sys.stderr is not None:
-    sys.stderr = io.TextIOWrapper(sys.stderr.detach(), encoding='utf-8', errors='replace')
+# Tiến trình con của ProcessPoolExecutor (báo cáo theo Zone_Bx) chạy lại script này với tên
+# __mp_main__ (bản exe: cờ --multiprocessing-fork) -> bỏ qua mọi tác dụng phụ của giao diện.
+IS_POOL_WORKER = __name__ == "__mp_main__" or "--multiprocessing-fork" in sys.argv
+
+# Chạy không giao diện chỉ khi có cờ của main_headless; tham số khác (vd. file kéo thả vào exe) -> mở GUI
+HEADLESS_FLAGS = ("--config", "--inputs", "--output-dir", "--formats", "--trace",
+                  "--import-times", "--self-check", "-h", "--help")
+
+def is_headless_argv(argv) -> bool:
+    return any(str(a).split("=", 1)[0] in HEADLESS_FLAGS for a in argv)
+
+IS_HEADLESS = __name__ == "__main__" and is_headless_argv(sys.argv[1:])
+
+if not IS_POOL_WORKER:
+    if sys.stdout is not None:
+        sys.stdout = io.TextIOWrapper(sys.stdout.detach(), encoding='utf-8', errors='replace')
+    if sys.stderr is not None:
+        sys.stderr = io.TextIOWrapper(sys.stderr.detach(), encoding='utf-8', errors='replace')
 
 
 """
@@ -23,9 +37,17 @@ Chức năng chính:
     • Biểu đồ U thực tế (Line / Scatter)
     • 🌡 Heatmap điện áp theo giờ/ngày
     • 📊 Histogram, 📦 Boxplot
+    • 📈 Độ nhạy ngưỡng: số TBA / số lần vi phạm khi quét ngưỡng THẤP–CAO (tổng & theo Zone_Bx)
 - Báo cáo & xuất dữ liệu:
-    • Xuất báo cáo phân tích điện áp Zone_Bx (Excel / Word)
+    • Xuất báo cáo phân tích điện áp Zone_Bx (Excel / Word), gộp hoặc riêng từng Zone_Bx (song song)
+    • Báo cáo nhiều kỳ (quý/năm) gộp từ summary lưu cạnh từng file, không nạp lại dữ liệu thô
+    • So sánh các tháng (Δ số lần / số ngày vi phạm, Umin/Umax theo Zone_Bx & TBA) từ summary
+    • Chạy không giao diện: --config report.json -> báo cáo Zone_Bx (Excel / Word / HTML) cho nhiều kỳ
+    • --import-times: in thời gian import từng gói nặng (đo khởi động bản exe)
+    • ⏱ Hiệu năng: thời gian từng bước (gần nhất, p50/p95), xuất Chrome trace; --trace khi chạy không giao diện
+    • --self-check: kiểm tra xuất Parquet theo chunk; kèm --config thì đối chiếu tab Độ nhạy với bảng báo cáo
     • Xuất danh sách TBA lỗi (chưa map Zone_Bx)
+    • Xuất toàn bộ dữ liệu đang lọc (CSV / Excel / Parquet, chạy nền)
     • Lưu biểu đồ ra PNG
 - Quản lý:
     • Ghi nhớ cấu hình & cache tự động
@@ -37,34 +59,38 @@ Chức năng chính:
 Bản quyền phần mềm © 2025 NSO / SuNV
 """
 
-import plotly.graph_objs as go
-import plotly.io as pio
-import webview  # pip install pywebview
-import tempfile
-import os
-
-import os, re, sys, json, shutil, subprocess, tempfile, unicodedata
+import os, re, sys, json, time, shutil, subprocess, tempfile, threading, unicodedata
 from pathlib import Path
 from typing import List, Optional, Dict
+from contextlib import contextmanager
+
+_T_START = time.perf_counter()   # mốc đo thời gian khởi động (xem STARTUP_TIMES)
 
 import pandas as pd
 import numpy as np
 import matplotlib
-matplotlib.use("TkAgg")
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 
-import customtkinter as ctk
-import tkinter as tk
-from tkinter import filedialog, messagebox, ttk
-from tkcalendar import DateEntry
-
-from openpyxl import load_workbook
-from openpyxl.drawing.image import Image as XLImage
+if IS_POOL_WORKER or IS_HEADLESS:
+    # tiến trình con / chạy không giao diện chỉ dựng + ghi báo cáo: backend Agg, không nạp Tk
+    # (máy chạy lịch không cần customtkinter/tkinter); App chỉ cần lớp cơ sở để định nghĩa
+    import types
+    matplotlib.use("Agg")
+    ctk = types.SimpleNamespace(CTk=object)
+else:
+    matplotlib.use("TkAgg")      # pyplot / canvas Tk chỉ import khi dựng biểu đồ
+    import customtkinter as ctk
+    import tkinter as tk
+    from tkinter import filedialog, messagebox, ttk
+
+# Gói nặng (plotly, webview, rapidfuzz, python-docx, seaborn, openpyxl, tkcalendar...) import
+# trong hàm dùng tới chúng: cửa sổ hiện sớm hơn, tiến trình con / chế độ không giao diện nhẹ hơn.
+STARTUP_TIMES = {"import": time.perf_counter() - _T_START}
 
 APP_NAME = "station_gui_ctk_v8_1"
 CFG_PATH = os.path.join(Path.home(), f".{APP_NAME}_cfg.json")
-CACHE_PATH = os.path.join(Path.home(), f".{APP_NAME}_last.pkl")
+CACHE_PATH = os.path.join(Path.home(), f".{APP_NAME}_last.pkl")   # cache cũ (pickle), chỉ còn đọc/ghi khi thiếu pyarrow
+SUMMARY_DIR = os.path.join(Path.home(), f".{APP_NAME}_summaries")
+REPORT_CACHE_DIR = os.path.join(Path.home(), f".{APP_NAME}_reports")
 
 
 
@@ -83,6 +109,121 @@ def get_db_path(filename="DB_VietSub.xlsx"):
         base_path = os.path.dirname(os.path.abspath(__file__))
     return os.path.join(base_path, filename)
 
+# ==================== Performance tracing ====================
+PERF_STAGES = {   # bước pipeline -> nhãn hiển thị (theo thứ tự xử lý)
+    "parse": "Đọc file Excel",
+    "xls_convert": "Chuyển .xls -> .xlsx",
+    "dedup": "Khử trùng",
+    "zone_map": "Gắn Zone_Bx",
+    "filter": "Lọc dữ liệu",
+    "table": "Đổ bảng",
+    "chart": "Vẽ biểu đồ",
+    "heatmap": "Heatmap",
+    "rasterize": "Vẽ tab (thread nền)",
+    "report_build": "Dựng báo cáo",
+    "export": "Xuất file",
+}
+PERF_HISTORY = 200          # số lần đo gần nhất giữ cho mỗi bước (tính p50/p95)
+PERF_MAX_EVENTS = 20_000    # số span gần nhất giữ cho Chrome trace
+
+class PerfTracer:
+    """Đo thời gian các bước xử lý theo span; dùng chung cho GUI, thread nền và chế độ không giao diện.
+
+    - with PERF.span("filter", rows=n): ...  hoặc  @PERF.traced("zone_map")
+    - stats(): số lần, lần gần nhất, p50/p95/max (ms) trên PERF_HISTORY lần gần nhất của từng bước.
+    - chrome_trace(): sự kiện "X" (ts/dur µs), mở bằng chrome://tracing hoặc ui.perfetto.dev.
+    Span lồng cùng tên trên 1 thread (from_frame -> build) chỉ tính 1 mẫu: span ngoài cùng.
+    """
+
+    def __init__(self, history: int = PERF_HISTORY, max_events: int = PERF_MAX_EVENTS):
+        import threading
+        from collections import deque
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._history = history
+        self._samples = {}                       # stage -> deque[giây]
+        self._events = deque(maxlen=max_events)  # (event, tên thread)
+        self._t0 = time.perf_counter()
+
+    @contextmanager
+    def span(self, stage: str, **args):
+        import threading
+        stack = self._local.__dict__.setdefault("stack", [])
+        outer = stage not in stack
+        stack.append(stage)
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            dur = time.perf_counter() - t0
+            stack.pop()
+            th = threading.current_thread()
+            ev = {"name": stage, "cat": "dienap", "ph": "X",
+                  "ts": round((t0 - self._t0) * 1e6, 1), "dur": round(dur * 1e6, 1),
+                  "pid": os.getpid(), "tid": th.ident}
+            if args:
+                ev["args"] = args
+            with self._lock:
+                self._events.append((ev, th.name))
+                if outer:
+                    if stage not in self._samples:
+                        from collections import deque
+                        self._samples[stage] = deque(maxlen=self._history)
+                    self._samples[stage].append(dur)
+
+    def traced(self, stage: str):
+        """Decorator: cả lời gọi hàm là 1 span."""
+        import functools
+        def deco(fn):
+            @functools.wraps(fn)
+            def wrapper(*a, **kw):
+                with self.span(stage):
+                    return fn(*a, **kw)
+            return wrapper
+        return deco
+
+    def stats(self) -> List[dict]:
+        with self._lock:
+            samples = {k: list(v) for k, v in self._samples.items()}
+        rows = []
+        for stage in list(PERF_STAGES) + sorted(set(samples) - set(PERF_STAGES)):
+            if not samples.get(stage):
+                continue
+            ms = np.asarray(samples[stage]) * 1000.0
+            p50, p95 = np.percentile(ms, [50, 95])
+            rows.append({"stage": stage, "label": PERF_STAGES.get(stage, stage), "n": int(ms.size),
+                         "last": float(ms[-1]), "p50": float(p50), "p95": float(p95), "max": float(ms.max())})
+        return rows
+
+    def report(self) -> str:
+        """Bảng stats() dạng chữ (log / chế độ không giao diện)."""
+        lines = [f"{'Bước':<24}{'Lần':>6}{'Gần nhất':>12}{'p50':>10}{'p95':>10}{'Max':>10}  (ms)"]
+        for r in self.stats():
+            lines.append(f"{r['label']:<24}{r['n']:>6}{r['last']:>12.1f}{r['p50']:>10.1f}{r['p95']:>10.1f}{r['max']:>10.1f}")
+        return "\n".join(lines)
+
+    def chrome_trace(self) -> dict:
+        with self._lock:
+            events = list(self._events)
+        threads = {(ev["pid"], ev["tid"]): name for ev, name in events}
+        meta = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                for (pid, tid), name in threads.items()]
+        return {"traceEvents": meta + [ev for ev, _ in events], "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, path: str) -> str:
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.chrome_trace(), f, ensure_ascii=False, default=str)
+        os.replace(tmp, path)
+        return path
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+            self._events.clear()
+
+PERF = PerfTracer()
+
 # ==================== Helpers ====================
 def normalize_cols(df: pd.DataFrame) -> pd.DataFrame:
     out = df.copy()
@@ -120,29 +261,33 @@ def ensure_readable_xlsx(path: str, tmp_dir: str) -> str:
         _ = read_excel_all_sheets_xls(path)
         return path
     except Exception:
-        base = Path(path).stem
-        out_xlsx = os.path.join(tmp_dir, base + ".xlsx")
-        try:
-            if sys.platform.startswith("win"):
-                import win32com.client as win32  # pip install pywin32
-                excel = win32.gencache.EnsureDispatch("Excel.Application")
-                excel.DisplayAlerts = False
-                wb = excel.Workbooks.Open(path)
-                wb.SaveAs(out_xlsx, FileFormat=51)
-                wb.Close(False); excel.Quit()
-                if not os.path.exists(out_xlsx):
-                    raise RuntimeError("Excel không tạo được file .xlsx")
-                return out_xlsx
-            else:
-                if has_soffice():
-                    subprocess.run(["soffice","--headless","--convert-to","xlsx",path,"--outdir",tmp_dir],
-                                   check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                    out = os.path.join(tmp_dir, Path(path).with_suffix(".xlsx").name)
-                    if not os.path.exists(out): raise RuntimeError("LibreOffice không tạo được file .xlsx")
-                    return out
-                return path
-        except Exception as e:
-            raise RuntimeError(f"Không thể chuyển .xls: {e}")
+        return _convert_xls(path, tmp_dir)
+
+@PERF.traced("xls_convert")
+def _convert_xls(path: str, tmp_dir: str) -> str:
+    base = Path(path).stem
+    out_xlsx = os.path.join(tmp_dir, base + ".xlsx")
+    try:
+        if sys.platform.startswith("win"):
+            import win32com.client as win32  # pip install pywin32
+            excel = win32.gencache.EnsureDispatch("Excel.Application")
+            excel.DisplayAlerts = False
+            wb = excel.Workbooks.Open(path)
+            wb.SaveAs(out_xlsx, FileFormat=51)
+            wb.Close(False); excel.Quit()
+            if not os.path.exists(out_xlsx):
+                raise RuntimeError("Excel không tạo được file .xlsx")
+            return out_xlsx
+        else:
+            if has_soffice():
+                subprocess.run(["soffice","--headless","--convert-to","xlsx",path,"--outdir",tmp_dir],
+                               check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                out = os.path.join(tmp_dir, Path(path).with_suffix(".xlsx").name)
+                if not os.path.exists(out): raise RuntimeError("LibreOffice không tạo được file .xlsx")
+                return out
+            return path
+    except Exception as e:
+        raise RuntimeError(f"Không thể chuyển .xls: {e}")
 
 def detect_datetime_column(df: pd.DataFrame) -> Optional[str]:
     hints = ["ngay", "thoi gian", "date", "time", "thang", "month", "nam", "year", "ngay gio"]
@@ -208,11 +353,12 @@ def combine_from_paths(file_paths: List[str]) -> pd.DataFrame:
     with tempfile.TemporaryDirectory() as tmpd:
         for f in file_paths:
             readable = ensure_readable_xlsx(f, tmpd)
-            book = (
-                read_excel_all_sheets_xlsx(readable)
-                if readable.lower().endswith(".xlsx")
-                else read_excel_all_sheets_xls(readable)
-            )
+            with PERF.span("parse", file=os.path.basename(f)):
+                book = (
+                    read_excel_all_sheets_xlsx(readable)
+                    if readable.lower().endswith(".xlsx")
+                    else read_excel_all_sheets_xls(readable)
+                )
 
             for sname, df in book.items():
                 if df is None or df.shape[0] == 0:
@@ -233,6 +379,7 @@ def combine_from_paths(file_paths: List[str]) -> pd.DataFrame:
                 seen_sig.add(sig)
 
                 df["_source_file"] = os.path.basename(f)
+                df["_source_path"] = os.path.abspath(f)   # phân biệt file trùng tên ở thư mục khác (summary)
                 df["_sheet"] = sname
                 all_rows.append(df)
 
@@ -240,11 +387,13 @@ def combine_from_paths(file_paths: List[str]) -> pd.DataFrame:
         return pd.DataFrame()
 
     combined = pd.concat(all_rows, ignore_index=True, sort=False)
+    combined["_source_path"] = combined["_source_path"].astype("category")
 
     # 3) drop duplicates theo toàn bộ cột trừ "so tt" (nếu có)
     subset = [c for c in combined.columns if c != "so tt"]
     if subset:
-        combined = combined.drop_duplicates(subset=subset, keep="first").reset_index(drop=True)
+        with PERF.span("dedup", rows=len(combined)):
+            combined = combined.drop_duplicates(subset=subset, keep="first").reset_index(drop=True)
 
     combined.insert(0, "so tt", np.arange(1, len(combined) + 1))
     return combined
@@ -260,6 +409,2166 @@ def detect_compare_column(df: pd.DataFrame) -> Optional[str]:
                 return c
     return None
 
+# ==================== Zone_Bx mapping ====================
+@PERF.traced("zone_map")
+def attach_zone_bx(df: pd.DataFrame, db_path: Optional[str] = None, log=safe_print) -> pd.DataFrame:
+    """Ánh xạ TRẠM BIẾN ÁP -> Sym/zone_code -> Zone_Bx theo DB_VietSub.xlsx.
+    Trả về DataFrame mới (không sửa df đầu vào); log(msg) nhận thông báo tiến trình."""
+    db_path = db_path or get_db_path()
+
+    if "TRẠM BIẾN ÁP" not in df.columns:
+        log("⚠️ Không tìm thấy cột 'TRẠM BIẾN ÁP' để ánh xạ Zone_Bx.")
+    elif not os.path.exists(db_path):
+        log(f"⚠️ Không tìm thấy file DB_VietSub.xlsx tại: {db_path}")
+    else:
+        # ====== MAP Zone_Bx (TRIỆT LỖI zone_code <NA>) ======
+        buses_df = pd.read_excel(db_path, sheet_name="Buses")
+        try:
+            zone_df = pd.read_excel(db_path, sheet_name="Zones")
+        except Exception:
+            zone_df = pd.read_excel(db_path, sheet_name=1)
+
+        zone_df = zone_df.rename(columns={"zone_name_vi": "Zone_Bx"})
+
+        # --- helper: dò cột theo danh sách ứng viên ---
+        def _pick_col(df, candidates):
+            cols = {c.lower(): c for c in df.columns}
+            for cand in candidates:
+                if cand in df.columns:
+                    return cand
+                if cand.lower() in cols:
+                    return cols[cand.lower()]
+            return None
+
+        # --- helper: ép zone_code an toàn (không rớt NA nếu dữ liệu kiểu "15.0", "15 ") ---
+        def _coerce_zone_code(s):
+            # s: Series
+            x = s.copy()
+            # ưu tiên numeric
+            out = pd.to_numeric(x, errors="coerce")
+            # các giá trị numeric ok
+            ok = out.notna()
+            # phần còn lại: xử lý string "15.0", "15 ", "015"
+            if (~ok).any():
+                t = x[~ok].astype(str).str.strip()
+                t = t.str.replace(".0", "", regex=False)
+                t = t.str.replace(",", ".", regex=False)
+                t2 = pd.to_numeric(t, errors="coerce")
+                out.loc[~ok] = t2
+            return out.astype("Int64")
+
+        # --- dò đúng tên cột trong DB (tránh DB đặt khác 'zone_code', 'Sym') ---
+        bus_sym_col  = _pick_col(buses_df, ["Sym", "SYM", "sym"])
+        bus_zone_col = _pick_col(buses_df, ["zone_code", "Zone_code", "ZONE_CODE", "zone", "Zone", "ZONE", "zone_id", "Zone_ID", "ZONE_ID"])
+        zone_sym_col  = _pick_col(zone_df, ["Sym", "SYM", "sym"])
+        zone_zone_col = _pick_col(zone_df, ["zone_code", "Zone_code", "ZONE_CODE", "zone", "Zone", "ZONE", "zone_id", "Zone_ID", "ZONE_ID"])
+
+        if bus_sym_col is None or bus_zone_col is None:
+            log(f"⚠️ DB 'Buses' thiếu cột Sym/zone_code (Sym={bus_sym_col}, zone={bus_zone_col}).")
+        else:
+            # chuẩn hóa Sym + zone_code trong buses_df
+            buses_df = buses_df.copy()
+            buses_df[bus_sym_col] = buses_df[bus_sym_col].astype(str).str.strip().str.upper()
+            buses_df[bus_zone_col] = _coerce_zone_code(buses_df[bus_zone_col])
+
+            if zone_sym_col is None or zone_zone_col is None:
+                log(f"⚠️ DB 'Zones' thiếu cột Sym/zone_code (Sym={zone_sym_col}, zone={zone_zone_col}).")
+            else:
+                zone_df = zone_df.copy()
+                zone_df[zone_sym_col] = zone_df[zone_sym_col].astype(str).str.strip().str.upper()
+                zone_df[zone_zone_col] = _coerce_zone_code(zone_df[zone_zone_col])
+
+                # ===== FIX TRIỆT ĐỂ: zone_code trong Buses là công thức -> pandas đọc ra <NA> =====
+                # Nếu zone_code của Buses bị <NA> hàng loạt (do công thức mất cached result sau khi openpyxl save),
+                # thì suy ra zone_code theo Sym từ sheet Zones (Zones đang là giá trị số ổn định).
+                try:
+                    bus_zone_na = buses_df[bus_zone_col].notna().sum()
+                    if bus_zone_na == 0 or bus_zone_na < 10:
+                        # map Sym -> zone_code từ Zones
+                        sym2zone = zone_df.set_index(zone_sym_col)[zone_zone_col].to_dict()
+                        buses_df[bus_zone_col] = buses_df[bus_sym_col].map(sym2zone)
+                        buses_df[bus_zone_col] = _coerce_zone_code(buses_df[bus_zone_col])
+                        log("ℹ️ zone_code(Buses) là công thức bị mất giá trị -> đã suy ra lại từ sheet Zones.")
+                except Exception as _e:
+                    log(f"⚠️ Không suy ra được zone_code từ Zones: {_e}")
+
+                # --- chuẩn hóa key join __jk như code của bạn ---
+                import re, unicodedata
+
+                def _norm_key(s: str) -> str:
+                    s = str(s).strip().lower()
+                    s = unicodedata.normalize("NFD", s)
+                    s = "".join(ch for ch in s if unicodedata.category(ch) != "Mn")
+                    s = s.replace("đ", "d").replace("Đ", "d")
+                    s = re.sub(r"\b\d{2,3}\s*kv\b", " ", s)
+                    s = re.sub(r"\b(tba|tram bien ap|nm|tdn|td|xm|nmd|nmdn|nmt|nha may|xi mang|kcn)\b", " ", s)
+                    s = re.sub(r"\b\d+[a-z]?\b", " ", s)
+                    s = re.sub(r"[,/()\-]", " ", s)
+                    s = re.sub(r"\s+", " ", s).strip()
+                    return s
+
+                # Dọn cột cũ để tránh Sym_x/Sym_y / zone_code_x
+                df = df.drop(columns=[c for c in ["__jk", "Sym", "zone_code", "Zone_Bx"] if c in df.columns])
+
+                buses_df["__jk"] = buses_df["TBA_SCADA"].astype(str).map(_norm_key)
+                df["__jk"]  = df["TRẠM BIẾN ÁP"].astype(str).map(_norm_key)
+
+                # --- merge __jk -> Sym, zone_code (đặt tên chuẩn Sym/zone_code) ---
+                bus_map = buses_df[["__jk", bus_sym_col, bus_zone_col]].drop_duplicates(subset=["__jk"]).copy()
+                bus_map = bus_map.rename(columns={bus_sym_col: "Sym", bus_zone_col: "zone_code"})
+
+                df = df.merge(bus_map, on="__jk", how="left")
+
+                # --- merge Sym + zone_code -> Zone_Bx ---
+                zone_map = zone_df[[zone_sym_col, zone_zone_col, "Zone_Bx"]].drop_duplicates(subset=[zone_sym_col, zone_zone_col]).copy()
+                zone_map = zone_map.rename(columns={zone_sym_col: "Sym", zone_zone_col: "zone_code"})
+
+                df["Sym"] = df["Sym"].astype(str).str.strip().str.upper()
+                df["zone_code"] = _coerce_zone_code(df["zone_code"])
+
+                df = df.merge(zone_map, on=["Sym", "zone_code"], how="left")
+
+                # dọn cột tạm
+                df = df.drop(columns=["__jk"], errors="ignore")
+
+            # Báo cáo gọn
+            if "Zone_Bx" in df.columns:
+                missing_rows = df[df["Zone_Bx"].isna()]
+                if not missing_rows.empty:
+                    num_missing = int(missing_rows["TRẠM BIẾN ÁP"].nunique())
+                    sample = ", ".join(sorted(missing_rows["TRẠM BIẾN ÁP"].dropna().astype(str).unique()[:5]))
+                    log(
+                        f"⚠️ Còn {num_missing} trạm chưa ánh xạ Zone_Bx (vd: {sample}…). "
+                        f"Dùng nút '📤 Xuất TBA lỗi' để xuất danh sách chi tiết."
+                    )
+                else:
+                    log("[ok] Đã ánh xạ thành công tất cả TBA sang Zone_Bx.")
+    return df
+
+# ==================== Session cache ====================
+SESSION_CACHE_DIR = os.path.join(Path.home(), f".{APP_NAME}_session")
+SESSION_CACHE_VERSION = 1
+SESSION_CACHE_META = b"dienap_session_version"
+
+def _session_arrow_table(df: pd.DataFrame):
+    """pyarrow Table 1 chunk/cột (đọc lại qua memory-map không cần parse), giữ metadata kiểu pandas;
+    cột object lẫn số + chuỗi -> chuỗi."""
+    import pyarrow as pa
+    fixes = {}
+    for c in df.columns:
+        if df[c].dtype != object:
+            continue
+        try:
+            pa.array(df[c], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            fixes[c] = df[c].map(lambda x: None if pd.isna(x) else str(x))
+    if fixes:
+        df = df.assign(**fixes)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    meta = dict(table.schema.metadata or {})
+    meta[SESSION_CACHE_META] = str(SESSION_CACHE_VERSION).encode()
+    return table.replace_schema_metadata(meta)
+
+def _session_cache_files() -> List[str]:
+    """Các bản cache phiên, mới nhất trước (tên chứa số thứ tự theo thời gian ghi)."""
+    try:
+        names = [n for n in os.listdir(SESSION_CACHE_DIR) if n.startswith("session_") and n.endswith(".arrow")]
+    except OSError:
+        return []
+    return [os.path.join(SESSION_CACHE_DIR, n) for n in sorted(names, reverse=True)]
+
+def write_session_cache(df: pd.DataFrame) -> Optional[str]:
+    """Ghi df ra Arrow IPC (không nén, để memory-map) dưới tên mới rồi xóa bản cũ.
+    Không ghi đè tại chỗ: bản đang được map (Windows khóa file) chỉ bị xóa ở lần ghi sau."""
+    import pyarrow as pa
+    os.makedirs(SESSION_CACHE_DIR, exist_ok=True)
+    table = _session_arrow_table(df)
+    path = os.path.join(SESSION_CACHE_DIR, f"session_{time.time_ns():020d}.arrow")
+    tmp = path + ".tmp"
+    with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp, path)
+    stale = [str(p) for p in Path(SESSION_CACHE_DIR).glob("session_*.arrow.tmp")]  # ghi dở khi đóng app quá hạn
+    for old in _session_cache_files()[1:]:
+        stale += [old, session_state_path(old)]
+    for f in stale:
+        try: os.remove(f)
+        except OSError: pass
+    return path
+
+def _session_readonly_columns(df: pd.DataFrame) -> List[str]:
+    """Cột mà to_pandas có thể để trỏ thẳng vào vùng memory-map (mảng chỉ đọc).
+    Category luôn tính vào (mã code nhỏ, chép rẻ; pandas không cho xem cờ ghi của code)."""
+    out = []
+    for c in df.columns:
+        s = df[c]
+        if isinstance(s.dtype, pd.CategoricalDtype):
+            out.append(c)
+        elif isinstance(s.dtype, np.dtype) and not s.to_numpy().flags.writeable:
+            out.append(c)
+    return out
+
+def read_session_cache():
+    """(df, path) của bản cache phiên mới nhất còn hợp lệ, hoặc None nếu không có bản nào.
+
+    Đọc qua memory-map (không parse lại Excel/pickle) rồi dựng đủ DataFrame ngay trên thread gọi:
+    cột chuỗi thành object có khử trùng chuỗi; cột số/thời gian không-null mà Arrow trả về dạng
+    view chỉ đọc của vùng map được chép ra mảng thường, nên df sửa tại chỗ được như mọi dataset khác."""
+    import pyarrow as pa
+    for path in _session_cache_files():
+        try:
+            table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+        except (OSError, pa.ArrowInvalid):
+            continue
+        if (table.schema.metadata or {}).get(SESSION_CACHE_META) != str(SESSION_CACHE_VERSION).encode():
+            continue
+        df = table.to_pandas(split_blocks=True, deduplicate_objects=True)
+        for c in _session_readonly_columns(df):
+            df[c] = df[c].copy()
+        return df, path
+    return None
+
+def save_session_df(df: pd.DataFrame) -> str:
+    """Cache phiên Arrow; thiếu pyarrow thì pickle. Cả hai đều ghi file tạm rồi đổi tên nguyên tử."""
+    try:
+        return write_session_cache(df)
+    except ImportError:
+        pass
+    tmp = CACHE_PATH + ".tmp"
+    df.to_pickle(tmp)
+    os.replace(tmp, CACHE_PATH)
+    return CACHE_PATH
+
+SESSION_CACHE_COALESCE_S = 1.0     # gom các lần đổi dataset liên tiếp trước khi ghi
+SESSION_CACHE_CLOSE_S = 5.0        # đóng app: chờ ghi nốt tối đa (cửa sổ đã ẩn); quá hạn thì giữ bản cũ
+
+class SessionCacheWriter:
+    """Ghi cache phiên trên 1 thread nền, chỉ khi dataset đổi.
+
+    - submit(df, version): version = phiên bản dataset; trùng bản đã ghi / đang chờ thì bỏ qua.
+    - Nhiều lần submit liên tiếp được gộp: thread chờ SESSION_CACHE_COALESCE_S rồi chỉ ghi bản mới nhất.
+    - flush(timeout) bỏ nhịp gộp, ghi ngay bản đang chờ và chờ tối đa timeout (0 = chỉ hỏi đã xong chưa).
+    - discard() bỏ bản đang chờ; file của lần ghi đang dở sẽ bị xóa khi ghi xong.
+    Ghi dở bị ngắt (đóng app) không hỏng cache cũ: file tạm chỉ đổi tên khi đã ghi đủ.
+    """
+
+    def __init__(self, save=save_session_df, log=safe_print, coalesce_s: float = SESSION_CACHE_COALESCE_S):
+        self._save, self._log, self._coalesce_s = save, log, coalesce_s
+        self._cond = threading.Condition()
+        self._pending = None          # (version, df) mới nhất chưa ghi
+        self._saved_version = None
+        self._saved_path = None
+        self._writing = False
+        self._hurry = False           # flush(): bỏ nhịp gộp
+        self._epoch = 0               # tăng mỗi lần discard()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def mark_saved(self, version, path: Optional[str] = None):
+        """Dataset vừa nạp từ chính cache: không cần ghi lại."""
+        with self._cond:
+            self._saved_version, self._saved_path = version, path
+
+    def saved_path(self, version) -> Optional[str]:
+        """File cache đang chứa đúng bản dataset version (None nếu chưa ghi xong)."""
+        with self._cond:
+            return self._saved_path if version == self._saved_version else None
+
+    def submit(self, df: pd.DataFrame, version) -> bool:
+        with self._cond:
+            if version == self._saved_version or (self._pending and self._pending[0] == version):
+                return False
+            self._pending = (version, df)
+            self._cond.notify_all()
+            return True
+
+    def discard(self):
+        """Bỏ bản đang chờ ghi (dataset vừa bị xóa); không chờ lần ghi đang dở."""
+        with self._cond:
+            self._pending = None
+            self._epoch += 1
+            self._cond.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Ghi ngay bản đang chờ; True nếu không còn gì chờ ghi trong timeout."""
+        with self._cond:
+            self._hurry = True
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: self._pending is None and not self._writing, timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None:
+                    self._cond.wait()
+                # gom các lần submit dồn dập: đợi hết 1 nhịp rồi lấy bản mới nhất
+                deadline = time.monotonic() + self._coalesce_s
+                while self._pending is not None and not self._hurry and time.monotonic() < deadline:
+                    self._cond.wait(deadline - time.monotonic())
+                if self._pending is None:      # đã discard()
+                    continue
+                version, df = self._pending
+                self._pending = None
+                self._writing = True
+                epoch = self._epoch
+            try:
+                path = self._save(df)
+                with self._cond:
+                    discarded = epoch != self._epoch
+                    if not discarded:
+                        self._saved_version, self._saved_path = version, path
+                if discarded:                  # dữ liệu đã bị xóa trong lúc ghi
+                    for f in (path, session_state_path(path)):
+                        try: os.remove(f)
+                        except OSError: pass
+            except Exception as e:
+                self._log(f"[cache] Lỗi ghi cache phiên: {e}")
+            finally:
+                with self._cond:
+                    self._writing = False
+                    self._cond.notify_all()
+
+def clear_session_cache():
+    shutil.rmtree(SESSION_CACHE_DIR, ignore_errors=True)
+    for f in (CACHE_PATH, session_state_path(CACHE_PATH)):
+        try:
+            if os.path.exists(f): os.remove(f)
+        except OSError:
+            pass
+
+# Snapshot trạng thái dẫn xuất (cột đã dò, cube, bảng hiển thị, KPI, biểu đồ, kết quả lọc)
+# đi kèm đúng 1 bản cache phiên: khởi động ấm vẽ lại màn hình cũ mà không tính lại.
+SESSION_STATE_VERSION = 2
+SESSION_STATE_REFRESH_MS = 300     # khởi động ấm: chờ vẽ xong màn hình cũ rồi mới vẽ tab dashboard
+
+def session_state_path(data_path: str) -> str:
+    return os.path.splitext(data_path)[0] + ".state.pkl"
+
+def write_session_state(data_path: str, state: dict) -> str:
+    import pickle
+    path = session_state_path(data_path)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(dict(state, version=SESSION_STATE_VERSION), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+    return path
+
+def read_session_state(data_path: str, df: pd.DataFrame) -> Optional[dict]:
+    """Snapshot của bản cache data_path; None nếu thiếu, khác phiên bản hoặc không khớp df."""
+    import pickle
+    try:
+        with open(session_state_path(data_path), "rb") as f:
+            state = pickle.load(f)
+    except Exception:
+        return None
+    if not isinstance(state, dict) or state.get("version") != SESSION_STATE_VERSION:
+        return None
+    if state.get("rows") != len(df) or state.get("columns") != [str(c) for c in df.columns]:
+        return None
+    return state
+
+# ==================== Streaming export ====================
+EXPORT_CHUNK_ROWS = 50_000
+
+def _iter_chunks(df: pd.DataFrame, chunk_rows: int = EXPORT_CHUNK_ROWS):
+    """Duyệt df theo lát iloc (không tạo bản sao toàn bộ frame)."""
+    for start in range(0, len(df), chunk_rows):
+        yield start, df.iloc[start:start + chunk_rows]
+
+def _export_csv_stream(df: pd.DataFrame, path: str, progress=None):
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        for start, chunk in _iter_chunks(df):
+            chunk.to_csv(f, header=(start == 0), index=False)
+            if progress: progress(start + len(chunk), len(df))
+
+def _xlsx_rows(chunk: pd.DataFrame):
+    # NaN/NaT -> ô trống; chỉ chuyển đổi trong phạm vi 1 chunk
+    obj = chunk.astype(object).where(chunk.notna(), None)
+    return obj.itertuples(index=False, name=None)
+
+def _export_xlsx_stream(df: pd.DataFrame, path: str, progress=None):
+    """Ghi xlsx ở chế độ constant-memory (xlsxwriter); fallback openpyxl write_only."""
+    cols = [str(c) for c in df.columns]
+
+    try:
+        import xlsxwriter
+    except ImportError:
+        xlsxwriter = None
+
+    if xlsxwriter is not None:
+        wb = xlsxwriter.Workbook(path, {"constant_memory": True,
+                                        "default_date_format": "dd-mm-yyyy hh:mm",
+                                        "nan_inf_to_errors": True})
+        try:
+            ws = wb.add_worksheet("DATA")
+            ws.write_row(0, 0, cols)
+            r = 1
+            for start, chunk in _iter_chunks(df):
+                for row in _xlsx_rows(chunk):
+                    ws.write_row(r, 0, row)
+                    r += 1
+                if progress: progress(start + len(chunk), len(df))
+        finally:
+            wb.close()
+        return
+
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("DATA")
+    ws.append(cols)
+    for start, chunk in _iter_chunks(df):
+        for row in _xlsx_rows(chunk):
+            ws.append(list(row))
+        if progress: progress(start + len(chunk), len(df))
+    wb.save(path)
+
+def _export_parquet_stream(df: pd.DataFrame, path: str, progress=None):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # schema dựng 1 lần từ dtype của cả df: cột object (kể cả chunk đầu toàn rỗng) luôn là string
+    obj_cols = [c for c in df.columns if df[c].dtype == object]
+    schema = pa.Schema.from_pandas(df.head(0), preserve_index=False)
+    for c in obj_cols:
+        schema = schema.set(schema.get_field_index(str(c)), pa.field(str(c), pa.string()))
+
+    writer = None
+    try:
+        for start, chunk in _iter_chunks(df):
+            # cột object hỗn hợp (số + chuỗi) -> chuỗi
+            if obj_cols:
+                chunk = chunk.assign(**{c: chunk[c].map(lambda x: None if pd.isna(x) else str(x)) for c in obj_cols})
+            table = pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(path, schema, compression="zstd")
+            writer.write_table(table)
+            if progress: progress(start + len(chunk), len(df))
+        if writer is None:
+            pq.write_table(pa.Table.from_pandas(df.head(0), schema=schema, preserve_index=False), path)
+    finally:
+        if writer is not None:
+            writer.close()
+
+@PERF.traced("export")
+def export_frame_streaming(df: pd.DataFrame, path: str, progress=None) -> str:
+    """Xuất toàn bộ df ra CSV / XLSX / Parquet theo phần mở rộng của path,
+    ghi từng chunk EXPORT_CHUNK_ROWS dòng. progress(done, total) được gọi sau mỗi chunk."""
+    ext = Path(path).suffix.lower()
+    if ext == ".csv":
+        _export_csv_stream(df, path, progress)
+    elif ext == ".xlsx":
+        _export_xlsx_stream(df, path, progress)
+    elif ext == ".parquet":
+        _export_parquet_stream(df, path, progress)
+    else:
+        raise ValueError(f"Định dạng không hỗ trợ: {ext}")
+    return path
+
+def check_parquet_export() -> List[str]:
+    """Xuất Parquet 1 bảng mẫu có cột chuỗi rỗng suốt chunk đầu rồi đọc lại.
+    Trả về danh sách lỗi (rỗng = đạt; thiếu pyarrow thì bỏ qua)."""
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        return []
+    n = EXPORT_CHUNK_ROWS + 3
+    df = pd.DataFrame({"U": np.arange(n, dtype=float),
+                       "z": [None] * EXPORT_CHUNK_ROWS + ["a", 1, None]})
+    path = os.path.join(tempfile.mkdtemp(), "check.parquet")
+    try:
+        export_frame_streaming(df, path)
+        back = pq.read_table(path).to_pandas()
+    except Exception as e:
+        return [f"Parquet: {e}"]
+    finally:
+        shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+    if len(back) != n or back["z"].tail(3).tolist() != ["a", "1", None]:
+        return ["Parquet: dữ liệu đọc lại không khớp"]
+    return []
+
+# --- Báo cáo Zone_Bx (Excel) ---
+# (tên sheet, tiêu đề biểu đồ theo cột 2 và 3 của bảng thống kê, màu cột)
+ZONE_XLSX_STAT_CHARTS = {
+    "ZONE_BX_HIGH_STAT": [("Số lượng TBA có vi phạm điện áp CAO (>=110%) theo Zone_Bx", "#24BE6E"),
+                          ("Tổng số lần vi phạm điện áp CAO (>=110%) theo Zone_Bx", "#0078FA")],
+    "ZONE_BX_LOW_STAT":  [("Số lượng TBA có vi phạm điện áp THẤP (<=95%) theo Zone_Bx", "#F16235"),
+                          ("Tổng số lần vi phạm điện áp THẤP (<=95%) theo Zone_Bx", "#8C4BE6")],
+}
+
+def export_zone_report_xlsx(path: str, stat_high: pd.DataFrame, stat_low: pd.DataFrame,
+                            df_high: pd.DataFrame, df_low: pd.DataFrame, progress=None) -> str:
+    """Báo cáo Zone_Bx ra xlsx; sheet thống kê kèm biểu đồ cột gốc của Excel (ZONE_XLSX_STAT_CHARTS)."""
+    sheets = [("ZONE_BX_HIGH_STAT", stat_high), ("ZONE_BX_LOW_STAT", stat_low),
+              ("HIGH_VOLTAGE_DETAIL", df_high), ("LOW_VOLTAGE_DETAIL", df_low)]
+    return write_xlsx_sheets(path, sheets, ZONE_XLSX_STAT_CHARTS, progress)
+
+@PERF.traced("export")
+def write_xlsx_sheets(path: str, sheets, charts: Optional[dict] = None, progress=None) -> str:
+    """Ghi nhiều bảng ra xlsx, mỗi sheet ghi tuần tự từng chunk (xlsxwriter constant_memory,
+    fallback openpyxl write_only); bỏ qua bảng rỗng.
+
+    charts: {tên sheet: [(tiêu đề, màu), ...]} — biểu đồ cột gốc của Excel thứ k lấy cột k+2
+    theo nhãn cột 1, tham chiếu thẳng vào ô dữ liệu, không cần ảnh PNG."""
+    charts = charts or {}
+    sheets = [(name, df) for name, df in sheets if not df.empty]
+    total = sum(len(df) for _, df in sheets)
+    done = 0
+
+    try:
+        import xlsxwriter
+    except ImportError:
+        xlsxwriter = None
+
+    if xlsxwriter is not None:
+        wb = xlsxwriter.Workbook(path, {"constant_memory": True, "nan_inf_to_errors": True})
+        try:
+            for name, df in sheets:
+                ws = wb.add_worksheet(name)
+                ws.write_row(0, 0, [str(c) for c in df.columns])
+                r = 1
+                for start, chunk in _iter_chunks(df):
+                    for row in _xlsx_rows(chunk):
+                        ws.write_row(r, 0, row)
+                        r += 1
+                    done += len(chunk)
+                    if progress: progress(done, total)
+                n = len(df)
+                for k, (title, color) in enumerate(charts.get(name, [])):
+                    chart = wb.add_chart({"type": "column"})
+                    chart.add_series({
+                        "name": [name, 0, k + 1],
+                        "categories": [name, 1, 0, n, 0],
+                        "values": [name, 1, k + 1, n, k + 1],
+                        "fill": {"color": color},
+                        "data_labels": {"value": True},
+                    })
+                    chart.set_title({"name": title, "name_font": {"size": 11}})
+                    chart.set_legend({"none": True})
+                    chart.set_size({"width": 760, "height": 300})
+                    ws.insert_chart(1 + 16 * k, len(df.columns) + 1, chart)
+        finally:
+            wb.close()
+        return path
+
+    from openpyxl import Workbook
+    from openpyxl.chart import BarChart, Reference
+    from openpyxl.utils import get_column_letter
+    wb = Workbook(write_only=True)
+    for name, df in sheets:
+        ws = wb.create_sheet(name)
+        ws.append([str(c) for c in df.columns])
+        for start, chunk in _iter_chunks(df):
+            for row in _xlsx_rows(chunk):
+                ws.append(list(row))
+            done += len(chunk)
+            if progress: progress(done, total)
+        n = len(df)
+        for k, (title, color) in enumerate(charts.get(name, [])):
+            chart = BarChart()
+            chart.type = "col"
+            chart.title = title
+            chart.legend = None
+            chart.width, chart.height = 20, 8
+            chart.add_data(Reference(ws, min_col=k + 2, min_row=1, max_row=n + 1), titles_from_data=True)
+            chart.set_categories(Reference(ws, min_col=1, min_row=2, max_row=n + 1))
+            chart.series[0].graphicalProperties.solidFill = color.lstrip("#")
+            chart.anchor = f"{get_column_letter(len(df.columns) + 2)}{2 + 16 * k}"
+            ws.add_chart(chart)
+    wb.save(path)
+    return path
+
+# ==================== Static chart images ====================
+STATIC_IMAGE_CACHE_MAX = 64
+_STATIC_IMAGE_CACHE: Dict[str, bytes] = {}   # fingerprint -> ảnh (PNG)
+
+def figure_fingerprint(fig, **opts) -> str:
+    """Dấu vân tay của figure plotly (dữ liệu + layout + tham số xuất ảnh)."""
+    import hashlib
+    payload = fig.to_json() + json.dumps(opts, sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+def render_static_images(figs, width: int = 950, height: int = 340, scale: float = 2,
+                         fmt: str = "png") -> List[bytes]:
+    """Ảnh tĩnh cho nhiều figure plotly, chỉ gọi khi thật sự xuất file.
+
+    - Ảnh đã có trong cache (theo fingerprint) thì dùng lại.
+    - plotly ≥ 6.1 (kaleido ≥ 1): pio.write_images xuất cả lô trong 1 phiên trình duyệt.
+    - Bản cũ: kaleido giữ 1 tiến trình nền dùng chung, các figure xuất song song qua thread.
+    """
+    import plotly.io as pio
+    opts = dict(width=width, height=height, scale=scale, format=fmt)
+    keys = [figure_fingerprint(f, **opts) for f in figs]
+    todo = [i for i, k in enumerate(keys) if k not in _STATIC_IMAGE_CACHE]
+
+    if todo:
+        images = None
+        if hasattr(pio, "write_images"):
+            try:
+                with tempfile.TemporaryDirectory() as tmpdir:
+                    paths = [os.path.join(tmpdir, f"chart_{i}.{fmt}") for i in todo]
+                    pio.write_images([figs[i] for i in todo], paths, format=fmt,
+                                     width=width, height=height, scale=scale)
+                    images = [Path(p).read_bytes() for p in paths]
+            except Exception as e:
+                safe_print(f"[!] write_images lỗi, chuyển sang xuất từng ảnh: {e}")
+                images = None
+        if images is None:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=min(4, len(todo))) as pool:
+                images = list(pool.map(lambda i: pio.to_image(figs[i], format=fmt, width=width,
+                                                              height=height, scale=scale), todo))
+        for i, img in zip(todo, images):
+            _STATIC_IMAGE_CACHE[keys[i]] = img
+        while len(_STATIC_IMAGE_CACHE) > STATIC_IMAGE_CACHE_MAX:
+            _STATIC_IMAGE_CACHE.pop(next(iter(_STATIC_IMAGE_CACHE)))
+
+    return [_STATIC_IMAGE_CACHE[k] for k in keys]
+
+# ==================== Word tables ====================
+def _docx_cell_texts(col: pd.Series) -> pd.Series:
+    """Chuỗi hiển thị của cả cột 1 lần (số giữ dạng str(val) như trước, NaN -> rỗng), đã escape XML."""
+    if pd.api.types.is_numeric_dtype(col) and not pd.api.types.is_bool_dtype(col):
+        txt = col.astype(str).where(col.notna(), "")
+    else:
+        txt = col.map(lambda x: "" if x is None or (isinstance(x, float) and np.isnan(x)) else str(x))
+    return (txt.str.replace("&", "&amp;", regex=False)
+               .str.replace("<", "&lt;", regex=False)
+               .str.replace(">", "&gt;", regex=False))
+
+def docx_add_dataframe_table(doc, df: pd.DataFrame, style: str = "Table Grid"):
+    """Thêm bảng python-docx cho cả DataFrame: XML các dòng dựng 1 lượt theo cột
+    rồi parse 1 lần, thay cho add_row()/cell.text từng ô (chậm với hàng nghìn dòng)."""
+    from docx.oxml import parse_xml
+    from docx.oxml.ns import nsdecls
+
+    t = doc.add_table(rows=1, cols=len(df.columns), style=style)
+    for j, col in enumerate(df.columns):
+        t.cell(0, j).text = str(col)
+    if df.empty:
+        return t
+
+    cell_open = '<w:tc><w:p><w:r><w:t xml:space="preserve">'
+    cell_close = '</w:t></w:r></w:p></w:tc>'
+    rows = pd.Series("<w:tr>", index=df.index)
+    for c in df.columns:
+        rows = rows + cell_open + _docx_cell_texts(df[c]) + cell_close
+    body = parse_xml(f"<w:tbl {nsdecls('w')}>" + "</w:tr>".join(rows.tolist()) + "</w:tr></w:tbl>")
+    t._tbl.extend(list(body))
+    return t
+
+# ==================== HTML report ====================
+HTML_TABLE_PAGE_SIZES = (100, 500, 0)   # 0 = tất cả (vẫn cuộn ảo)
+HTML_TABLE_ROW_PX = 26
+
+def plotly_js_tag(inline: bool = False) -> str:
+    """Thẻ <script> nạp plotly.js đúng 1 lần, không cần mạng.
+    inline=False: chép plotly.min.js của gói plotly vào REPORT_CACHE_DIR (plotly-<phiên bản>.min.js)
+    rồi trỏ bằng đường dẫn tương đối -> chỉ dùng cho HTML nằm trong REPORT_CACHE_DIR (webview);
+    HTML cache không phụ thuộc nơi cài plotly, bản cũ vẫn trỏ đúng file js của phiên bản đã dựng nó.
+    inline=True (hoặc không chép được): nhúng toàn bộ thư viện để file HTML tự chứa."""
+    import plotly
+    if not inline:
+        name = f"plotly-{plotly.__version__}.min.js"
+        dst = os.path.join(REPORT_CACHE_DIR, name)
+        try:
+            if not os.path.exists(dst):
+                os.makedirs(REPORT_CACHE_DIR, exist_ok=True)
+                shutil.copyfile(Path(plotly.__file__).parent / "package_data" / "plotly.min.js", dst + ".tmp")
+                os.replace(dst + ".tmp", dst)
+            return f'<script src="{name}"></script>'
+        except OSError:
+            pass
+    from plotly.offline import get_plotlyjs
+    return f'<script type="text/javascript">{get_plotlyjs()}</script>'
+
+def json_table_html(df: pd.DataFrame, table_id: str, caption: str = "") -> str:
+    """Bảng chi tiết dạng JSON gọn (columns + data) + khung để JS dựng trang/cuộn ảo,
+    thay cho to_html toàn bộ bảng."""
+    if df.empty:
+        return "<i>Không có số liệu.</i>"
+    payload = df.to_json(orient="split", index=False, double_precision=3,
+                         date_format="iso", force_ascii=False)
+    payload = payload.replace("</", "<\\/")   # không để chuỗi dữ liệu đóng thẻ <script>
+    return (f"<div style='font-weight:bold;margin:8px 0'>{caption}</div>"
+            f"<div class='zr-table' id='{table_id}'></div>"
+            f"<script type='application/json' id='{table_id}-data'>{payload}</script>")
+
+HTML_TABLE_CSS = f"""
+    .zr-bar {{ margin:4px 0; font-size:14px; }}
+    .zr-bar button {{ padding:2px 10px; }}
+    .zr-scroll {{ max-height:480px; overflow-y:auto; border:1px solid #bbb; }}
+    .zr {{ table-layout:fixed; margin-bottom:0; }}
+    .zr thead th {{ position:sticky; top:0; }}
+    .zr td {{ height:{HTML_TABLE_ROW_PX}px; box-sizing:border-box; padding:0 8px;
+              white-space:nowrap; overflow:hidden; text-overflow:ellipsis; }}
+    .zr td.zr-pad {{ padding:0; border:0; }}
+"""
+
+# Trang hiện tại chỉ dựng các dòng đang nằm trong khung cuộn (+ đệm), phần còn lại là 2 dòng đệm cao tương ứng.
+HTML_TABLE_JS = """
+function zrTable(id) {
+  var el = document.getElementById(id);
+  var d = JSON.parse(document.getElementById(id + '-data').textContent);
+  var cols = d.columns, rows = d.data, RH = %(row_px)d, size = %(first_size)d, page = 0;
+  function esc(v) { return String(v).replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;'); }
+  function fmt(v) {
+    if (v === null || v === undefined) return '';
+    if (typeof v === 'number' && !Number.isInteger(v)) return v.toFixed(3);
+    return esc(v);
+  }
+  var opts = %(sizes)s.map(function (s) { return '<option value="' + s + '">' + (s ? s : 'Tất cả') + '</option>'; }).join('');
+  el.innerHTML = '<div class="zr-bar"><button data-a="-1">◀</button> <span class="zr-info"></span> '
+    + '<button data-a="1">▶</button> &nbsp;Số dòng/trang <select>' + opts + '</select></div>'
+    + '<div class="zr-scroll"><table class="table zr"><thead><tr>'
+    + cols.map(function (c) { return '<th>' + esc(c) + '</th>'; }).join('')
+    + '</tr></thead><tbody></tbody></table></div>';
+  var sc = el.querySelector('.zr-scroll'), tb = el.querySelector('tbody'), info = el.querySelector('.zr-info');
+  function pages() { return size ? Math.max(1, Math.ceil(rows.length / size)) : 1; }
+  function pad(h) { return '<tr><td class="zr-pad" colspan="' + cols.length + '" style="height:' + h + 'px"></td></tr>'; }
+  var queued = false;
+  function draw() {
+    queued = false;
+    var a = size ? page * size : 0, b = size ? Math.min(rows.length, a + size) : rows.length, n = b - a;
+    var first = Math.max(0, Math.floor(sc.scrollTop / RH) - 10);
+    var last = Math.min(n, first + Math.ceil((sc.clientHeight || 480) / RH) + 20);
+    var h = [pad(first * RH)];
+    for (var i = first; i < last; i++) {
+      h.push('<tr><td>' + rows[a + i].map(fmt).join('</td><td>') + '</td></tr>');
+    }
+    h.push(pad((n - last) * RH));
+    tb.innerHTML = h.join('');
+    info.textContent = 'Trang ' + (page + 1) + '/' + pages() + ' · dòng ' + (n ? a + 1 : 0) + '–' + b + ' / ' + rows.length;
+  }
+  function redraw() { if (!queued) { queued = true; requestAnimationFrame(draw); } }
+  sc.addEventListener('scroll', redraw);
+  el.querySelector('select').onchange = function () { size = +this.value; page = 0; sc.scrollTop = 0; draw(); };
+  el.querySelector('.zr-bar').onclick = function (e) {
+    var step = +e.target.getAttribute('data-a');
+    if (!step) return;
+    page = Math.min(pages() - 1, Math.max(0, page + step)); sc.scrollTop = 0; draw();
+  };
+  draw();
+}
+document.querySelectorAll('.zr-table').forEach(function (el) { zrTable(el.id); });
+""" % {"row_px": HTML_TABLE_ROW_PX, "first_size": HTML_TABLE_PAGE_SIZES[0],
+       "sizes": json.dumps(list(HTML_TABLE_PAGE_SIZES))}
+
+# ==================== Chart decimation ====================
+def minmax_decimate(x: np.ndarray, y: np.ndarray, n_buckets: int) -> np.ndarray:
+    """Chỉ số điểm cần vẽ: min + max của y trong mỗi bucket đều theo trục x
+    (x đã sắp tăng dần), luôn giữ điểm đầu/cuối -> không bao giờ mất đỉnh/đáy điện áp."""
+    n = len(x)
+    n_buckets = max(int(n_buckets), 1)
+    if n <= 4 * n_buckets:
+        return np.arange(n)
+    x0, x1 = float(x[0]), float(x[-1])
+    if x1 > x0:
+        bucket = np.minimum(((x - x0) * (n_buckets / (x1 - x0))).astype(np.int64), n_buckets - 1)
+    else:
+        bucket = np.arange(n, dtype=np.int64) * n_buckets // n
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    ends = np.r_[starts[1:], n]
+    order = np.lexsort((y, bucket))           # trong mỗi bucket: y tăng dần
+    keep = np.concatenate([[0], order[starts], order[ends - 1], [n - 1]])
+    return np.unique(keep)
+
+# ==================== Heatmap grid ====================
+HEATMAP_STATS = {"mean": "trung bình", "min": "nhỏ nhất", "max": "lớn nhất", "p95": "P95"}
+HEATMAP_PERIODS = {"D": "Ngày", "W": "Tuần", "M": "Tháng"}
+HEATMAP_MAX_DAY_COLS = 120     # quá số ngày này -> gộp theo tuần
+HEATMAP_MAX_WEEK_COLS = 156    # quá số tuần này -> gộp theo tháng
+
+def _heatmap_period_codes(days: np.ndarray, period: str):
+    """Mã cột nguyên (0..ncols-1) + nhãn cột cho từng ngày theo chu kỳ D/W/M."""
+    if period == "M":
+        raw = days.astype("datetime64[M]").astype(np.int64)
+    elif period == "W":
+        # 1970-01-01 là thứ Năm -> +3 để tuần bắt đầu từ thứ Hai
+        raw = (days.astype(np.int64) + 3) // 7
+    else:
+        raw = days.astype(np.int64)
+    lo = int(raw.min())
+    codes = raw - lo
+    ncols = int(codes.max()) + 1
+    starts = np.arange(lo, lo + ncols)
+    if period == "M":
+        labels = [str(m)[5:7] + "-" + str(m)[:4] for m in starts.astype("datetime64[M]")]
+    elif period == "W":
+        labels = [pd.Timestamp(d).strftime("%d-%m-%Y") for d in (starts * 7 - 3).astype("datetime64[D]")]
+    else:
+        labels = [pd.Timestamp(d).date() for d in starts.astype("datetime64[D]")]
+    return codes, ncols, labels
+
+def heatmap_grid(days, hours, values=None, stat: str = "mean", period: Optional[str] = None,
+                 sums=None, counts=None, mins=None, maxs=None):
+    """Lưới 24 giờ × (ngày|tuần|tháng) tính thẳng bằng mảng (bincount), không pivot_table.
+
+    - days: mảng datetime64 (cắt về ngày), hours: mảng giờ 0..23.
+    - Dữ liệu thô: truyền values (U từng dòng) -> hỗ trợ mean/min/max/p95.
+    - Dữ liệu đã gộp (cube): truyền sums/counts (+ mins/maxs) -> mean/min/max.
+    - period None: tự gộp theo tuần/tháng khi khoảng ngày dài.
+    Trả về (grid 24×ncols float với NaN cho ô trống, nhãn cột, period).
+    """
+    days = np.asarray(days).astype("datetime64[D]")
+    hours = np.asarray(hours, dtype=float)
+    ok = ~np.isnat(days) & np.isfinite(hours) & (hours >= 0) & (hours < 24)
+    if values is not None:
+        values = np.asarray(values, dtype=float)
+        ok &= np.isfinite(values)
+    else:
+        counts = np.asarray(counts, dtype=float)
+        ok &= counts > 0
+    if not ok.any():
+        return np.empty((24, 0)), [], period or "D"
+
+    days = days[ok]
+    hours = hours[ok].astype(np.int64)
+    if period is None:
+        span = int((days.max() - days.min()).astype(np.int64)) + 1
+        period = "D" if span <= HEATMAP_MAX_DAY_COLS else ("W" if span <= 7 * HEATMAP_MAX_WEEK_COLS else "M")
+    codes, ncols, labels = _heatmap_period_codes(days, period)
+    idx = hours * ncols + codes
+    size = 24 * ncols
+
+    if values is not None:
+        values = values[ok]
+        if stat == "mean":
+            s = np.bincount(idx, weights=values, minlength=size)
+            c = np.bincount(idx, minlength=size)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                flat = np.where(c > 0, s / np.maximum(c, 1), np.nan)
+        else:
+            # sắp theo (ô, U) 1 lần -> min/max/P95 của mỗi ô là vị trí trong nhóm;
+            # khóa = ô + U chuẩn hóa về [0, 1) -> 1 argsort số thực thay cho lexsort
+            span = float(values.max() - values.min())
+            order = np.argsort(idx + (values - values.min()) / (span * (1 + 1e-9) + 1e-12))
+            sidx, sval = idx[order], values[order]
+            starts = np.flatnonzero(np.r_[True, sidx[1:] != sidx[:-1]])
+            ends = np.r_[starts[1:], len(sidx)]
+            flat = np.full(size, np.nan)
+            if stat == "min":
+                flat[sidx[starts]] = sval[starts]
+            elif stat == "max":
+                flat[sidx[starts]] = sval[ends - 1]
+            else:
+                pos = starts + 0.95 * (ends - 1 - starts)
+                lo = np.floor(pos).astype(np.int64)
+                hi = np.minimum(lo + 1, ends - 1)
+                frac = pos - lo
+                flat[sidx[starts]] = sval[lo] + (sval[hi] - sval[lo]) * frac
+    else:
+        if stat == "mean":
+            s = np.bincount(idx, weights=np.asarray(sums, dtype=float)[ok], minlength=size)
+            c = np.bincount(idx, weights=counts[ok], minlength=size)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                flat = np.where(c > 0, s / np.maximum(c, 1), np.nan)
+        elif stat in ("min", "max"):
+            src = np.asarray(mins if stat == "min" else maxs, dtype=float)[ok]
+            flat = np.full(size, np.inf if stat == "min" else -np.inf)
+            (np.minimum if stat == "min" else np.maximum).at(flat, idx, src)
+            flat[~np.isfinite(flat)] = np.nan
+        else:
+            raise ValueError("P95 cần dữ liệu thô (values), cube chỉ có sum/count/min/max.")
+
+    return flat.reshape(24, ncols), labels, period
+
+# ==================== Voltage cube ====================
+REPORT_LOW_PCT = 95.0    # ngưỡng báo cáo Zone_Bx: U ≤ 95% Uđd
+REPORT_HIGH_PCT = 110.0  # ngưỡng báo cáo Zone_Bx: U ≥ 110% Uđd
+
+CUBE_DIMS = ["Zone_Bx", "station", "un_key", "day", "hour"]
+VIOLATION_CACHE_SIZE = 4   # số cặp ngưỡng giữ bảng vi phạm (xem App._get_violations)
+
+def detect_hour_column(df: pd.DataFrame) -> Optional[str]:
+    for c in df.columns:
+        if "giờ" in str(c).lower() or "hour" in str(c).lower():
+            return c
+    return None
+
+def build_timestamps(df: pd.DataFrame, dt_col: str) -> pd.Series:
+    """Ngày (dt_col) + cột giờ riêng nếu có -> datetime đầy đủ."""
+    dt = pd.to_datetime(df[dt_col], errors="coerce", dayfirst=True)
+    hour_col = detect_hour_column(df)
+    if hour_col:
+        hour_val = pd.to_numeric(df[hour_col], errors="coerce").fillna(0)
+        dt = dt + pd.to_timedelta(hour_val, unit="h")
+    return dt
+
+def classify_violations(v, un, low_pct: float = REPORT_LOW_PCT, high_pct: float = REPORT_HIGH_PCT) -> np.ndarray:
+    """Mã int8 mỗi dòng: -1 THẤP (U ≤ low%·Uđd), 1 CAO (U ≥ high%·Uđd), 0 bình thường/thiếu số.
+    So sánh dạng U ≥ k·Uđd (giống báo cáo gốc) để không lệch ở biên do làm tròn."""
+    v = np.asarray(v, dtype=float)
+    un = np.asarray(un, dtype=float)
+    with np.errstate(invalid="ignore"):
+        code = (v >= (high_pct / 100.0) * un).astype(np.int8)
+        code[v <= (low_pct / 100.0) * un] = -1
+    return code
+
+def build_voltage_cube(df: pd.DataFrame, station_col: str, vcol: str,
+                       un_col: Optional[str] = None, dt_col: Optional[str] = None,
+                       low_pct: float = REPORT_LOW_PCT, high_pct: float = REPORT_HIGH_PCT,
+                       dims: Optional[List[str]] = None,
+                       stats: bool = True, violations: bool = True) -> pd.DataFrame:
+    """Gộp df thành cube Zone_Bx × trạm × Uđd × ngày × giờ.
+
+    stats: mỗi ô giữ rows/count/sum/sumsq/min/max của U (không phụ thuộc ngưỡng).
+    violations: số lần THẤP/CAO (U ≤ low_pct%·Uđd / U ≥ high_pct%·Uđd, xem classify_violations)
+    kèm min/max U trong các lần vi phạm. Chỉ violations -> chỉ gộp các dòng vi phạm.
+    """
+    dims = list(dims or CUBE_DIMS)
+    v = pd.to_numeric(df[vcol], errors="coerce") if vcol in df.columns else pd.Series(np.nan, index=df.index)
+    un = (pd.to_numeric(df[un_col], errors="coerce") if un_col and un_col in df.columns
+          else pd.Series(np.nan, index=df.index))
+
+    code = classify_violations(v, un, low_pct, high_pct) if violations else None
+    if violations and not stats:
+        # chỉ đếm vi phạm: bỏ dòng bình thường trước khi tách ngày/giờ và gộp
+        hit = code != 0
+        df, v, un, code = df[hit], v[hit], un[hit], code[hit]
+    n = len(df)
+
+    un_key = df[un_col].astype(str) if un_col and un_col in df.columns else pd.Series("", index=df.index)
+    if dt_col and dt_col in df.columns:
+        day = pd.to_datetime(df[dt_col], errors="coerce", dayfirst=True).dt.normalize()
+        hour = build_timestamps(df, dt_col).dt.hour
+    else:
+        day = pd.Series(pd.NaT, index=df.index)
+        hour = pd.Series(np.nan, index=df.index)
+
+    frame = pd.DataFrame({
+        "Zone_Bx": df["Zone_Bx"] if "Zone_Bx" in df.columns else pd.Series(np.nan, index=df.index),
+        "station": df[station_col] if station_col in df.columns else pd.Series("", index=df.index),
+        "un_key": un_key,
+        "day": day,
+        "hour": hour,
+        "v": v,
+    })
+    aggs = {}
+    if stats:
+        frame["v2"] = v * v
+        aggs.update(rows=("v", "size"), count=("v", "count"), sum=("v", "sum"), sumsq=("v2", "sum"),
+                    min=("v", "min"), max=("v", "max"))
+    if violations:
+        lo, hi = code < 0, code > 0
+        frame = frame.assign(lo=lo.astype(np.int8), hi=hi.astype(np.int8),
+                             v_lo=v.where(lo), v_hi=v.where(hi))
+        aggs.update(n_low=("lo", "sum"), n_high=("hi", "sum"),
+                    low_min=("v_lo", "min"), low_max=("v_lo", "max"),
+                    high_min=("v_hi", "min"), high_max=("v_hi", "max"))
+    if n == 0:
+        return pd.DataFrame(columns=dims + list(aggs) + (["Un"] if "un_key" in dims else []))
+
+    cube = frame.groupby(dims, dropna=False, sort=False).agg(**aggs).reset_index()
+    if "un_key" in cube.columns:
+        cube["Un"] = pd.to_numeric(cube["un_key"], errors="coerce")
+    return cube
+
+def select_dims(t: pd.DataFrame, zones=None, stations=None, un_key=None,
+                day_from=None, day_to=None) -> pd.DataFrame:
+    """Lọc bảng gộp theo các chiều Zone_Bx/trạm/Uđd/ngày (bộ lọc view_df đã quy đổi)."""
+    m = np.ones(len(t), dtype=bool)
+    if stations is not None:
+        m &= t["station"].isin(list(stations)).to_numpy()
+    if un_key is not None:
+        m &= (t["un_key"] == un_key).to_numpy()
+    if day_from is not None:
+        m &= (t["day"] >= pd.Timestamp(day_from).normalize()).to_numpy()
+    if day_to is not None:
+        m &= (t["day"] <= pd.Timestamp(day_to).normalize()).to_numpy()
+    if zones:
+        m &= t["Zone_Bx"].isin(list(zones)).to_numpy()
+    return t[m] if not m.all() else t
+
+ZONE_HIGH_COLS = ["STT", "Zone_Bx", "TBA", "Udđ", "U(kV)", "U(kV)/Udđ", "Số lần Cao", "Umin", "Umax"]
+ZONE_LOW_COLS = ["STT", "Zone_Bx", "TBA", "Udđ", "U(kV)", "U(kV)/Udđ", "Số lần Thấp", "Umin", "Umax"]
+
+def zone_tables_from_groups(g: pd.DataFrame):
+    """Bảng chi tiết CAO/THẤP từ bảng gộp theo (Zone_Bx, station, Un) có
+    n_low/n_high/low_min/low_max/high_min/high_max. Luôn đủ cột kể cả khi rỗng."""
+    h = g[g["n_high"] > 0]
+    df_high = pd.DataFrame({
+        "STT": None, "Zone_Bx": h["Zone_Bx"], "TBA": h["station"], "Udđ": h["Un"],
+        "U(kV)": h["high_max"], "U(kV)/Udđ": (h["high_max"] / h["Un"]).round(3),
+        "Số lần Cao": h["n_high"].astype(int), "Umin": h["high_min"], "Umax": h["high_max"],
+    }, columns=ZONE_HIGH_COLS)
+    l = g[g["n_low"] > 0]
+    df_low = pd.DataFrame({
+        "STT": None, "Zone_Bx": l["Zone_Bx"], "TBA": l["station"], "Udđ": l["Un"],
+        "U(kV)": l["low_min"], "U(kV)/Udđ": (l["low_min"] / l["Un"]).round(3),
+        "Số lần Thấp": l["n_low"].astype(int), "Umin": l["low_min"], "Umax": l["low_max"],
+    }, columns=ZONE_LOW_COLS)
+    return df_high.reset_index(drop=True), df_low.reset_index(drop=True)
+
+def zone_summaries(df_high: pd.DataFrame, df_low: pd.DataFrame):
+    """(stat_high, stat_low): số TBA vi phạm + tổng số lần theo Zone_Bx."""
+    def _stat(df, num_col, label_sum):
+        if df.empty:
+            return pd.DataFrame(columns=["Zone_Bx", "Số TBA vi phạm", label_sum])
+        return df.groupby("Zone_Bx").agg(
+            **{"Số TBA vi phạm": ("TBA", "nunique"), label_sum: (num_col, "sum")}
+        ).reset_index()
+    return (_stat(df_high, "Số lần Cao", "Tổng số lần Cao"),
+            _stat(df_low, "Số lần Thấp", "Tổng số lần Thấp"))
+
+def violation_tables(df: pd.DataFrame, station_col: str, vcol: str, un_col: str,
+                     low_pct: float = REPORT_LOW_PCT, high_pct: float = REPORT_HIGH_PCT):
+    """Bảng chi tiết CAO/THẤP trên dữ liệu thô trong 1 lượt vector hóa:
+    phân loại từng dòng thành mã int8 rồi 1 lần groupby (Zone_Bx, TBA, Uđd) trên các dòng vi phạm."""
+    v = pd.to_numeric(df[vcol], errors="coerce").to_numpy(dtype=float)
+    un = pd.to_numeric(df[un_col], errors="coerce").to_numpy(dtype=float)
+    code = classify_violations(v, un, low_pct, high_pct)
+    hit = code != 0
+    zone = df["Zone_Bx"].to_numpy()[hit] if "Zone_Bx" in df.columns else "(Chưa có Zone)"
+    vh, ch = v[hit], code[hit]
+    is_lo, is_hi = ch < 0, ch > 0
+    frame = pd.DataFrame({
+        "Zone_Bx": zone, "station": df[station_col].to_numpy()[hit], "Un": un[hit],
+        "n_low": is_lo.astype(np.int64), "n_high": is_hi.astype(np.int64),
+        "v_lo": np.where(is_lo, vh, np.nan), "v_hi": np.where(is_hi, vh, np.nan),
+    })
+    g = frame.groupby(["Zone_Bx", "station", "Un"], sort=True).agg(
+        n_low=("n_low", "sum"), n_high=("n_high", "sum"),
+        low_min=("v_lo", "min"), low_max=("v_lo", "max"),
+        high_min=("v_hi", "min"), high_max=("v_hi", "max"),
+    ).reset_index()
+    return zone_tables_from_groups(g)
+
+class VoltageCube:
+    """Cube thống kê U (rows/count/sum/sumsq/min/max) dựng 1 lần / dataset, không phụ thuộc ngưỡng.
+    Trả lời KPI, heatmap, phân phối cho mọi bộ lọc ánh xạ được vào các chiều của cube.
+    Số lần vi phạm theo ngưỡng: bảng riêng từ violations() (chỉ gồm các dòng vi phạm)."""
+
+    def __init__(self, table: pd.DataFrame, vcol: str):
+        self.table = table
+        self.vcol = vcol
+        self.stations = table["station"].dropna().astype(str).unique().tolist() if "station" in table else []
+
+    @classmethod
+    def build(cls, df, station_col, vcol, un_col=None, dt_col=None):
+        return cls(build_voltage_cube(df, station_col, vcol, un_col, dt_col, violations=False), vcol)
+
+    @staticmethod
+    def violations(df, station_col, vcol, un_col=None, dt_col=None,
+                   low_pct=REPORT_LOW_PCT, high_pct=REPORT_HIGH_PCT) -> pd.DataFrame:
+        """Bảng vi phạm cùng chiều với cube (n_low/n_high + min/max U khi vi phạm) cho 1 cặp ngưỡng;
+        lọc bằng select_dims, đọc bằng zone_violation_counts / zone_report_tables."""
+        return build_voltage_cube(df, station_col, vcol, un_col, dt_col, low_pct, high_pct, stats=False)
+
+    def select(self, zones=None, stations=None, un_key=None, day_from=None, day_to=None) -> pd.DataFrame:
+        return select_dims(self.table, zones, stations, un_key, day_from, day_to)
+
+    @staticmethod
+    def kpis(sub: pd.DataFrame) -> dict:
+        cnt = float(sub["count"].sum()) if not sub.empty else 0.0
+        return {
+            "rows": int(sub["rows"].sum()) if not sub.empty else 0,
+            "tba": int(sub["station"].nunique()) if not sub.empty else 0,
+            "umin": float(sub["min"].min()) if cnt else np.nan,
+            "utb": float(sub["sum"].sum() / cnt) if cnt else np.nan,
+            "umax": float(sub["max"].max()) if cnt else np.nan,
+        }
+
+    @staticmethod
+    def day_hour_grid(sub: pd.DataFrame, stat: str = "mean", period: Optional[str] = None):
+        """Lưới U 24 giờ × ngày/tuần/tháng từ cube (mean/min/max), xem heatmap_grid."""
+        return heatmap_grid(pd.to_datetime(sub["day"]).to_numpy(),
+                            pd.to_numeric(sub["hour"], errors="coerce").to_numpy(),
+                            stat=stat, period=period,
+                            sums=sub["sum"].to_numpy(), counts=sub["count"].to_numpy(),
+                            mins=sub["min"].to_numpy(), maxs=sub["max"].to_numpy())
+
+    @staticmethod
+    def zone_violation_counts(sub: pd.DataFrame):
+        """(low_tba, low_times, high_tba, high_times) theo Zone_Bx."""
+        ok = sub.dropna(subset=["Zone_Bx"])
+        per_st = ok.groupby(["Zone_Bx", "station"])[["n_low", "n_high"]].sum()
+        low_tba = (per_st["n_low"] > 0).groupby(level=0).sum().astype("int64")
+        high_tba = (per_st["n_high"] > 0).groupby(level=0).sum().astype("int64")
+        low_times = per_st["n_low"].groupby(level=0).sum().astype("int64")
+        high_times = per_st["n_high"].groupby(level=0).sum().astype("int64")
+        return low_tba[low_tba > 0], low_times[low_times > 0], high_tba[high_tba > 0], high_times[high_times > 0]
+
+    @staticmethod
+    def zone_report_tables(sub: pd.DataFrame):
+        """Bảng chi tiết CAO/THẤP theo (Zone_Bx, TBA, Uđd) như báo cáo Zone_Bx."""
+        ok = sub.dropna(subset=["Zone_Bx", "Un"])
+        g = ok.groupby(["Zone_Bx", "station", "Un"]).agg(
+            n_low=("n_low", "sum"), n_high=("n_high", "sum"),
+            low_min=("low_min", "min"), low_max=("low_max", "max"),
+            high_min=("high_min", "min"), high_max=("high_max", "max"),
+        ).reset_index()
+        return zone_tables_from_groups(g)
+
+# ==================== Threshold sweep ====================
+SWEEP_LOW_RANGE = (85.0, 100.0)     # % Uđd quét cho phía THẤP
+SWEEP_HIGH_RANGE = (100.0, 120.0)   # % Uđd quét cho phía CAO
+SWEEP_STEP = 0.5
+
+class ThresholdSweep:
+    """Đếm vi phạm cho MỌI ngưỡng bằng tìm kiếm nhị phân.
+
+    Dòng được chia đoạn theo (trạm, Uđd), trong mỗi đoạn U sắp tăng dần. Số lần
+    U ≤ k·Uđd (THẤP) hoặc U ≥ k·Uđd (CAO) của 1 đoạn là 1 phép searchsorted trên
+    chính đoạn đó — cùng phép so sánh với classify_violations nên khớp báo cáo
+    tới từng dòng; cả đường cong chỉ tốn (số đoạn)×(số ngưỡng) phép tìm nhị phân.
+    Như báo cáo, chỉ tính dòng đã gắn Zone_Bx và có đủ U, Uđd, TBA.
+    """
+
+    def __init__(self, values, starts, ends, seg_un, seg_station, stations, zones):
+        self._values = values            # U, tăng dần trong từng đoạn
+        self._starts = starts            # đoạn i = values[starts[i]:ends[i]]
+        self._ends = ends
+        self._seg_un = seg_un            # Uđd của đoạn
+        self._seg_station = seg_station  # code trạm của đoạn
+        self.stations = stations         # ndarray tên trạm (theo code)
+        self.zones = zones               # ndarray Zone_Bx của trạm (theo code)
+
+    @classmethod
+    def build(cls, df: pd.DataFrame, station_col: str, vcol: str, un_col: str) -> "ThresholdSweep":
+        v = pd.to_numeric(df[vcol], errors="coerce").to_numpy(dtype=float)
+        un = pd.to_numeric(df[un_col], errors="coerce").to_numpy(dtype=float)
+        st = df[station_col]
+        ok = np.isfinite(v) & np.isfinite(un) & st.notna().to_numpy()
+        if "Zone_Bx" in df.columns:
+            ok &= df["Zone_Bx"].notna().to_numpy()
+        v, un = v[ok], un[ok]
+        codes, stations = pd.factorize(st[ok], sort=True)
+        zone_src = df["Zone_Bx"][ok] if "Zone_Bx" in df.columns else pd.Series(np.nan, index=st[ok].index)
+        zones = (pd.Series(zone_src.to_numpy()).groupby(codes).first()
+                 .reindex(range(len(stations))).to_numpy(dtype=object))
+        order = np.lexsort((v, un, codes))
+        v, un, codes = v[order], un[order], codes[order]
+        new_seg = np.ones(v.size, dtype=bool)
+        new_seg[1:] = (codes[1:] != codes[:-1]) | (un[1:] != un[:-1])
+        starts = np.flatnonzero(new_seg)
+        ends = np.append(starts[1:], v.size).astype(np.int64)
+        return cls(v, starts, ends, un[starts], codes[starts],
+                   np.asarray(stations, dtype=object), zones)
+
+    def station_counts(self, thresholds, side: str = "low") -> np.ndarray:
+        """Ma trận (số trạm × số ngưỡng): số lần vi phạm của từng trạm tại từng ngưỡng (%)."""
+        t = np.atleast_1d(np.asarray(thresholds, dtype=float))
+        out = np.zeros((len(self.stations), t.size), dtype=np.int64)
+        for s, e, un, code in zip(self._starts, self._ends, self._seg_un, self._seg_station):
+            seg = self._values[s:e]
+            bound = (t / 100.0) * un         # giống classify_violations: U so với k·Uđd
+            if side == "low":
+                out[code] += np.searchsorted(seg, bound, side="right")
+            else:
+                out[code] += seg.size - np.searchsorted(seg, bound, side="left")
+        return out
+
+    def curve(self, thresholds, side: str = "low"):
+        """(số lần vi phạm, số TBA vi phạm) cho từng ngưỡng."""
+        m = self.station_counts(thresholds, side)
+        return m.sum(axis=0), (m > 0).sum(axis=0)
+
+    def zone_curves(self, thresholds, side: str = "low") -> pd.DataFrame:
+        """Số TBA vi phạm theo Zone_Bx (dòng) × ngưỡng (cột)."""
+        t = np.atleast_1d(np.asarray(thresholds, dtype=float))
+        m = self.station_counts(t, side) > 0
+        zone = pd.Series(self.zones).fillna("(Chưa có Zone)").astype(str).to_numpy()
+        return pd.DataFrame(m.astype(np.int64), columns=t).groupby(zone).sum()
+
+def check_sweep_consistency(df: pd.DataFrame, station_col: str, vcol: str, un_col: str,
+                            low_pct: float = REPORT_LOW_PCT, high_pct: float = REPORT_HIGH_PCT) -> List[str]:
+    """So tổng số lần vi phạm của ThresholdSweep tại ngưỡng báo cáo với violation_tables.
+    Trả về danh sách sai lệch (rỗng = khớp)."""
+    sweep = ThresholdSweep.build(df, station_col, vcol, un_col)
+    df_high, df_low = violation_tables(df, station_col, vcol, un_col, low_pct, high_pct)
+    errors = []
+    for side, pct, table, col in (("low", low_pct, df_low, "Số lần Thấp"),
+                                  ("high", high_pct, df_high, "Số lần Cao")):
+        got = int(sweep.curve([pct], side)[0][0])
+        want = int(pd.to_numeric(table[col], errors="coerce").sum()) if col in table.columns else 0
+        if got != want:
+            errors.append(f"{side} {pct:g}%: Độ nhạy {got:,} ≠ báo cáo {want:,}")
+    return errors
+
+# ==================== Sketches & per-file summaries ====================
+class QuantileSketch:
+    """Sketch phân vị gộp được (kiểu DDSketch): bucket theo log, sai số tương đối ≤ alpha.
+    Lưu dạng dict thuần (to_dict/from_dict) để pickle ổn định giữa các phiên bản tool."""
+
+    def __init__(self, alpha: float = 0.001):
+        self.alpha = float(alpha)
+        self.gamma = (1 + self.alpha) / (1 - self.alpha)
+        self._log_gamma = float(np.log(self.gamma))
+        self.bins: Dict[int, int] = {}
+        self.zero = 0               # giá trị ≤ 0
+        self.count = 0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def add(self, values) -> "QuantileSketch":
+        v = np.asarray(values, dtype=float)
+        v = v[np.isfinite(v)]
+        if v.size == 0:
+            return self
+        self.count += int(v.size)
+        self.min = min(self.min, float(v.min()))
+        self.max = max(self.max, float(v.max()))
+        pos = v[v > 0]
+        self.zero += int(v.size - pos.size)
+        if pos.size:
+            keys, counts = np.unique(self.bucket_keys(pos), return_counts=True)
+            for k, c in zip(keys.tolist(), counts.tolist()):
+                self.bins[k] = self.bins.get(k, 0) + c
+        return self
+
+    def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+        if other.alpha != self.alpha:
+            raise ValueError("Không gộp được sketch khác alpha.")
+        for k, c in other.bins.items():
+            self.bins[k] = self.bins.get(k, 0) + c
+        self.zero += other.zero
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    @classmethod
+    def from_counts(cls, keys, counts, zero: int = 0, vmin: float = np.inf, vmax: float = -np.inf,
+                    alpha: float = 0.001) -> "QuantileSketch":
+        """Sketch từ bảng (key bucket, số lần) đã gộp sẵn, vd. DistSketches.merged()."""
+        sk = cls(alpha)
+        sk.bins = dict(zip(np.asarray(keys, dtype=np.int64).tolist(), np.asarray(counts, dtype=np.int64).tolist()))
+        sk.zero = int(zero)
+        sk.count = int(sum(sk.bins.values())) + sk.zero
+        sk.min, sk.max = float(vmin), float(vmax)
+        return sk
+
+    def bucket_keys(self, values: np.ndarray) -> np.ndarray:
+        """Key bucket của từng giá trị dương (cùng công thức với add())."""
+        return np.ceil(np.log(values) / self._log_gamma).astype(np.int64)
+
+    def _centers(self):
+        keys = np.array(sorted(self.bins), dtype=np.int64)
+        counts = np.array([self.bins[k] for k in keys.tolist()], dtype=np.int64)
+        centers = 2.0 * np.power(self.gamma, keys.astype(float)) / (self.gamma + 1.0)
+        return centers, counts
+
+    def quantiles(self, qs) -> np.ndarray:
+        qs = np.atleast_1d(np.asarray(qs, dtype=float))
+        if self.count == 0:
+            return np.full(qs.shape, np.nan)
+        centers, counts = self._centers()
+        vals = np.concatenate([[min(self.min, 0.0)] if self.zero else [], centers])
+        cum = np.cumsum(np.concatenate([[self.zero] if self.zero else [], counts]))
+        ranks = qs * (self.count - 1)
+        idx = np.searchsorted(cum, ranks, side="right")
+        out = vals[np.minimum(idx, len(vals) - 1)]
+        return np.clip(out, self.min, self.max)
+
+    def quantile(self, q: float) -> float:
+        return float(self.quantiles([q])[0])
+
+    def histogram(self, bins: int = 30, value_range=None):
+        """(counts, edges) xấp xỉ: số lần mỗi bucket rải đều trong khoảng [γ^(k-1), γ^k]
+        của nó rồi chia theo các bin (CDF tuyến tính từng đoạn)."""
+        if value_range is None:
+            value_range = (self.min, self.max) if self.count else (0.0, 1.0)
+        lo_r, hi_r = float(value_range[0]), float(value_range[1])
+        if not hi_r > lo_r:
+            hi_r = lo_r + 1.0
+        edges = np.linspace(lo_r, hi_r, int(bins) + 1)
+        keys = np.array(sorted(self.bins), dtype=np.int64)
+        counts = np.array([self.bins[k] for k in keys.tolist()], dtype=float)
+        # biên bucket, kẹp trong [min, max] thật của dữ liệu
+        b_hi = np.clip(np.power(self.gamma, keys.astype(float)), self.min, self.max)
+        b_lo = np.clip(np.power(self.gamma, keys.astype(float) - 1.0), self.min, self.max)
+        out = np.zeros(int(bins))
+        if keys.size:
+            cum = np.cumsum(counts)
+            xs = np.column_stack([b_lo, b_hi]).ravel()
+            ys = np.column_stack([cum - counts, cum]).ravel()
+            out += np.diff(np.interp(edges, xs, ys, left=0.0, right=float(cum[-1])))
+        if self.zero:
+            # giá trị ≤ 0: dồn vào 1 điểm (0, kẹp trong khoảng vẽ)
+            out += np.histogram([min(max(0.0, lo_r), hi_r)], bins=edges, weights=[float(self.zero)])[0]
+        return out, edges
+
+    def box_stats(self, mean: Optional[float] = None, whis: float = 1.5) -> dict:
+        """Thống kê box-whisker (dạng matplotlib bxp) từ sketch, sai số tương đối ≤ alpha.
+        Outlier = tâm các bucket nằm ngoài râu (mỗi bucket 1 điểm)."""
+        q1, med, q3 = self.quantiles([0.25, 0.5, 0.75])
+        iqr = q3 - q1
+        centers, _ = self._centers()
+        vals = np.clip(np.concatenate([[min(self.min, 0.0)] if self.zero else [], centers]), self.min, self.max)
+        vals = np.unique(np.concatenate([vals, [self.min, self.max]]))
+        inside = vals[(vals >= q1 - whis * iqr) & (vals <= q3 + whis * iqr)]
+        whislo = float(inside.min()) if inside.size else float(q1)
+        whishi = float(inside.max()) if inside.size else float(q3)
+        return {"med": float(med), "q1": float(q1), "q3": float(q3),
+                "whislo": min(whislo, float(q1)), "whishi": max(whishi, float(q3)),
+                "fliers": vals[(vals < whislo) | (vals > whishi)],
+                "mean": float(mean) if mean is not None else float(med)}
+
+    def to_dict(self) -> dict:
+        return {"alpha": self.alpha, "keys": list(self.bins), "counts": list(self.bins.values()),
+                "zero": self.zero, "count": self.count, "min": self.min, "max": self.max}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "QuantileSketch":
+        sk = cls(d["alpha"])
+        sk.bins = dict(zip(d["keys"], d["counts"]))
+        sk.zero, sk.count, sk.min, sk.max = d["zero"], d["count"], d["min"], d["max"]
+        return sk
+
+SKETCH_DIMS = ["Zone_Bx", "station", "un_key", "day"]
+SKETCH_ZERO_KEY = np.iinfo(np.int64).min    # bucket cho U ≤ 0
+
+class DistSketches:
+    """Sketch phân vị U theo Zone_Bx × trạm × Uđd × ngày, lưu dạng bảng (chiều, key, n).
+
+    Dựng 1 lần / dataset; mọi bộ lọc quy về được các chiều này được trả lời bằng
+    cách cộng số lần theo key bucket (không đụng dữ liệu thô), ra QuantileSketch
+    dùng cho histogram + box-whisker.
+    """
+
+    def __init__(self, table: pd.DataFrame, alpha: float = 0.001):
+        self.table = table
+        self.alpha = float(alpha)
+
+    @classmethod
+    def build(cls, df, station_col, vcol, un_col=None, dt_col=None, alpha: float = 0.001) -> "DistSketches":
+        v = pd.to_numeric(df[vcol], errors="coerce").to_numpy(dtype=float)
+        ok = np.isfinite(v)
+        keys = np.full(len(v), SKETCH_ZERO_KEY, dtype=np.int64)
+        pos = ok & (v > 0)
+        keys[pos] = QuantileSketch(alpha).bucket_keys(v[pos])
+        if dt_col and dt_col in df.columns:
+            day = pd.to_datetime(df[dt_col], errors="coerce", dayfirst=True).dt.normalize()
+        else:
+            day = pd.Series(pd.NaT, index=df.index)
+        frame = pd.DataFrame({
+            "Zone_Bx": df["Zone_Bx"] if "Zone_Bx" in df.columns else pd.Series(np.nan, index=df.index),
+            "station": df[station_col] if station_col in df.columns else pd.Series("", index=df.index),
+            "un_key": df[un_col].astype(str) if un_col and un_col in df.columns else pd.Series("", index=df.index),
+            "day": day,
+            "key": keys,
+        })[ok]
+        table = frame.groupby(SKETCH_DIMS + ["key"], dropna=False, sort=False).size().rename("n").reset_index()
+        return cls(table, alpha)
+
+    def select(self, zones=None, stations=None, un_key=None, day_from=None, day_to=None) -> pd.DataFrame:
+        return select_dims(self.table, zones, stations, un_key, day_from, day_to)
+
+    def merged(self, sub: pd.DataFrame, vmin: float = np.inf, vmax: float = -np.inf) -> QuantileSketch:
+        """Gộp các dòng đã chọn thành 1 QuantileSketch (min/max chính xác lấy từ cube)."""
+        per_key = sub.groupby("key", sort=False)["n"].sum()
+        zero = int(per_key.pop(SKETCH_ZERO_KEY)) if SKETCH_ZERO_KEY in per_key.index else 0
+        return QuantileSketch.from_counts(per_key.index.to_numpy(), per_key.to_numpy(),
+                                          zero, vmin, vmax, self.alpha)
+
+SUMMARY_VERSION = 2
+SUMMARY_SUFFIX = ".dasum.pkl"
+SUMMARY_DIMS = ["Zone_Bx", "station", "un_key", "day"]   # cube không có chiều giờ
+
+def _file_signature(path: str) -> Optional[tuple]:
+    try:
+        st = os.stat(path)
+        return (int(st.st_size), int(st.st_mtime))
+    except OSError:
+        return None
+
+def summary_paths(src_path: str) -> List[str]:
+    """Ứng viên lưu summary: cạnh file nguồn, sau đó thư mục dự phòng trong home."""
+    import hashlib
+    key = hashlib.sha1(os.path.abspath(src_path).encode("utf-8")).hexdigest()[:16]
+    fallback = os.path.join(SUMMARY_DIR, f"{Path(src_path).stem}_{key}{SUMMARY_SUFFIX}")
+    return [src_path + SUMMARY_SUFFIX, fallback]
+
+def summarize_frame(df: pd.DataFrame, station_col: str, vcol: str,
+                    un_col: Optional[str], dt_col: Optional[str]) -> dict:
+    """Summary gộp được của 1 file: cube theo trạm/Uđd/ngày (ngưỡng báo cáo)
+    + sketch phân vị U theo (trạm, Uđd)."""
+    agg = build_voltage_cube(df, station_col, vcol, un_col, dt_col,
+                             REPORT_LOW_PCT, REPORT_HIGH_PCT, dims=SUMMARY_DIMS)
+    sketches = {}
+    v = pd.to_numeric(df[vcol], errors="coerce")
+    un_key = df[un_col].astype(str) if un_col and un_col in df.columns else pd.Series("", index=df.index)
+    for (st, uk), idx in pd.DataFrame({"s": df[station_col], "u": un_key}).groupby(["s", "u"]).groups.items():
+        sketches[(st, uk)] = QuantileSketch().add(v.loc[idx].to_numpy()).to_dict()
+    return {"version": SUMMARY_VERSION, "agg": agg, "sketches": sketches, "vcol": vcol,
+            "low_pct": REPORT_LOW_PCT, "high_pct": REPORT_HIGH_PCT}
+
+def write_file_summary(src_path: str, summary: dict, db_sig=None) -> Optional[str]:
+    import pickle
+    summary = dict(summary, source=os.path.abspath(src_path),
+                   source_sig=_file_signature(src_path), db_sig=db_sig)
+    for out in summary_paths(src_path):
+        try:
+            os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+            tmp = out + ".tmp"
+            with open(tmp, "wb") as f:
+                pickle.dump(summary, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, out)
+            return out
+        except OSError:
+            continue
+    return None
+
+def read_file_summary(src_path: str, db_sig=None) -> Optional[dict]:
+    """Summary còn hợp lệ (cùng version, file nguồn và DB chưa đổi) hoặc None."""
+    import pickle
+    sig = _file_signature(src_path)
+    for p in summary_paths(src_path):
+        if not os.path.exists(p):
+            continue
+        try:
+            with open(p, "rb") as f:
+                s = pickle.load(f)
+        except Exception:
+            continue
+        if s.get("version") == SUMMARY_VERSION and s.get("source_sig") == (tuple(sig) if sig else None) \
+                and s.get("db_sig") == db_sig:
+            return s
+    return None
+
+def merge_summaries(summaries: List[dict]):
+    """Gộp nhiều summary -> (agg, sketches) mà không cần dữ liệu thô."""
+    aggs = [s["agg"] for s in summaries if s is not None and not s["agg"].empty]
+    if not aggs:
+        return pd.DataFrame(), {}
+    allc = pd.concat(aggs, ignore_index=True, sort=False)
+    agg = allc.groupby(SUMMARY_DIMS, dropna=False, sort=False).agg(
+        rows=("rows", "sum"), count=("count", "sum"), sum=("sum", "sum"), sumsq=("sumsq", "sum"),
+        min=("min", "min"), max=("max", "max"), n_low=("n_low", "sum"), n_high=("n_high", "sum"),
+        low_min=("low_min", "min"), low_max=("low_max", "max"),
+        high_min=("high_min", "min"), high_max=("high_max", "max"),
+    ).reset_index()
+    agg["Un"] = pd.to_numeric(agg["un_key"], errors="coerce")
+
+    sketches: Dict[tuple, QuantileSketch] = {}
+    for s in summaries:
+        if s is None:
+            continue
+        for k, d in s["sketches"].items():
+            sk = QuantileSketch.from_dict(d)
+            if k in sketches:
+                sketches[k].merge(sk)
+            else:
+                sketches[k] = sk
+    return agg, sketches
+
+def load_and_map(paths: List[str], db_path: Optional[str] = None, log=safe_print) -> pd.DataFrame:
+    """Đọc các file Excel + gắn Zone_Bx (dùng chung cho GUI và chế độ không giao diện)."""
+    df = combine_from_paths(list(paths))
+    if df.empty:
+        return df
+    try:
+        df = attach_zone_bx(df, db_path or get_db_path(), log=log)
+    except Exception as e:
+        log(f"⚠️ Lỗi khi gắn Zone_Bx: {e}")
+    return df
+
+def ensure_file_summaries(paths: List[str], db_path: Optional[str] = None, log=safe_print) -> List[dict]:
+    """Summary cho từng file; file chưa có (hoặc đã cũ) thì đọc thô 1 lần rồi lưu lại."""
+    db_sig = _file_signature(db_path or get_db_path())
+    out = []
+    for p in paths:
+        s = read_file_summary(p, db_sig)
+        if s is None:
+            log(f"⏳ Tạo summary cho {os.path.basename(p)}...")
+            df = load_and_map([p], db_path, log=log)
+            vcol = pick_voltage_col(df) if not df.empty else None
+            st_col = detect_station_column(df) if not df.empty else None
+            if not vcol or not st_col:
+                log(f"⚠️ Bỏ qua {os.path.basename(p)}: thiếu cột U/TBA.")
+                continue
+            s = summarize_frame(df, st_col, vcol, pick_nominal_col(df), detect_datetime_column(df))
+            write_file_summary(p, s, db_sig)
+        out.append(s)
+    return out
+
+# ==================== Period comparison ====================
+COMPARE_METRICS = {
+    "n_high": "Số lần Cao", "n_low": "Số lần Thấp",
+    "days_high": "Số ngày Cao", "days_low": "Số ngày Thấp",
+    "umin": "Umin", "umax": "Umax",
+}
+COMPARE_COUNT_METRICS = ["n_high", "n_low", "days_high", "days_low"]
+COMPARE_ZONE_KEYS = ["Zone_Bx"]
+COMPARE_STATION_KEYS = ["Zone_Bx", "station", "un_key"]
+
+def compare_periods(agg: pd.DataFrame, keys: List[str], freq: str = "M") -> pd.DataFrame:
+    """So sánh các kỳ (mặc định theo tháng) từ bảng gộp theo ngày (summary / cube).
+
+    Mỗi dòng = khóa (keys) × Kỳ: số lần & số ngày vi phạm CAO/THẤP, Umin/Umax,
+    kèm cột Δ so với kỳ liền trước. Khóa vắng mặt ở 1 kỳ được tính 0 lần / 0 ngày.
+    """
+    names = {"station": "TBA", "un_key": "Udđ", "period": "Kỳ"}
+    cols = [names.get(k, k) for k in keys] + ["Kỳ"] + list(COMPARE_METRICS.values()) \
+        + [f"Δ {COMPARE_METRICS[m]}" for m in COMPARE_METRICS]
+    t = agg[agg["day"].notna()] if "day" in agg.columns else agg.head(0)
+    if t.empty:
+        return pd.DataFrame(columns=cols)
+    t = t.assign(period=t["day"].dt.to_period(freq).astype(str),
+                 Zone_Bx=t["Zone_Bx"].fillna("(Chưa có Zone)"))
+
+    # theo ngày trước để đếm số ngày có vi phạm (không cộng trùng giữa các trạm trong 1 zone)
+    daily = t.groupby(keys + ["period", "day"], sort=False).agg(
+        n_high=("n_high", "sum"), n_low=("n_low", "sum"), umin=("min", "min"), umax=("max", "max"))
+    daily["days_high"] = (daily["n_high"] > 0).astype(np.int64)
+    daily["days_low"] = (daily["n_low"] > 0).astype(np.int64)
+    g = daily.groupby(level=keys + ["period"]).agg(
+        n_high=("n_high", "sum"), n_low=("n_low", "sum"),
+        days_high=("days_high", "sum"), days_low=("days_low", "sum"),
+        umin=("umin", "min"), umax=("umax", "max"))
+
+    periods = sorted(t["period"].unique())
+    key_idx = g.index.droplevel("period").unique()
+    full = pd.MultiIndex.from_tuples(
+        [(k if isinstance(k, tuple) else (k,)) + (p,) for k in key_idx for p in periods],
+        names=keys + ["period"])
+    g = g.reindex(full)
+    g[COMPARE_COUNT_METRICS] = g[COMPARE_COUNT_METRICS].fillna(0).astype(np.int64)
+    g = g.sort_index()
+
+    delta = g.groupby(level=keys)[list(COMPARE_METRICS)].diff()
+    delta[COMPARE_COUNT_METRICS] = delta[COMPARE_COUNT_METRICS].astype("Int64")
+    out = pd.concat([g[list(COMPARE_METRICS)].rename(columns=COMPARE_METRICS),
+                     delta.rename(columns={m: f"Δ {l}" for m, l in COMPARE_METRICS.items()})], axis=1)
+    return out.reset_index().rename(columns=names)[cols]
+
+def comparison_tables(agg: pd.DataFrame, freq: str = "M"):
+    """(bảng so sánh theo Zone_Bx, bảng so sánh theo TBA) giữa các kỳ."""
+    return compare_periods(agg, COMPARE_ZONE_KEYS, freq), compare_periods(agg, COMPARE_STATION_KEYS, freq)
+
+# ==================== Zone report ====================
+def report_period_label(date_from=None, date_to=None):
+    """(time_label hiển thị 'dd/mm/YYYY - dd/mm/YYYY', file_time dùng đặt tên file)."""
+    def _format_date(d):
+        try:
+            return pd.to_datetime(d).strftime("%d/%m/%Y")
+        except Exception:
+            return str(d)
+    if date_from and date_to:
+        time_label = f"{_format_date(date_from)} - {_format_date(date_to)}"
+        file_time = f"{pd.to_datetime(date_from).strftime('%Y-%m-%d')}_{pd.to_datetime(date_to).strftime('%Y-%m-%d')}"
+    else:
+        time_label = ""
+        file_time = pd.Timestamp.today().strftime("%Y-%m-%d")
+    return time_label, file_time
+
+@PERF.traced("filter")
+def apply_view_filters(df: pd.DataFrame, station_text: str = "", unom=None, date_from=None, date_to=None,
+                       low_pct: Optional[float] = None, high_pct: Optional[float] = None, zones=None,
+                       nominal_col: Optional[str] = None, dt_col: Optional[str] = None,
+                       compare_col: Optional[str] = None, log=safe_print):
+    """Bộ lọc dữ liệu dùng chung cho GUI và chế độ không giao diện.
+
+    Trả về (df đã lọc + đánh lại 'so tt', cube_args) — cube_args là bộ lọc quy về chiều
+    cube (Zone_Bx × trạm × Uđd × ngày), None nếu không ánh xạ được.
+    unom / date_from / date_to / low_pct / high_pct / zones = None nghĩa là không lọc theo tiêu chí đó.
+    """
+    df = df.copy()
+    cube_args = {}
+
+    # station
+    text = _norm_text(station_text or "")
+    station_col = detect_station_column(df)
+    if text and station_col:
+        col_norm = df[station_col].astype(str).map(_norm_text)
+        mask = col_norm.str.contains(re.escape(text), na=False)
+        cube_args["stations"] = df.loc[mask, station_col].dropna().unique().tolist()
+        df = df[mask].copy()
+
+    # Uđd value filter (exact)
+    if unom not in (None, ""):
+        nom_col = nominal_col or pick_nominal_col(df)
+        if nom_col and nom_col in df.columns:
+            df = df[df[nom_col].astype(str) == str(unom)].copy()
+            cube_args["un_key"] = str(unom)
+
+    # time filter (inclusive end day)
+    if date_from is not None or date_to is not None:
+        col = dt_col or detect_datetime_column(df)
+        if col:
+            start = pd.to_datetime(date_from) if date_from is not None else pd.NaT
+            end = pd.to_datetime(date_to) if date_to is not None else pd.NaT
+            if dt_col and col == dt_col:
+                cube_args["day_from"] = start if pd.notna(start) else None
+                cube_args["day_to"] = end if pd.notna(end) else None
+            else:
+                cube_args = None
+            dt = pd.to_datetime(df[col], errors="coerce", dayfirst=True)
+            df = df.assign(__dt=dt).dropna(subset=["__dt"])
+            if pd.notna(start): df = df[df["__dt"] >= start]
+            if pd.notna(end):   df = df[df["__dt"] <= (end + pd.Timedelta(days=1) - pd.Timedelta(seconds=1))]
+            df = df.drop(columns=["__dt"], errors="ignore")
+
+    # --- Lọc U THẤP / U CAO so với CỘT SO SÁNH (%) (độc lập với cột U dùng vẽ) ---
+    comp_col = compare_col or detect_compare_column(df)
+    if (low_pct is not None or high_pct is not None) and comp_col and comp_col in df.columns:
+        cmp_series = pd.to_numeric(df[comp_col], errors="coerce")
+        df = df.assign(__cmp=cmp_series).dropna(subset=["__cmp"])
+        if low_pct is not None:
+            df = df[df["__cmp"] <= low_pct]
+        if high_pct is not None:
+            df = df[df["__cmp"] >= high_pct]
+        df = df.drop(columns=["__cmp"], errors="ignore")
+        cube_args = None  # lọc theo từng dòng, không quy về cube được
+    elif low_pct is not None or high_pct is not None:
+        log("⚠️ Không tìm thấy cột so sánh (ví dụ 'SO SÁNH (%)'). Vui lòng kiểm tra dữ liệu.")
+
+    # Lọc theo vùng Zone_Bx (multi-select)
+    zones = list(zones or [])
+    if zones and "Zone_Bx" in df.columns:
+        df = df[df["Zone_Bx"].isin(zones)]
+        if cube_args is not None:
+            cube_args["zones"] = zones
+
+    # renumber so tt
+    if "so tt" in df.columns: df = df.drop(columns=["so tt"], errors="ignore")
+    df.insert(0, "so tt", np.arange(1, len(df)+1))
+    return df, cube_args
+
+def _zone_bar_figure(stat: pd.DataFrame, ycol: str, color: str, name: str, title: str, ytitle: str):
+    import plotly.graph_objs as go
+    fig = go.Figure()
+    fig.add_trace(go.Bar(
+        x=stat["Zone_Bx"], y=stat[ycol],
+        marker_color=color,
+        text=stat[ycol], textposition="auto",
+        name=name,
+        hovertemplate=f'<b>%{{x}}</b><br>{ytitle}: %{{y}}'
+    ))
+    fig.update_layout(
+        title=title,
+        xaxis_title="Zone_Bx", yaxis_title=ytitle,
+        height=320, font=dict(family="Arial", size=13), plot_bgcolor="#fafdff"
+    )
+    return fig
+
+REPORT_CACHE_VERSION = 3       # tăng khi đổi bố cục báo cáo -> bỏ artifact cũ
+REPORT_CACHE_MAX_FILES = 200
+REPORT_MEM_CACHE_SIZE = 8      # số báo cáo giữ trong RAM (LRU) trong 1 phiên
+
+def _prune_report_cache(max_files: int = REPORT_CACHE_MAX_FILES):
+    """Giữ tối đa max_files artifact mới dùng gần nhất (theo mtime) trong REPORT_CACHE_DIR.
+    Không xóa plotly-*.min.js: HTML cache (kể cả bản cũ) trỏ tới chúng (xem plotly_js_tag)."""
+    try:
+        files = sorted((f for f in Path(REPORT_CACHE_DIR).iterdir() if not f.name.endswith(".js")),
+                       key=lambda f: f.stat().st_mtime, reverse=True)
+    except OSError:
+        return
+    for f in files[max_files:]:
+        try: f.unlink()
+        except OSError: pass
+
+def frame_signature(df: pd.DataFrame, cols) -> str:
+    """Chữ ký nội dung (sha1) của các cột cols trong df: đổi khi dữ liệu đổi, không phụ thuộc phiên làm việc."""
+    import hashlib
+    h = hashlib.sha1(json.dumps([len(df), [str(c) for c in cols]], ensure_ascii=False).encode("utf-8"))
+    for c in cols:
+        h.update(pd.util.hash_pandas_object(df[c], index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+def report_cache_key(*parts) -> str:
+    """Khóa file báo cáo đã tổng hợp trong REPORT_CACHE_DIR (xem ZoneReport.save_cached)."""
+    import hashlib
+    payload = json.dumps([REPORT_CACHE_VERSION, *parts], default=str, ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+def _table_html(df: pd.DataFrame, caption: str = "") -> str:
+    if df.empty:
+        return "<i>Không có số liệu.</i>"
+    html = df.to_html(index=False, classes="table table-striped", border=1, float_format="%.3f")
+    return (f"<div style='font-weight:bold;margin:8px 0'>{caption}</div>{html}")
+
+class ZoneReport:
+    """Báo cáo điện áp theo Zone_Bx (bảng chi tiết + thống kê CAO/THẤP, TBA lỗi) và các
+    đầu ra HTML / Excel / Word. Không phụ thuộc Tk/webview để chạy được cả khi không có giao diện."""
+
+    def __init__(self, df_high, df_low, time_label="", file_time="", tba_loi=None):
+        self.df_high, self.df_low = df_high, df_low
+        self.time_label, self.file_time = time_label, file_time
+        self.tba_loi = sorted(tba_loi or [])
+        self.stat_high, self.stat_low = zone_summaries(df_high, df_low)
+        self._figs = None
+        self._figs_json = None      # JSON 4 biểu đồ khi nạp từ cache (xem load_cached)
+        self._fingerprint = None
+
+    @classmethod
+    @PERF.traced("report_build")
+    def build(cls, df_high, df_low, time_label="", file_time="", db_path: Optional[str] = None) -> "ZoneReport":
+        """Sắp xếp + đánh STT 2 bảng chi tiết và kiểm tra TBA lỗi theo sheet Buses của DB VietSub."""
+        db_buses = pd.read_excel(db_path or get_db_path(), sheet_name="Buses")
+        tba_scada_set = set(db_buses["TBA_SCADA"].astype(str).str.strip().str.lower())
+        def is_tba_loi(tba_name):
+            return tba_name.strip().lower() not in tba_scada_set
+
+        if not df_high.empty:
+            df_high = df_high.sort_values(["Zone_Bx", "Số lần Cao"], ascending=[True, False]).reset_index(drop=True)
+            df_high["STT"] = range(1, len(df_high)+1)
+        if not df_low.empty:
+            df_low = df_low.sort_values(["Zone_Bx", "Số lần Thấp"], ascending=[True, False]).reset_index(drop=True)
+            df_low["STT"] = range(1, len(df_low)+1)
+
+        # --- DANH SÁCH TBA LỖI ở cả CAO & THẤP ---
+        tba_loi_high = list(df_high[df_high["TBA"].apply(is_tba_loi)]["TBA"].unique())
+        tba_loi_low  = list(df_low[df_low["TBA"].apply(is_tba_loi)]["TBA"].unique())
+        return cls(df_high, df_low, time_label, file_time, set(tba_loi_high) | set(tba_loi_low))
+
+    @classmethod
+    @PERF.traced("report_build")
+    def from_frame(cls, df: pd.DataFrame, time_label="", file_time="", db_path: Optional[str] = None,
+                   station_col: Optional[str] = None, vcol: Optional[str] = None,
+                   un_col: Optional[str] = None) -> "ZoneReport":
+        """Dựng báo cáo thẳng từ dữ liệu thô đã lọc (ngưỡng REPORT_LOW_PCT / REPORT_HIGH_PCT)."""
+        station_col = station_col or detect_station_column(df)
+        vcol = vcol or pick_voltage_col(df)
+        un_col = un_col or pick_nominal_col(df)
+        if not vcol or not un_col or not station_col:
+            raise ValueError("Không tìm thấy cột cần thiết (TBA / U thực tế / Uđd).")
+        df_high, df_low = violation_tables(df, station_col, vcol, un_col)
+        return cls.build(df_high, df_low, time_label, file_time, db_path)
+
+    @property
+    def fingerprint(self) -> str:
+        """Dấu vân tay nội dung báo cáo (2 bảng chi tiết + TBA lỗi + kỳ báo cáo).
+        Bảng dẫn xuất từ dataset + DB VietSub + bộ lọc, nên mọi thay đổi ở đó đều đổi fingerprint."""
+        if self._fingerprint is None:
+            import hashlib
+            h = hashlib.sha1()
+            for df in (self.df_high, self.df_low):
+                h.update("|".join(map(str, df.columns)).encode("utf-8"))
+                h.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+            h.update(json.dumps([REPORT_CACHE_VERSION, self.time_label, self.tba_loi],
+                                ensure_ascii=False).encode("utf-8"))
+            self._fingerprint = h.hexdigest()
+        return self._fingerprint
+
+    def save_cached(self, key: str) -> Optional[str]:
+        """Lưu 2 bảng chi tiết, kỳ, TBA lỗi và JSON 4 biểu đồ vào REPORT_CACHE_DIR/<key>.report.pkl."""
+        import pickle
+        path = os.path.join(REPORT_CACHE_DIR, f"{key}.report.pkl")
+        payload = {"version": REPORT_CACHE_VERSION, "df_high": self.df_high, "df_low": self.df_low,
+                   "time_label": self.time_label, "file_time": self.file_time, "tba_loi": self.tba_loi,
+                   "figures": [fig.to_json() for fig in self.figures()]}
+        try:
+            os.makedirs(REPORT_CACHE_DIR, exist_ok=True)
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as f:
+                pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+            _prune_report_cache()
+        except OSError as e:
+            safe_print(f"[report-cache] Không lưu được báo cáo: {e}")
+            return None
+        return path
+
+    @classmethod
+    def load_cached(cls, key: str) -> Optional["ZoneReport"]:
+        """Báo cáo đã lưu bằng save_cached(key); None nếu chưa có / khác phiên bản / hỏng."""
+        import pickle
+        path = os.path.join(REPORT_CACHE_DIR, f"{key}.report.pkl")
+        try:
+            with open(path, "rb") as f:
+                p = pickle.load(f)
+            os.utime(path)   # đánh dấu mới dùng (xem _prune_report_cache)
+        except Exception:
+            return None
+        if not isinstance(p, dict) or p.get("version") != REPORT_CACHE_VERSION:
+            return None
+        report = cls(p["df_high"], p["df_low"], p["time_label"], p["file_time"], p["tba_loi"])
+        report._figs_json = p.get("figures")
+        return report
+
+    def _artifact(self, ext: str, write, path: Optional[str] = None) -> str:
+        """File đầu ra lấy từ cache REPORT_CACHE_DIR/<fingerprint><ext>; chưa có thì write(tmp)
+        rồi đổi tên nguyên tử vào cache. path: chép ra vị trí người dùng cần."""
+        cache_path = os.path.join(REPORT_CACHE_DIR, f"{self.fingerprint}{ext}")
+        try:
+            if os.path.exists(cache_path):
+                os.utime(cache_path)   # đánh dấu mới dùng (xem _prune_report_cache)
+            else:
+                os.makedirs(REPORT_CACHE_DIR, exist_ok=True)
+                tmp = os.path.join(REPORT_CACHE_DIR, f"{self.fingerprint}.tmp{ext}")
+                with PERF.span("export", format=ext):
+                    write(tmp)
+                os.replace(tmp, cache_path)
+                _prune_report_cache()
+        except OSError as e:
+            safe_print(f"[report-cache] Bỏ qua cache: {e}")
+            if path is None:
+                raise
+            return write(path)
+        if path is None:
+            return cache_path
+        shutil.copyfile(cache_path, path)
+        return path
+
+    def figures(self):
+        """4 biểu đồ cột plotly: [số TBA CAO, số lần CAO, số TBA THẤP, số lần THẤP]."""
+        if self._figs is None and self._figs_json:
+            import plotly.io as pio
+            self._figs = [pio.from_json(s) for s in self._figs_json]
+        if self._figs is None:
+            sh, sl = self.stat_high, self.stat_low
+            self._figs = [
+                _zone_bar_figure(sh, "Số TBA vi phạm", "rgb(36,190,110)", "Số TBA vi phạm CAO",
+                                 "Số lượng TBA có vi phạm điện áp CAO (>=110%) theo Zone_Bx", "Số TBA vi phạm"),
+                _zone_bar_figure(sh, "Tổng số lần Cao", "rgb(0,120,250)", "Tổng số lần vi phạm CAO",
+                                 "Tổng số lần vi phạm điện áp CAO (>=110%) theo Zone_Bx", "Tổng số lần Cao"),
+                _zone_bar_figure(sl, "Số TBA vi phạm", "rgb(241,98,53)", "Số TBA vi phạm THẤP",
+                                 "Số lượng TBA có vi phạm điện áp THẤP (<=95%) theo Zone_Bx", "Số TBA vi phạm"),
+                _zone_bar_figure(sl, "Tổng số lần Thấp", "rgb(140, 75, 230)", "Tổng số lần vi phạm THẤP",
+                                 "Tổng số lần vi phạm điện áp THẤP (<=95%) theo Zone_Bx", "Tổng số lần Thấp"),
+            ]
+        return self._figs
+
+    def _tba_loi_html(self) -> str:
+        if not self.tba_loi:
+            return ""
+        html = "<div style='padding:10px; border:2px solid #F05; background:#FFF6E6; color:#F05; border-radius:10px; margin-bottom:18px;'>"
+        html += "<b>⚠️ DANH SÁCH TBA ĐANG LỖI TÊN (chưa được tổng hợp):</b><br>"
+        html += "<ul style='margin:8px 0 0 20px;'>"
+        for tba in self.tba_loi:
+            html += f"<li style='margin-bottom:3px;'><b>{tba}</b></li>"
+        html += "</ul>"
+        html += "<div style='margin-top:6px; color:#888; font-size:14px;'>Hãy sửa tên TBA này ở dashboard hiệu chỉnh để báo cáo tổng hợp đủ!</div>"
+        html += "</div>"
+        return html
+
+    def html(self, inline_js: bool = False, export_buttons: bool = True) -> str:
+        """Dashboard HTML. inline_js=True nhúng plotly.js để file tự chứa (xuất file);
+        export_buttons gắn nút gọi API xuất Excel/Word của webview."""
+        import plotly.io as pio
+        html_high_stat = _table_html(self.stat_high, "BẢNG TK ZONE_BX: Số TBA & số lần VI PHẠM ĐIỆN ÁP CAO (>=110%)")
+        html_low_stat  = _table_html(self.stat_low,  "BẢNG TK ZONE_BX: Số TBA & số lần VI PHẠM ĐIỆN ÁP THẤP (<=95%)")
+        # Bảng chi tiết có thể rất dài: gửi JSON, trình duyệt tự chia trang + cuộn ảo
+        html_high_detail = json_table_html(self.df_high, "zr-high", "BẢNG CHI TIẾT TBA VI PHẠM ĐIỆN ÁP CAO (>=110%)")
+        html_low_detail  = json_table_html(self.df_low,  "zr-low",  "BẢNG CHI TIẾT TBA VI PHẠM ĐIỆN ÁP THẤP (<=95%)")
+
+        # plotly.js nạp 1 lần ở <head>, các figure chỉ còn phần dữ liệu
+        fig_high1_html, fig_high2_html, fig_low1_html, fig_low2_html = (
+            pio.to_html(fig, full_html=False, include_plotlyjs=False) for fig in self.figures())
+
+        buttons = ("""<button class="dash-btn" onclick="window.pywebview.api.export_excel()">📥 Xuất báo cáo Excel</button>
+            <button class="dash-btn" onclick="window.pywebview.api.export_word()">📝 Xuất Word báo cáo</button>
+            <button class="dash-btn" onclick="window.pywebview.api.export_per_zone()">🗂 Xuất riêng từng Zone_Bx</button>"""
+                   if export_buttons else "")
+
+        # ==== HTML dashboard có cảnh báo TBA lỗi ====
+        return f"""
+        <html>
+        <head>
+            <meta charset="utf-8">
+            <style>
+                body {{ font-family: Arial; margin: 16px; background: #fafdff; }}
+                .table {{ border-collapse: collapse; width: 100%; font-size: 15px; margin-bottom:18px;}}
+                .table th, .table td {{ border: 1px solid #bbb; padding: 4px 8px; }}
+                .table th {{ background: #e8e8e8; }}
+                .dash-btn {{
+                    display:inline-block; margin:12px 0; padding:7px 15px;
+                    background:#1756d9; color:#fff; border:none; border-radius:6px; font-size:15px; cursor:pointer;}}
+                h2,h3 {{margin-top:18px;}}
+                {HTML_TABLE_CSS}
+            </style>
+            {plotly_js_tag(inline_js)}
+        </head>
+        <body>
+            <h2 style="color:#1756d9">
+                BÁO CÁO PHÂN TÍCH ĐIỆN ÁP THEO ZONE_BX
+                <br><span style="font-size:18px;color:#F05;">{self.time_label}</span>
+            </h2>
+            {self._tba_loi_html()}
+            {fig_high1_html}
+            {fig_high2_html}
+            {html_high_stat}
+            <hr>
+            {fig_low1_html}
+            {fig_low2_html}
+            {html_low_stat}
+            <hr>
+            {html_high_detail}
+            <hr>
+            {html_low_detail}
+            {buttons}
+            <script>{HTML_TABLE_JS}</script>
+        </body>
+        </html>
+        """
+
+    @staticmethod
+    def _write_text(path: str, text: str) -> str:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return path
+
+    def dashboard_file(self) -> str:
+        """File HTML (có nút xuất) cho webview, lấy từ cache nếu đã dựng."""
+        import plotly
+        plotly_js_tag()   # file plotly.js cạnh HTML cache (chép lại nếu đã bị xóa)
+        # HTML trỏ tới plotly-<phiên bản>.min.js -> phiên bản plotly thuộc khóa artifact
+        return self._artifact(f".view-{plotly.__version__}.html", lambda p: self._write_text(p, self.html()))
+
+    def to_html(self, path: str) -> str:
+        return self._artifact(".html", lambda p: self._write_text(p, self.html(inline_js=True, export_buttons=False)), path)
+
+    def to_excel(self, path: str) -> str:
+        return self._artifact(".xlsx", lambda p: export_zone_report_xlsx(
+            p, self.stat_high, self.stat_low, self.df_high, self.df_low), path)
+
+    def to_word(self, path: str) -> str:
+        return self._artifact(".docx", self._write_word, path)
+
+    def _write_word(self, path: str) -> str:
+        from docx import Document
+        from docx.shared import Inches
+        # Ảnh tĩnh của biểu đồ chỉ dựng khi xuất Word (xem render_static_images)
+        chart_imgs = [io.BytesIO(b) for b in render_static_images(self.figures(), width=950, height=340, scale=2)]
+        doc = Document()
+        if self.tba_loi:
+            doc.add_paragraph("⚠️ DANH SÁCH TBA LỖI: " + ", ".join(self.tba_loi), style="Intense Quote")
+        doc.add_heading(f'BÁO CÁO PHÂN TÍCH ĐIỆN ÁP THEO ZONE_BX\n{self.time_label}', 0)
+        doc.add_heading('Biểu đồ tổng hợp điện áp CAO', level=1)
+        doc.add_picture(chart_imgs[0], width=Inches(6.2))
+        doc.add_picture(chart_imgs[1], width=Inches(6.2))
+        doc.add_paragraph()
+        doc.add_heading('Biểu đồ tổng hợp điện áp THẤP', level=1)
+        doc.add_picture(chart_imgs[2], width=Inches(6.2))
+        doc.add_picture(chart_imgs[3], width=Inches(6.2))
+        doc.add_paragraph()
+
+        for title, table in (('Thống kê điện áp CAO', self.stat_high),
+                             ('Thống kê điện áp THẤP', self.stat_low),
+                             ('Bảng chi tiết TBA vi phạm điện áp CAO', self.df_high),
+                             ('Bảng chi tiết TBA vi phạm điện áp THẤP', self.df_low)):
+            doc.add_heading(title, level=1)
+            if not table.empty:
+                docx_add_dataframe_table(doc, table, style='Table Grid')
+                doc.add_paragraph()
+        doc.save(path)
+        return path
+
+    def split_by_zone(self) -> Dict[str, "ZoneReport"]:
+        """Báo cáo con cho từng Zone_Bx, tách từ bảng đã tổng hợp (không tổng hợp lại dữ liệu)."""
+        gh = dict(tuple(self.df_high.groupby("Zone_Bx", sort=False))) if not self.df_high.empty else {}
+        gl = dict(tuple(self.df_low.groupby("Zone_Bx", sort=False))) if not self.df_low.empty else {}
+        out = {}
+        for zone in sorted(set(gh) | set(gl), key=str):
+            parts = []
+            for g, base in ((gh, self.df_high), (gl, self.df_low)):
+                part = g.get(zone, base.head(0)).reset_index(drop=True)
+                part["STT"] = range(1, len(part) + 1)
+                parts.append(part)
+            names = set(parts[0]["TBA"]) | set(parts[1]["TBA"])
+            label = f"Zone_Bx {zone}" + (f" | {self.time_label}" if self.time_label else "")
+            out[zone] = ZoneReport(parts[0], parts[1], label, self.file_time,
+                                   [t for t in self.tba_loi if t in names])
+        return out
+
+    def write(self, out_dir: str, formats=("xlsx", "docx", "html"), prefix: str = "Báo cáo") -> List[str]:
+        """Ghi các định dạng yêu cầu vào out_dir, tên 'Báo cáo <file_time>.<ext>'."""
+        writers = {"xlsx": self.to_excel, "docx": self.to_word, "html": self.to_html}
+        os.makedirs(out_dir, exist_ok=True)
+        out = []
+        for fmt in formats:
+            fmt = str(fmt).lower().lstrip(".")
+            if fmt not in writers:
+                raise ValueError(f"Định dạng không hỗ trợ: {fmt}")
+            out.append(writers[fmt](os.path.join(out_dir, f"{prefix} {self.file_time}.{fmt}")))
+        return out
+
+def _safe_filename(name: str) -> str:
+    return re.sub(r'[\\/:*?"<>|]+', "_", str(name)).strip() or "_"
+
+def _write_report_job(report: ZoneReport, out_dir: str, formats, prefix: str) -> List[str]:
+    # chạy trong tiến trình con (phải ở mức module để pickle được)
+    return report.write(out_dir, formats, prefix)
+
+@PERF.traced("export")
+def write_zone_reports(report: ZoneReport, out_dir: str, formats=("xlsx", "docx"),
+                       max_workers: Optional[int] = None, log=safe_print) -> List[str]:
+    """Mỗi Zone_Bx 1 bộ file báo cáo: tách từ 1 lần tổng hợp (ZoneReport.split_by_zone),
+    dựng + ghi song song trong ProcessPoolExecutor; pool hỏng thì các zone còn lại chạy tuần tự.
+    Zone lỗi được log '❌ Zone_Bx ...' và bỏ qua; trả về các file đã ghi được."""
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from concurrent.futures.process import BrokenProcessPool
+
+    jobs = [(zone, part, _safe_filename(f"Báo cáo {zone}")) for zone, part in report.split_by_zone().items()]
+    if not jobs:
+        return []
+    os.makedirs(out_dir, exist_ok=True)
+    written, failed, done = [], [], set()
+
+    def collect(zone, result):
+        try:
+            files = result()
+        except BrokenProcessPool:
+            raise
+        except Exception as e:
+            failed.append(zone)
+            log(f"❌ Zone_Bx {zone}: {e}")
+        else:
+            written.extend(files)
+            log(f"✅ Zone_Bx {zone}")
+        done.add(zone)
+
+    workers = max_workers or min(len(jobs), os.cpu_count() or 1)
+    if workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as ex:
+                futs = {ex.submit(_write_report_job, part, out_dir, formats, prefix): zone
+                        for zone, part, prefix in jobs}
+                for fut in as_completed(futs):
+                    collect(futs[fut], fut.result)
+        except (BrokenProcessPool, OSError) as e:
+            log(f"⚠️ Không chạy song song được ({e}), chuyển sang tuần tự.")
+    for zone, part, prefix in jobs:
+        if zone not in done:
+            collect(zone, lambda: part.write(out_dir, formats, prefix))
+    if failed:
+        log(f"⚠️ {len(failed)}/{len(jobs)} Zone_Bx lỗi: " + ", ".join(map(str, failed)))
+    return written
+
+# ==================== Render tracking ====================
+class DirtyTracker:
+    """Theo dõi view nào cần vẽ lại.
+
+    Mỗi view đăng ký 1 hàm trả về tuple các input nó phụ thuộc (phiên bản bộ lọc,
+    cột U, ngưỡng, Top N...). View chỉ "bẩn" khi tuple này khác lần vẽ gần nhất.
+    """
+
+    def __init__(self):
+        self._deps = {}       # view -> callable() -> tuple
+        self._rendered = {}   # view -> chữ ký lúc vẽ xong
+
+    def register(self, view, deps):
+        self._deps[view] = deps
+        self._rendered.pop(view, None)
+
+    def signature(self, view):
+        fn = self._deps.get(view)
+        return fn() if fn is not None else None
+
+    def is_dirty(self, view) -> bool:
+        if view not in self._deps:
+            return True
+        return view not in self._rendered or self._rendered[view] != self.signature(view)
+
+    def mark_clean(self, view, signature=None):
+        self._rendered[view] = self.signature(view) if signature is None else signature
+
+    def invalidate(self, view=None):
+        if view is None:
+            self._rendered.clear()
+        else:
+            self._rendered.pop(view, None)
+
+
+# ==================== Off-thread rasterization ====================
+# Khóa chung cho mọi lần render matplotlib: thread nền (AggRasterizer) và canvas Tk (tk_figure_canvas)
+MPL_LOCK = threading.RLock()
+
+def tk_figure_canvas(fig, master):
+    """FigureCanvasTkAgg có draw() chạy dưới MPL_LOCK (không render cùng lúc với AggRasterizer)."""
+    global _LockedTkCanvas
+    if _LockedTkCanvas is None:
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+        class _Canvas(FigureCanvasTkAgg):
+            def draw(self):
+                with MPL_LOCK:
+                    super().draw()
+
+        _LockedTkCanvas = _Canvas
+    return _LockedTkCanvas(fig, master=master)
+
+_LockedTkCanvas = None
+
+class AggRasterizer:
+    """Vẽ figure matplotlib (Agg) trên 1 thread nền thành ảnh RGBA.
+
+    - Figure + artist của từng key do thread nền tạo và giữ riêng (draw(fig, art), art là dict
+      riêng của key); main thread chỉ gửi hàm vẽ + dữ liệu và nhận lại bitmap qua hàng đợi.
+    - Render giữ MPL_LOCK, cùng khóa với canvas Tk của biểu đồ chính.
+    - Mỗi key chỉ giữ yêu cầu mới nhất; kết quả cũ hơn yêu cầu mới nhất bị bỏ.
+    - results() gọi trên main thread (qua after) để lấy ảnh đã vẽ xong.
+    """
+
+    def __init__(self):
+        import queue
+        self._cond = threading.Condition()
+        self._pending = {}    # key -> (seq, draw, w, h)
+        self._latest = {}     # key -> seq yêu cầu mới nhất
+        self._seq = 0
+        self._in_flight = 0
+        self._done = queue.Queue()
+        self._figs = {}       # key -> (Figure, art); chỉ thread nền đọc/ghi
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, key, draw, width, height):
+        """draw(fig, art) chạy trên thread nền; width/height tính bằng pixel."""
+        with self._cond:
+            self._seq += 1
+            self._latest[key] = self._seq
+            self._pending[key] = (self._seq, draw, int(width), int(height))
+            self._cond.notify()
+
+    def cancel(self, key):
+        """Bỏ yêu cầu đang chờ của key + mọi kết quả đang vẽ dở."""
+        with self._cond:
+            self._seq += 1
+            self._latest[key] = self._seq
+            self._pending.pop(key, None)
+
+    def busy(self) -> bool:
+        with self._cond:
+            return bool(self._pending) or self._in_flight > 0 or not self._done.empty()
+
+    def results(self):
+        """[(key, rgba ndarray | None, exc | None)] của các yêu cầu mới nhất đã xong."""
+        import queue
+        out = []
+        while True:
+            try:
+                key, seq, img, err = self._done.get_nowait()
+            except queue.Empty:
+                break
+            with self._cond:
+                if self._latest.get(key) != seq:
+                    continue
+            out.append((key, img, err))
+        return out
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                key = next(iter(self._pending))
+                seq, draw, w, h = self._pending.pop(key)
+                self._in_flight += 1
+            try:
+                with PERF.span("rasterize", tab=key), MPL_LOCK:
+                    fig, art = self._figure(key)
+                    fig.set_size_inches(max(w, 100) / fig.dpi, max(h, 100) / fig.dpi)
+                    draw(fig, art)
+                    fig.canvas.draw()
+                    img = np.asarray(fig.canvas.buffer_rgba()).copy()
+                result = (key, seq, img, None)
+            except Exception as e:
+                result = (key, seq, None, e)
+            with self._cond:
+                self._in_flight -= 1
+            self._done.put(result)
+
+    def _figure(self, key):
+        # (thread nền) figure Agg + dict artist riêng của key, tạo ở lần vẽ đầu
+        entry = self._figs.get(key)
+        if entry is None:
+            from matplotlib.figure import Figure
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+            fig = Figure(dpi=100)
+            FigureCanvasAgg(fig)
+            entry = self._figs[key] = (fig, {})
+        return entry
+
+
 # ==================== GUI ====================
 class App(ctk.CTk):
     def __init__(self):
@@ -287,6 +2596,40 @@ class App(ctk.CTk):
         self.zone_selected = set()    # set[str] các zone đã chọn
         self.zones_all = []           # list[str] danh sách zone có trong df
 
+        # --- Cube tổng hợp (dựng lazy 1 lần / dataset, xem _get_cube / _get_violations) ---
+        self._cubes = {}              # key (cột) -> VoltageCube, không phụ thuộc ngưỡng
+        self._violations = {}         # key (cột, ngưỡng) -> bảng vi phạm; LRU VIOLATION_CACHE_SIZE mục
+        self._sketches = {}           # key (cột) -> DistSketches
+        self._view_cube_args = {}     # bộ lọc view_df quy về chiều cube; None = không ánh xạ được
+
+        # --- Figure dùng lâu dài của các tab dashboard (xem _tab_figure) ---
+        self._tab_figs = {}           # "heatmap"/"dist"/"report"/"sens" -> {fig, view, msg, artist...}
+        self._rasterizer = None       # AggRasterizer, tạo khi tab đầu tiên cần vẽ
+        self._raster_polling = False
+
+        # --- Vẽ lười theo dirty-flag: tab chỉ vẽ lại khi input phụ thuộc đổi ---
+        self._view_version = 0        # tăng mỗi lần view_df đổi (lọc / nạp dữ liệu)
+        self._render_deps = DirtyTracker()
+        self._render_deps.register("Heatmap", lambda: (self._view_version, self.voltage_col, self.dt_col,
+                                                       self._heatmap_options()))
+        self._render_deps.register("Phân phối", lambda: (self._view_version, self.voltage_col))
+        # Báo cáo: số liệu zone phụ thuộc ngưỡng; Top N chỉ ảnh hưởng bước vẽ
+        self._render_deps.register("report_data", lambda: (self._view_version, self.voltage_col,
+                                                           self.nominal_col, self._ui_thresholds()))
+        self._render_deps.register("Báo cáo", lambda: (self._render_deps.signature("report_data"),
+                                                       self._report_top_n()))
+        self._render_deps.register("Độ nhạy", lambda: (self._view_version, self.voltage_col,
+                                                       self.nominal_col, self._ui_thresholds()))
+        self._sweep_cache = None      # (view_version, cột U, cột Uđd, ThresholdSweep)
+
+        # --- Báo cáo Zone_Bx theo _report_cache_key: RAM (LRU) -> REPORT_CACHE_DIR -> tổng hợp lại;
+        #     file xuất cache theo ZoneReport.fingerprint ---
+        self._data_version = 0        # tăng mỗi lần self.df đổi
+        self._view_filter_key = ""    # bộ lọc đã áp cho view_df ("" = chưa lọc); None = không xác định
+        self._data_sigs = {}          # (data_version, cột...) -> frame_signature
+        self._report_cache = {}       # key -> ZoneReport, thứ tự = mới dùng gần nhất ở cuối
+        self._session_writer = SessionCacheWriter()   # ghi cache phiên ở nền, chỉ khi self.df đổi
+
         # state vars
         self.chart_mode = tk.StringVar(value="line")
         self.station_text = tk.StringVar()
@@ -325,8 +2668,9 @@ class App(ctk.CTk):
         self.nominal_col = self.cfg.get("nominal_col") or None
 
         self._build_gui_modern_card()
-        self._try_load_cache()
         self.protocol("WM_DELETE_WINDOW", self._on_close)
+        # cửa sổ hiện trước, cache phiên nạp ở nền sau (xem _try_load_cache)
+        self.after_idle(self._try_load_cache)
 
     # ---------- Config/cache ----------
     def _load_cfg(self):
@@ -364,27 +2708,159 @@ class App(ctk.CTk):
             "high_pct_str": self.high_pct_str.get(),
         }
         try:
-            with open(CFG_PATH,"w",encoding="utf-8") as f:
+            tmp = CFG_PATH + ".tmp"
+            with open(tmp,"w",encoding="utf-8") as f:
                 json.dump(cfg,f,ensure_ascii=False,indent=2)
+            os.replace(tmp, CFG_PATH)
         except Exception: pass
 
     def _cache_df(self):
+        """Xếp lịch ghi cache phiên ở nền; bỏ qua nếu dataset chưa đổi từ lần ghi trước."""
         if not self.df.empty:
-            try: self.df.to_pickle(CACHE_PATH)
-            except Exception: pass
+            self._session_writer.submit(self.df, self._data_version)
 
-    def _try_load_cache(self):
+    def _load_session_df(self):
+        """(df, path) từ cache phiên Arrow (memory-map); không có thì đọc cache pickle cũ."""
+        try:
+            loaded = read_session_cache()
+            if loaded is not None:
+                return loaded
+        except ImportError:
+            pass
         if os.path.exists(CACHE_PATH):
-            try:
-                df = pd.read_pickle(CACHE_PATH)
-                if isinstance(df, pd.DataFrame) and not df.empty:
-                    self.df = df.copy()
-                    self.view_df = self.df.copy()
-                    self._populate_detects()
-                    self._refresh_table()
-                    self._update_stats_and_chart()
-            except Exception as e:
-                self._log(f"Không thể nạp cache: {e}")
+            return pd.read_pickle(CACHE_PATH), CACHE_PATH
+        return None, None
+
+    def _try_load_cache(self):
+        """Đọc cache phiên + snapshot trên thread nền (cửa sổ đã hiện), dựng màn hình ở _on_cache_loaded.
+        Nếu trong lúc chờ người dùng đã nạp/xóa dữ liệu thì bỏ kết quả cache."""
+        STARTUP_TIMES.setdefault("window", time.perf_counter() - _T_START)
+        version = self._data_version
+
+        def _job():
+            df, path = self._load_session_df()
+            if not isinstance(df, pd.DataFrame) or df.empty:
+                return None
+            return df, path, read_session_state(path, df)
+
+        def _done(loaded):
+            self.status_var.set("Sẵn sàng.")
+            if loaded is not None and self._data_version == version:
+                self._on_cache_loaded(*loaded)
+            STARTUP_TIMES.setdefault("cache", time.perf_counter() - _T_START)
+            safe_print("[startup]", format_startup_times())
+
+        def _fail(e):
+            self.status_var.set("Sẵn sàng.")
+            self._log(f"Không thể nạp cache: {e}")
+
+        self.status_var.set("⏳ Đang nạp dữ liệu phiên trước...")
+        self._run_in_background(_job, _done, _fail, poll_ms=50)
+
+    def _on_cache_loaded(self, df: pd.DataFrame, path: str, state: Optional[dict]):
+        try:
+            self.df = df                 # frame ghi được (xem read_session_cache)
+            self.view_df = df
+            self._on_dataset_changed()
+            self._session_writer.mark_saved(self._data_version, path)
+            if state is not None and self._restore_session_state(state):
+                # màn hình cũ đã vẽ xong từ snapshot; tab dashboard đang mở vẽ lười sau
+                self.after(SESSION_STATE_REFRESH_MS,
+                           lambda: self._render_tab_if_dirty(self.dashboard_tabs.get()))
+                return
+            self._populate_detects()
+            self._refresh_table()
+            self._update_stats_and_chart()
+        except Exception as e:
+            self._log(f"Không thể nạp cache: {e}")
+
+    def _session_state(self) -> dict:
+        """Trạng thái dẫn xuất của dataset + view hiện tại để ghi kèm cache phiên (xem _restore_session_state)."""
+        view = {"positions": None, "filter_key": self._view_filter_key, "cube_args": self._view_cube_args}
+        if self.view_df is not self.df:
+            pos = self.df.index.get_indexer(self.view_df.index) if self.df.index.is_unique else None
+            if pos is None or (pos < 0).any():
+                view["filter_key"] = None        # không dựng lại được view -> chỉ giữ phần dataset
+            else:
+                view["positions"] = pos.astype(np.int64)
+        sweep = self._sweep_cache if self._sweep_cache and self._sweep_cache[0] == self._view_version else None
+        return {
+            "rows": len(self.df),
+            "columns": [str(c) for c in self.df.columns],
+            "cols": {"compare_col": self.compare_col, "voltage_col": self.voltage_col,
+                     "nominal_col": self.nominal_col, "dt_col": self.dt_col},
+            "vcol": (list(self.vcol_cmb.cget("values")), self.vcol_cmb.get()),
+            "unom": (list(self.unom_val_cmb.cget("values")), self.unom_val_cmb.get()),
+            "zones_all": list(self.zones_all),
+            "zone_selected": sorted(self.zone_selected),
+            "cubes": self._cubes,
+            "violations": self._violations,
+            "sketches": self._sketches,
+            "sweep": sweep[1:] if sweep else None,
+            "view": view,
+            "table": getattr(self, "_table_snapshot", None),
+            "col_widths": getattr(self, "_col_width_cache", None),
+            "kpis": {k: v.get() for k, v in self.kpi_vars.items()},
+            "stats": self.stats_var.get(),
+            "chart": (self._chart_full, self._chart_axis) if getattr(self, "_chart_full", None) else None,
+        }
+
+    def _save_session_state(self):
+        """Ghi snapshot kèm bản cache phiên đang chứa đúng self.df (gọi khi đóng app, sau flush)."""
+        path = self._session_writer.saved_path(self._data_version)
+        if not path or self.df.empty:
+            return
+        try:
+            write_session_state(path, self._session_state())
+        except Exception as e:
+            safe_print("[cache] Lỗi ghi snapshot phiên:", e)
+
+    def _restore_session_state(self, state: dict) -> bool:
+        """Dựng lại cột đã dò, combo, zone, cube và màn hình (bảng, KPI, biểu đồ) từ snapshot.
+        Phần view chỉ dùng khi bộ lọc trên giao diện vẫn trùng bộ lọc đã lưu; False -> để nạp thường."""
+        for name, val in state["cols"].items():
+            setattr(self, name, val)
+        for cmb, (values, cur) in ((self.vcol_cmb, state["vcol"]), (self.unom_val_cmb, state["unom"])):
+            cmb.configure(values=values or [""])
+            cmb.set(cur)
+        self.zones_all = list(state["zones_all"])
+        self.zone_selected = set(state["zone_selected"])
+        self._update_zone_badge()
+        self._cubes = dict(state["cubes"])
+        self._violations = dict(state["violations"])
+        self._sketches = dict(state["sketches"])
+
+        view, table = state["view"], state["table"]
+        key = view["filter_key"]
+        if key is None or table is None:
+            return False
+        if key:
+            if key != json.dumps(self._current_filters(), default=str, sort_keys=True, ensure_ascii=False):
+                return False
+            vdf = self.df.take(view["positions"])
+            vdf = vdf.drop(columns=["so tt"], errors="ignore")
+            vdf.insert(0, "so tt", np.arange(1, len(vdf) + 1))
+            self.view_df = vdf
+        self._view_filter_key = key
+        self._view_cube_args = view["cube_args"]
+        self._view_version += 1
+        if state["sweep"] is not None:
+            self._sweep_cache = (self._view_version,) + tuple(state["sweep"])
+
+        self._col_width_cache = state["col_widths"]
+        with PERF.span("table", warm_start=True):
+            self._fill_table(*table)
+        for k, v in state["kpis"].items():
+            if k in self.kpi_vars:
+                self.kpi_vars[k].set(v)
+        self.stats_var.set(state["stats"])
+        if state["chart"] is not None:
+            self._chart_full, self._chart_axis = state["chart"]
+            with PERF.span("chart", warm_start=True):
+                self._plot_chart_full()
+        else:
+            self._draw_chart_empty()
+        return True
     def _show_tba_dashboard(self):
         """Alias để gọi dashboard hiệu chỉnh TBA lỗi"""
         return self._show_dashboard_fix_tba_loi()
@@ -398,6 +2874,8 @@ class App(ctk.CTk):
                      fg_color="transparent", text_color="#1a2857").place(x=28, y=12)
         ctk.CTkButton(header, text="❓ Help", width=70, height=36,
                       font=("Segoe UI", 15), command=self._show_help).place(relx=1, x=-18, y=13, anchor="ne")
+        ctk.CTkButton(header, text="⏱ Hiệu năng", width=100, height=36,
+                      font=("Segoe UI", 15), command=self._show_perf_panel).place(relx=1, x=-98, y=13, anchor="ne")
 
         # ---------- Main body ----------
         body = ctk.CTkFrame(self, fg_color="#f5f8ff", corner_radius=0)
@@ -452,6 +2930,20 @@ class App(ctk.CTk):
             font=("Segoe UI", 15, "bold"), anchor="w", command=self._export_missing_tba
         ).pack(fill="x", padx=18, pady=(13, 10))
 
+        # Nút Báo cáo nhiều kỳ (gộp summary từng file, không nạp dữ liệu thô)
+        ctk.CTkButton(
+            sidebar, text="  Báo cáo nhiều kỳ", width=160, height=44, corner_radius=18,
+            fg_color="#c8e6c9", hover_color="#a5d6a7", text_color="#1b5e20",
+            font=("Segoe UI", 15, "bold"), anchor="w", command=self._multi_period_report
+        ).pack(fill="x", padx=18, pady=(3, 10))
+
+        # Nút Xuất dữ liệu đang lọc (CSV / XLSX / Parquet)
+        ctk.CTkButton(
+            sidebar, text="  Xuất dữ liệu lọc", width=160, height=44, corner_radius=18,
+            fg_color="#e1d5f7", hover_color="#c5b3ec", text_color="#4b2a8a",
+            font=("Segoe UI", 15, "bold"), anchor="w", command=self._export_view_df
+        ).pack(fill="x", padx=18, pady=(3, 10))
+
         # ---------- Filter bar (dải ngang trên cùng) ----------
         filter_card = ctk.CTkFrame(body, fg_color="#fff", corner_radius=14)
         filter_card.grid(row=0, column=1, sticky="ew", padx=(2,18), pady=(16,8))
@@ -610,7 +3102,7 @@ class App(ctk.CTk):
         self._update_kpi_cards()
 
     def _build_dashboard_tabs(self, parent):
-        """Dashboard dạng tab: Tổng quan / Heatmap / Phân phối / Báo cáo."""
+        """Dashboard dạng tab: Tổng quan / Heatmap / Phân phối / Báo cáo / Độ nhạy."""
         #tabs = ctk.CTkTabview(parent, corner_radius=14)
         tabs = ctk.CTkTabview(parent, corner_radius=14, command=self._on_dashboard_tab_changed)
 
@@ -620,6 +3112,7 @@ class App(ctk.CTk):
         tab_heatmap  = tabs.add("Heatmap")
         tab_dist     = tabs.add("Phân phối")
         tab_report   = tabs.add("Báo cáo")
+        tab_sens     = tabs.add("Độ nhạy")
 
         # ===== TAB: Tổng quan (chart + stats) =====
         top = ctk.CTkFrame(tab_overview, fg_color="transparent")
@@ -640,8 +3133,15 @@ class App(ctk.CTk):
         chart_wrap = ctk.CTkFrame(tab_overview, fg_color="transparent")
         chart_wrap.pack(fill="both", expand=True, padx=10, pady=10)
 
-        self.fig, self.ax = plt.subplots(figsize=(6.2, 4), dpi=100)
-        self.canvas = FigureCanvasTkAgg(self.fig, master=chart_wrap)
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_tkagg import NavigationToolbar2Tk
+        self.fig = Figure(figsize=(6.2, 4), dpi=100)
+        self.ax = self.fig.add_subplot()
+        self.canvas = tk_figure_canvas(self.fig, chart_wrap)
+        # toolbar zoom/pan: khi đổi khoảng nhìn sẽ decimate lại từ dữ liệu gốc
+        self.chart_toolbar = NavigationToolbar2Tk(self.canvas, chart_wrap, pack_toolbar=False)
+        self.chart_toolbar.update()
+        self.chart_toolbar.pack(side="bottom", fill="x")
         self.canvas.get_tk_widget().pack(fill="both", expand=True)
 
         self._draw_chart_empty()
@@ -652,6 +3152,21 @@ class App(ctk.CTk):
                      font=("Segoe UI", 14, "bold"), text_color="#1a2857")\
             .pack(anchor="w", padx=12, pady=(14, 6))
 
+        # lớp thống kê + độ gộp cột (Tự động: gộp tuần/tháng khi khoảng ngày dài)
+        hm_ctrl = ctk.CTkFrame(tab_heatmap, fg_color="transparent")
+        hm_ctrl.pack(fill="x", padx=12, pady=(0, 2))
+        self.hm_stat_var = ctk.StringVar(value=HEATMAP_STATS["mean"])
+        self.hm_period_var = ctk.StringVar(value="Tự động")
+        ctk.CTkLabel(hm_ctrl, text="Lớp:", font=("Segoe UI", 12)).pack(side="left")
+        ctk.CTkSegmentedButton(hm_ctrl, values=list(HEATMAP_STATS.values()), variable=self.hm_stat_var,
+                               command=lambda _: self._render_tab_if_dirty("Heatmap"))\
+            .pack(side="left", padx=(6, 14))
+        ctk.CTkLabel(hm_ctrl, text="Cột:", font=("Segoe UI", 12)).pack(side="left")
+        ctk.CTkSegmentedButton(hm_ctrl, values=["Tự động"] + list(HEATMAP_PERIODS.values()),
+                               variable=self.hm_period_var,
+                               command=lambda _: self._render_tab_if_dirty("Heatmap"))\
+            .pack(side="left", padx=(6, 0))
+
         # vùng đặt chart
         self.hm_wrap = ctk.CTkFrame(tab_heatmap, fg_color="transparent")
         self.hm_wrap.pack(fill="both", expand=True, padx=10, pady=10)
@@ -674,6 +3189,96 @@ class App(ctk.CTk):
         self.report_wrap = ctk.CTkFrame(tab_report, fg_color="transparent")
         self.report_wrap.pack(fill="both", expand=True, padx=10, pady=10)
 
+        # ===== TAB: Độ nhạy ngưỡng (số TBA / số lần vi phạm theo từng ngưỡng %) =====
+        ctk.CTkLabel(tab_sens, text="Độ nhạy theo ngưỡng U/Uđd (%)",
+                     font=("Segoe UI", 14, "bold"), text_color="#1a2857")\
+            .pack(anchor="w", padx=12, pady=(14, 6))
+        self.sens_wrap = ctk.CTkFrame(tab_sens, fg_color="transparent")
+        self.sens_wrap.pack(fill="both", expand=True, padx=10, pady=10)
+
+    # ---------- Figure dùng lâu dài cho các tab ----------
+    def _tab_figure(self, key, wrap, figsize):
+        """Label ảnh của 1 tab: tạo 1 lần (không hủy/tạo lại widget Tk). Figure + artist
+        của tab nằm riêng ở thread nền (AggRasterizer), Tk chỉ nhận bitmap đã vẽ xong."""
+        st = self._tab_figs.get(key)
+        if st is None:
+            # wrap không co giãn theo ảnh, ảnh vẽ theo kích thước wrap
+            wrap.pack_propagate(False)
+            view = tk.Label(wrap, bd=0, highlightthickness=0, bg="#ffffff")
+            msg = ctk.CTkLabel(wrap, text="", font=("Segoe UI", 12), text_color="#6b7280")
+            st = {"view": view, "msg": msg, "wrap": wrap, "photo": None,
+                  "draw": None, "size": (int(figsize[0] * 100), int(figsize[1] * 100))}
+            self._tab_figs[key] = st
+            wrap.bind("<Configure>", lambda e, k=key: self._on_tab_resized(k), add="+")
+        return st
+
+    def _tab_show(self, key, message=None):
+        """Hiện ảnh chart của tab, hoặc ẩn ảnh và hiện thông báo."""
+        st = self._tab_figs[key]
+        widget = st["view"]
+        if message:
+            if self._rasterizer is not None:
+                self._rasterizer.cancel(key)
+            st["draw"] = None
+            widget.pack_forget()
+            st["msg"].configure(text=message)
+            if not st["msg"].winfo_manager():
+                st["msg"].pack(anchor="w", padx=12, pady=12)
+        else:
+            st["msg"].pack_forget()
+            if not widget.winfo_manager():
+                widget.pack(fill="both", expand=True)
+
+    def _tab_draw(self, key, draw):
+        """Gửi draw(fig, art) sang thread nền; yêu cầu mới nhất của tab sẽ thắng.
+        draw chỉ đọc dữ liệu đã tính sẵn, giữ artist trong art (không ghi vào state của Tk)."""
+        st = self._tab_figs[key]
+        st["draw"] = draw
+        self._tab_show(key)
+        wrap = st["wrap"]
+        w, h = wrap.winfo_width(), wrap.winfo_height()
+        if w > 100 and h > 100:
+            st["size"] = (w, h)
+        if self._rasterizer is None:
+            self._rasterizer = AggRasterizer()
+        self._rasterizer.submit(key, draw, *st["size"])
+        if not self._raster_polling:
+            self._raster_polling = True
+            self.after(30, self._poll_rasterizer)
+
+    def _poll_rasterizer(self):
+        """Main thread: lấy bitmap đã vẽ xong và đẩy lên Label của tab."""
+        from PIL import Image, ImageTk
+        for key, img, err in self._rasterizer.results():
+            st = self._tab_figs.get(key)
+            if st is None:
+                continue
+            if err is not None:
+                self._log(f"⚠️ Lỗi vẽ biểu đồ ({key}): {err}")
+                continue
+            st["photo"] = ImageTk.PhotoImage(Image.fromarray(img, "RGBA"))
+            st["view"].configure(image=st["photo"])
+        if self._rasterizer.busy():
+            self.after(30, self._poll_rasterizer)
+        else:
+            self._raster_polling = False
+
+    def _on_tab_resized(self, key):
+        """Đổi kích thước vùng chart -> vẽ lại đúng cỡ (gom nhiều sự kiện Configure)."""
+        st = self._tab_figs.get(key)
+        if st is None or st["draw"] is None:
+            return
+        if st.get("resize_job"):
+            self.after_cancel(st["resize_job"])
+
+        def _redraw():
+            st["resize_job"] = None
+            w, h = st["wrap"].winfo_width(), st["wrap"].winfo_height()
+            if st["draw"] is not None and abs(w - st["size"][0]) + abs(h - st["size"][1]) > 4:
+                self._tab_draw(key, st["draw"])
+
+        st["resize_job"] = self.after(150, _redraw)
+
     def _render_report_zone_charts_on_gui(self):
         """Báo cáo tổng hợp theo Zone_Bx (đẹp/pro):
         - Sort giảm dần
@@ -685,275 +3290,171 @@ class App(ctk.CTk):
         if getattr(self, "report_wrap", None) is None:
             return
 
-        for w in self.report_wrap.winfo_children():
-            w.destroy()
+        # --------- UI: thanh điều khiển Top N + vùng chart (dựng 1 lần) ----------
+        if getattr(self, "report_top_var", None) is None:
+            ctrl = ctk.CTkFrame(self.report_wrap, fg_color="transparent")
+            ctrl.pack(fill="x", padx=10, pady=(0, 4))
+
+            ctk.CTkLabel(ctrl, text="Top:", font=("Segoe UI", 12)).pack(side="left")
+            self.report_top_var = ctk.StringVar(value="12")  # mặc định top 12 zone
+            top_entry = ctk.CTkEntry(ctrl, width=60, textvariable=self.report_top_var)
+            top_entry.pack(side="left", padx=(6, 10))
+            ctk.CTkLabel(ctrl, text="(zones)", font=("Segoe UI", 12), text_color="#6b7280").pack(side="left")
+            # Enter: chỉ vẽ lại theo Top N, không tính lại số liệu
+            top_entry.bind("<Return>", lambda e: self._render_tab_if_dirty("Báo cáo"))
+
+            self._report_holder = ctk.CTkFrame(self.report_wrap, fg_color="transparent")
+            self._report_holder.pack(fill="both", expand=True, padx=10, pady=(0, 0))
+        self._tab_figure("report", self._report_holder, (12.6, 6.8))
+
+        # số liệu zone còn đúng (chỉ đổi Top N) -> vẽ lại từ series đã tính
+        if getattr(self, "_report_series", None) is not None and not self._render_deps.is_dirty("report_data"):
+            self._draw_report_zone_charts()
+            return
+
+        self._report_series = None
+        data_sig = self._render_deps.signature("report_data")
 
         if self.view_df.empty:
-            ctk.CTkLabel(self.report_wrap, text="Chưa có dữ liệu để lập báo cáo.",
-                        font=("Segoe UI", 12), text_color="#6b7280")\
-                .pack(anchor="w", padx=12, pady=12)
+            self._tab_show("report", "Chưa có dữ liệu để lập báo cáo.")
             return
 
-        df = self.view_df.copy()
+        df = self.view_df
 
         if "Zone_Bx" not in df.columns:
-            ctk.CTkLabel(self.report_wrap, text="Thiếu cột Zone_Bx để tổng hợp theo vùng.",
-                        font=("Segoe UI", 12), text_color="#6b7280")\
-                .pack(anchor="w", padx=12, pady=12)
-            return
-
-        # tìm cột % so sánh
-        pct_col = None
-        for c in df.columns:
-            if "so sánh" in str(c).lower() and "%" in str(c):
-                pct_col = c
-                break
-        if pct_col is None:
-            for c in df.columns:
-                if "percent" in str(c).lower() or "pct" in str(c).lower():
-                    pct_col = c
-                    break
-        if pct_col is None:
-            ctk.CTkLabel(self.report_wrap, text="Thiếu cột 'SO SÁNH (%)' để xác định vi phạm.",
-                        font=("Segoe UI", 12), text_color="#6b7280")\
-                .pack(anchor="w", padx=12, pady=12)
+            self._tab_show("report", "Thiếu cột Zone_Bx để tổng hợp theo vùng.")
             return
 
         # ngưỡng từ UI
-        try:
-            low_thr = float(self.low_pct_str.get())
-        except Exception:
-            low_thr = 95.0
-        try:
-            high_thr = float(self.high_pct_str.get())
-        except Exception:
-            high_thr = 110.0
+        low_thr, high_thr = self._ui_thresholds()
 
-        # chuẩn hóa
-        df[pct_col] = pd.to_numeric(df[pct_col], errors="coerce")
-        df["Zone_Bx"] = df["Zone_Bx"].astype(str).str.strip()
-        df = df.dropna(subset=["Zone_Bx", pct_col])
-
-        if df.empty:
-            ctk.CTkLabel(self.report_wrap, text="Không có dữ liệu hợp lệ để tổng hợp.",
-                        font=("Segoe UI", 12), text_color="#6b7280")\
-                .pack(anchor="w", padx=12, pady=12)
+        # vi phạm = U so với k·Uđd (như báo cáo Zone_Bx / tab Độ nhạy), từ bảng vi phạm của cube
+        # nếu bộ lọc quy về được chiều cube, không thì gộp thẳng view_df theo cùng quy tắc
+        sub = self._violation_view(low_thr, high_thr)
+        if sub is None:
+            self._tab_show("report", "Thiếu cột U / Uđd / TBA để xác định vi phạm.")
             return
+        low_tba, low_times, high_tba, high_times = VoltageCube.zone_violation_counts(sub)
 
-        st_col = detect_station_column(df) or "TRẠM BIẾN ÁP"
-        if st_col not in df.columns:
-            st_col = None
+        self._report_series = (low_tba, low_times, high_tba, high_times, low_thr, high_thr)
+        self._render_deps.mark_clean("report_data", data_sig)
+        self._draw_report_zone_charts()
 
-        low_df = df[df[pct_col] <= low_thr]
-        high_df = df[df[pct_col] >= high_thr]
-
-        def _agg(dfx):
-            if dfx.empty:
-                return pd.Series(dtype="int64"), pd.Series(dtype="int64")
-            if st_col:
-                n_tba = dfx.groupby("Zone_Bx")[st_col].nunique()
-            else:
-                n_tba = dfx.groupby("Zone_Bx").size()
-            n_times = dfx.groupby("Zone_Bx").size()
-            return n_tba, n_times
-
-        low_tba, low_times = _agg(low_df)
-        high_tba, high_times = _agg(high_df)
-
-        # --------- UI: thanh điều khiển Top N ----------
-        ctrl = ctk.CTkFrame(self.report_wrap, fg_color="transparent")
-        ctrl.pack(fill="x", padx=10, pady=(0, 4))
-
-        ctk.CTkLabel(ctrl, text="Top:", font=("Segoe UI", 12)).pack(side="left")
-        top_var = ctk.StringVar(value="12")  # mặc định top 12 zone
-        top_entry = ctk.CTkEntry(ctrl, width=60, textvariable=top_var)
-        top_entry.pack(side="left", padx=(6, 10))
-
-        ctk.CTkLabel(ctrl, text="(zones)", font=("Segoe UI", 12), text_color="#6b7280").pack(side="left")
+    def _draw_report_zone_charts(self):
+        """Vẽ 4 biểu đồ zone lên figure dùng lâu dài (trên thread nền); nếu danh sách
+        zone không đổi thì chỉ cập nhật độ dài bar + nhãn số."""
+        if getattr(self, "_report_series", None) is None:
+            return
+        low_tba, low_times, high_tba, high_times, low_thr, high_thr = self._report_series
 
-        # vùng vẽ chart
-        chart_holder = ctk.CTkFrame(self.report_wrap, fg_color="transparent")
-        chart_holder.pack(fill="both", expand=True, padx=10, pady=(0, 0))
+        top_n = self._report_top_n()
 
-        import matplotlib.pyplot as plt
-        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-
-        def _topn(s: pd.Series, n: int):
+        # --- 1) LOẠI nan/None/"" khỏi Zone_Bx ngay trong các series ---
+        def _clean_zone_index(s: pd.Series) -> pd.Series:
             if s is None or s.empty:
-                return s
-            s2 = s.sort_values(ascending=False)
-            return s2.head(n)
-
-        def _barh(ax, s: pd.Series, title: str, xlabel: str, color: str):
-            if s is None or s.empty:
-                ax.text(0.5, 0.5, "Không có dữ liệu", ha="center", va="center")
-                ax.set_axis_off()
-                return
-
-            y = list(s.index)[::-1]
-            x = list(s.values)[::-1]
-
-            ax.barh(y, x, color=color)
-            ax.set_title(title, fontsize=12, pad=10)
-            #ax.set_xlabel(xlabel)
-            ax.set_xlabel(xlabel, labelpad=6)
-
-
-            # Grid gọn
-            ax.grid(axis="x", linestyle="--", alpha=0.25)
-
-            # Chừa biên phải để số không bị cắt
-            xmax = max(x) if x else 0
-            ax.set_xlim(0, xmax * 1.12 if xmax > 0 else 1)
-
-            # Annotate (đặt sát trong plot, tránh đâm ra ngoài)
-            pad = max(0.01 * xmax, 0.2)
-            for yi, xi in zip(y, x):
-                ax.text(xi + pad, yi, f"{int(xi)}", va="center", fontsize=9, clip_on=False)
-
-            # Tick gọn + chừa khoảng cho nhãn y
-            ax.tick_params(axis="y", labelsize=9, pad=6)
-            ax.tick_params(axis="x", labelsize=9)
-
-        def _render():
-            # clear canvas cũ
-            for w in chart_holder.winfo_children():
-                w.destroy()
-
-            # đọc top n
-            try:
-                top_n = int(top_var.get())
-                top_n = max(5, min(top_n, 30))
-            except Exception:
-                top_n = 12
-
-            # chọn top theo “tổng số lần” để phản ánh mức độ nóng (business-friendly)
-            # đọc top n
-            try:
-                top_n = int(top_var.get())
-                top_n = max(5, min(top_n, 30))
-            except Exception:
-                top_n = 12
-
-            # --- 1) LOẠI nan/None/"" khỏi Zone_Bx ngay trong các series ---
-            def _clean_zone_index(s: pd.Series) -> pd.Series:
-                if s is None or s.empty:
-                    return pd.Series(dtype="int64")
-                s2 = s.copy()
-                s2.index = s2.index.astype(str).str.strip()
-                bad = s2.index.str.lower().isin(["nan", "none", ""])
-                s2 = s2[~bad]
-                return s2
-
-            l_tba0 = _clean_zone_index(low_tba).fillna(0).astype(int) if low_tba is not None else pd.Series(dtype="int64")
-            l_tim0 = _clean_zone_index(low_times).fillna(0).astype(int) if low_times is not None else pd.Series(dtype="int64")
-            h_tba0 = _clean_zone_index(high_tba).fillna(0).astype(int) if high_tba is not None else pd.Series(dtype="int64")
-            h_tim0 = _clean_zone_index(high_times).fillna(0).astype(int) if high_times is not None else pd.Series(dtype="int64")
-
-            # --- 2) CHỌN TOP N theo "điểm nóng" tổng hợp, để đúng Top=5 ---
-            # score = low_times + high_times (ưu tiên theo số lần vi phạm)
-            score = l_tim0.add(h_tim0, fill_value=0).astype(int)
-            score = score[score > 0].sort_values(ascending=False)
-
-            zones = score.head(top_n).index.tolist()
-
-            if not zones:
-                ctk.CTkLabel(chart_holder, text="Không có dữ liệu vi phạm theo ngưỡng hiện tại.",
-                            font=("Segoe UI", 12), text_color="#6b7280")\
-                    .pack(anchor="w", padx=12, pady=12)
-                return
-
-            # --- 3) Reindex theo đúng zones, bỏ zone = 0 để biểu đồ gọn ---
-            def _re(s0: pd.Series) -> pd.Series:
-                if s0 is None or s0.empty:
-                    return pd.Series(index=zones, data=[0]*len(zones), dtype="int64")
-                s2 = s0.reindex(zones).fillna(0).astype(int)
-                return s2
-
-            l_tba = _re(l_tba0)
-            l_tim = _re(l_tim0)
-            h_tba = _re(h_tba0)
-            h_tim = _re(h_tim0)
-
-            # sort hiển thị theo score (để 4 chart cùng thứ tự zone, nhìn "report")
-            order = score.reindex(zones).fillna(0).sort_values(ascending=True).index.tolist()  # ascending để barh đẹp (dưới lớn trên nhỏ)
-            l_tba = l_tba.reindex(order)
-            l_tim = l_tim.reindex(order)
-            h_tba = h_tba.reindex(order)
-            h_tim = h_tim.reindex(order)
-
+                return pd.Series(dtype="int64")
+            s2 = s.copy()
+            s2.index = s2.index.astype(str).str.strip()
+            bad = s2.index.str.lower().isin(["nan", "none", ""])
+            s2 = s2[~bad]
+            return s2
 
+        l_tba0 = _clean_zone_index(low_tba).fillna(0).astype(int)
+        l_tim0 = _clean_zone_index(low_times).fillna(0).astype(int)
+        h_tba0 = _clean_zone_index(high_tba).fillna(0).astype(int)
+        h_tim0 = _clean_zone_index(high_times).fillna(0).astype(int)
 
-            # figure: 2x2, chiều cao theo số zone (tối thiểu 6.8)
-            h = max(6.8, 0.35 * len(zones) + 2.8)
-            fig = plt.Figure(figsize=(12.6, h), dpi=100)
-
-            ax1 = fig.add_subplot(221)
-            ax2 = fig.add_subplot(222)
-            ax3 = fig.add_subplot(223)
-            ax4 = fig.add_subplot(224)
+        # --- 2) CHỌN TOP N theo "điểm nóng" tổng hợp, để đúng Top=5 ---
+        # score = low_times + high_times (ưu tiên theo số lần vi phạm)
+        score = l_tim0.add(h_tim0, fill_value=0).astype(int)
+        score = score[score > 0].sort_values(ascending=False)
 
+        zones = score.head(top_n).index.tolist()
 
+        if not zones:
+            self._tab_show("report", "Không có dữ liệu vi phạm theo ngưỡng hiện tại.")
+            return
 
-            # suptitle: hạ xuống để không đè title subplot
-            fig.suptitle(
-                "BÁO CÁO TỔNG HỢP VI PHẠM ĐIỆN ÁP THEO ZONE",
-                fontsize=15, fontweight="bold", y=0.955
-            )
+        # sort hiển thị theo score (để 4 chart cùng thứ tự zone, nhìn "report")
+        order = score.reindex(zones).fillna(0).sort_values(ascending=True).index.tolist()  # ascending để barh đẹp (dưới lớn trên nhỏ)
+
+        def _re(s0: pd.Series) -> pd.Series:
+            return s0.reindex(order).fillna(0).astype(int)
+
+        specs = [
+            (_re(l_tba0), f"TBA vi phạm THẤP (≤{low_thr}%)", "Số TBA", "#ef4444"),
+            (_re(l_tim0), f"Tổng số lần THẤP (≤{low_thr}%)", "Số lần", "#7c3aed"),
+            (_re(h_tba0), f"TBA vi phạm CAO (≥{high_thr}%)", "Số TBA", "#10b981"),
+            (_re(h_tim0), f"Tổng số lần CAO (≥{high_thr}%)", "Số lần", "#2563eb"),
+        ]
+
+        def draw(fig, art):
+            # (thread nền) figure 2x2: tạo axes + layout 1 lần duy nhất
+            if not fig.axes:
+                axes = [fig.add_subplot(221), fig.add_subplot(222), fig.add_subplot(223), fig.add_subplot(224)]
+                # suptitle: hạ xuống để không đè title subplot
+                fig.suptitle("BÁO CÁO TỔNG HỢP VI PHẠM ĐIỆN ÁP THEO ZONE",
+                             fontsize=15, fontweight="bold", y=0.955)
+                fig.subplots_adjust(
+                    left=0.15, right=0.9,
+                    top=0.80, bottom=0.14,      # bottom tăng để không cắt xlabel; top giảm để không đè title
+                    wspace=0.24, hspace=0.52    # tăng hspace để title + xlabel không đè nhau
+                )
+                # ---- DỊCH RIÊNG 2 BIỂU ĐỒ BÊN PHẢI SANG PHẢI ----
+                for ax in (axes[1], axes[3]):
+                    pos = ax.get_position()
+                    ax.set_position([pos.x0 + 0.08, pos.y0, pos.width, pos.height])
+                art["bars"] = [None] * 4
+            axes = fig.axes[:4]
 
-            _barh(ax1, l_tba, f"TBA vi phạm THẤP (≤{low_thr}%)", "Số TBA", "#ef4444")
-            _barh(ax2, l_tim, f"Tổng số lần THẤP (≤{low_thr}%)", "Số lần", "#7c3aed")
-            _barh(ax3, h_tba, f"TBA vi phạm CAO (≥{high_thr}%)", "Số TBA", "#10b981")
-            _barh(ax4, h_tim, f"Tổng số lần CAO (≥{high_thr}%)", "Số lần", "#2563eb")
+            for i, (ax, (s, title, xlabel, color)) in enumerate(zip(axes, specs)):
+                art["bars"][i] = self._barh_update(ax, art["bars"][i], s, title, xlabel, color)
 
-            # ==== AUTO chừa biên trái vừa đủ: tránh cắt chữ + tránh thừa khoảng trắng ====
-            try:
-                zones_show = [str(z) for z in order]
-                max_len = max((len(z) for z in zones_show), default=8)
-
-                # bắt đầu từ 0.18 (đỡ thừa trắng), tăng nhẹ theo độ dài zone
-                left = 0.18 + min(0.12, max(0.0, (max_len - 6) * 0.010))
-                left = min(max(left, 0.18), 0.32)  # chặn trong [0.18..0.32]
-            except Exception:
-                left = 0.22
-
-            # Layout 1 lần duy nhất (BỎ tight_layout để khỏi “đánh nhau”)
-            fig.subplots_adjust(
-                left=0.15, right=0.9,
-                top=0.80, bottom=0.14,      # bottom tăng để không cắt xlabel; top giảm để không đè title
-                wspace=0.24, hspace=0.52    # tăng hspace để title + xlabel không đè nhau
-            )
-            # ---- DỊCH RIÊNG 2 BIỂU ĐỒ BÊN PHẢI SANG PHẢI ----
-            for ax in (ax2, ax4):
-                pos = ax.get_position()
-                ax.set_position([
-                    pos.x0 + 0.08,   # 👈 tăng giá trị này nếu muốn sang phải thêm
-                    pos.y0,
-                    pos.width,
-                    pos.height
-                ])
-            # optional: đồng bộ label (không bắt buộc)
             try:
                 fig.align_labels()
             except Exception:
                 pass
 
+        self._tab_draw("report", draw)
 
+    def _report_top_n(self) -> int:
+        """Top N zone từ ô nhập (5..30, mặc định 12)."""
+        try:
+            top_n = int(self.report_top_var.get())
+            return max(5, min(top_n, 30))
+        except Exception:
+            return 12
+
+    @staticmethod
+    def _barh_update(ax, state, s: pd.Series, title: str, xlabel: str, color: str):
+        """barh có nhãn số; cùng danh sách zone -> set_width tại chỗ, khác -> vẽ lại axes."""
+        y = [str(z) for z in s.index]
+        x = [int(v) for v in s.values]
+        xmax = max(x) if x else 0
+        pad = max(0.01 * xmax, 0.2)
+
+        if state is None or state["zones"] != y:
+            ax.cla()
+            ax.set_axis_on()
+            bars = ax.barh(y, x, color=color)
+            texts = [ax.text(xi + pad, yi, f"{xi}", va="center", fontsize=9, clip_on=False)
+                     for yi, xi in zip(y, x)]
+            # Grid gọn + tick gọn, chừa khoảng cho nhãn y
+            ax.grid(axis="x", linestyle="--", alpha=0.25)
+            ax.tick_params(axis="y", labelsize=9, pad=6)
+            ax.tick_params(axis="x", labelsize=9)
+            ax.set_xlabel(xlabel, labelpad=6)
+            state = {"zones": y, "bars": bars, "texts": texts}
+        else:
+            for rect, t, xi in zip(state["bars"], state["texts"], x):
+                rect.set_width(xi)
+                t.set_x(xi + pad)
+                t.set_text(f"{xi}")
 
-
-
-            canvas = FigureCanvasTkAgg(fig, master=chart_holder)
-            canvas.get_tk_widget().pack(fill="both", expand=True)
-            canvas.draw()
-
-            self._report_fig = fig
-            self._report_canvas = canvas
-
-        # render lần đầu + bind Enter để refresh
-        _render()
-        top_entry.bind("<Return>", lambda e: _render())
-
-
+        ax.set_title(title, fontsize=12, pad=10)
+        # Chừa biên phải để số không bị cắt
+        ax.set_xlim(0, xmax * 1.12 if xmax > 0 else 1)
+        return state
 
     def _on_dashboard_tab_changed(self, *_):
         """CTkTabview sẽ gọi callback khi đổi tab (thường không truyền tham số).
@@ -962,156 +3463,247 @@ class App(ctk.CTk):
             tab_name = self.dashboard_tabs.get()
         except Exception:
             return
-
-        if tab_name == "Heatmap":
-            self._render_heatmap_on_gui()
-        elif tab_name == "Phân phối":
-            self._render_dist_on_gui()
-        elif tab_name == "Báo cáo":
-            self._render_report_zone_charts_on_gui()
+        self._render_tab_if_dirty(tab_name)
+
+    def _render_tab_if_dirty(self, tab_name):
+        """Vẽ tab khi nó hiện ra và chỉ khi input phụ thuộc đã đổi (đổi tab qua lại = 0 chi phí)."""
+        renderers = {
+            "Heatmap": self._render_heatmap_on_gui,
+            "Phân phối": self._render_dist_on_gui,
+            "Báo cáo": self._render_report_zone_charts_on_gui,
+            "Độ nhạy": self._render_sensitivity_on_gui,
+        }
+        render = renderers.get(tab_name)
+        if render is None or not self._render_deps.is_dirty(tab_name):
+            return
+        sig = self._render_deps.signature(tab_name)
+        render()
+        self._render_deps.mark_clean(tab_name, sig)
 
 
+    @PERF.traced("heatmap")
     def _render_heatmap_on_gui(self):
-        """Vẽ heatmap trực tiếp vào tab Heatmap."""
+        """Vẽ heatmap trực tiếp vào tab Heatmap (figure/AxesImage tạo 1 lần, sau đó set_data)."""
         if getattr(self, "hm_wrap", None) is None:
             return
 
-        # clear vùng vẽ cũ
-        for w in self.hm_wrap.winfo_children():
-            w.destroy()
+        self._tab_figure("heatmap", self.hm_wrap, (7.0, 4.2))
 
         if self.view_df.empty:
-            ctk.CTkLabel(self.hm_wrap, text="Chưa có dữ liệu để vẽ heatmap.",
-                         font=("Segoe UI", 12), text_color="#6b7280")\
-                .pack(anchor="w", padx=12, pady=12)
+            self._tab_show("heatmap", "Chưa có dữ liệu để vẽ heatmap.")
             return
 
-        df = self.view_df.copy()
+        df = self.view_df
         dt_col = self.dt_col or detect_datetime_column(df)
         vcol = self.voltage_col
 
         if not dt_col or dt_col not in df.columns or not vcol or vcol not in df.columns:
-            ctk.CTkLabel(self.hm_wrap, text="Thiếu cột thời gian hoặc cột U để vẽ heatmap.",
-                         font=("Segoe UI", 12), text_color="#6b7280")\
-                .pack(anchor="w", padx=12, pady=12)
-            return
-
-        # ghép thêm giờ nếu có cột giờ
-        hour_col = None
-        for c in df.columns:
-            if "giờ" in str(c).lower() or "hour" in str(c).lower():
-                hour_col = c
-                break
-
-        dt = pd.to_datetime(df[dt_col], errors="coerce", dayfirst=True)
-        if hour_col:
-            hour_val = pd.to_numeric(df[hour_col], errors="coerce").fillna(0)
-            dt = dt + pd.to_timedelta(hour_val, unit="h")
-
-        v = pd.to_numeric(df[vcol], errors="coerce")
-        df["__date"] = dt.dt.date
-        df["__hour"] = dt.dt.hour
-        df["__v"] = v
-        tmp = df.dropna(subset=["__date", "__hour", "__v"])
-
-        if tmp.empty:
-            ctk.CTkLabel(self.hm_wrap, text="Không có giá trị hợp lệ để vẽ heatmap.",
-                         font=("Segoe UI", 12), text_color="#6b7280")\
-                .pack(anchor="w", padx=12, pady=12)
-            return
-
-        pivot = tmp.pivot_table(index="__hour", columns="__date", values="__v", aggfunc="mean")
-        pivot = pivot.reindex(range(24))
-
-        # ---- vẽ matplotlib embed ----
-        import matplotlib.pyplot as plt
-        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-
-        fig = plt.Figure(figsize=(7.0, 4.2), dpi=100)
-        ax = fig.add_subplot(111)
+            self._tab_show("heatmap", "Thiếu cột thời gian hoặc cột U để vẽ heatmap.")
+            return
 
-        data = pivot.values
-        im = ax.imshow(data, aspect="auto", origin="lower")
+        stat, period = self._heatmap_options()
+        # mean/min/max lấy thẳng từ cube (sum/count/min/max); P95 cần U từng dòng
+        sub = self._cube_view() if dt_col == self.dt_col and stat != "p95" else None
+        if sub is not None:
+            data, cols, period = VoltageCube.day_hour_grid(sub, stat, period)
+        else:
+            dt = build_timestamps(df, dt_col)
+            data, cols, period = heatmap_grid(dt.to_numpy(), dt.dt.hour.to_numpy(dtype=float, na_value=np.nan),
+                                              pd.to_numeric(df[vcol], errors="coerce").to_numpy(dtype=float),
+                                              stat=stat, period=period)
 
-        ax.set_title("Heatmap U trung bình theo Giờ và Ngày", fontsize=12)
-        ax.set_ylabel("Giờ")
-        ax.set_xlabel("Ngày")
+        if data.shape[1] == 0:
+            self._tab_show("heatmap", "Không có giá trị hợp lệ để vẽ heatmap.")
+            return
 
-        # ticks ngày (giảm số tick cho đỡ rối)
-        cols = list(pivot.columns)
-        if len(cols) > 0:
+        title = f"Heatmap U {HEATMAP_STATS[stat]} theo Giờ và {HEATMAP_PERIODS[period]}"
+        xlabel = HEATMAP_PERIODS[period]
+
+        def draw(fig, art):
+            # (thread nền) AxesImage + colorbar tạo 1 lần, sau đó set_data
+            ncols = data.shape[1]
+            extent = (-0.5, ncols - 0.5, -0.5, data.shape[0] - 0.5)
+
+            if art.get("im") is None:
+                ax = fig.add_subplot(111)
+                im = ax.imshow(data, aspect="auto", origin="lower", extent=extent)
+                ax.set_ylabel("Giờ")
+                ax.set_yticks(range(0, 24, 2))
+                ax.set_yticklabels([str(i) for i in range(0, 24, 2)], fontsize=9)
+                fig.colorbar(im, ax=ax, fraction=0.046, pad=0.04, label="U (kV)")
+                art["ax"], art["im"] = ax, im
+            else:
+                ax, im = art["ax"], art["im"]
+                im.set_data(data)
+                im.set_extent(extent)
+            ax.set_title(title, fontsize=12)
+            ax.set_xlabel(xlabel)
+
+            # thang màu theo dữ liệu mới (bỏ NaN: ô không có số liệu)
+            finite = data[np.isfinite(data)]
+            if finite.size:
+                vmin, vmax = float(finite.min()), float(finite.max())
+                im.set_clim(vmin, vmax if vmax > vmin else vmin + 1e-9)
+            ax.set_xlim(extent[0], extent[1])
+            ax.set_ylim(extent[2], extent[3])
+
+            # ticks ngày (giảm số tick cho đỡ rối)
             step = max(1, len(cols) // 10)
             xticks = list(range(0, len(cols), step))
             ax.set_xticks(xticks)
             ax.set_xticklabels([str(cols[i]) for i in xticks], rotation=45, ha="right", fontsize=9)
 
-        ax.set_yticks(range(0, 24, 2))
-        ax.set_yticklabels([str(i) for i in range(0, 24, 2)], fontsize=9)
+            fig.tight_layout()
+
+        self._tab_draw("heatmap", draw)
+
+    def _get_sweep(self) -> Optional[ThresholdSweep]:
+        """ThresholdSweep của view_df hiện tại; dựng lại khi view/cột đổi."""
+        df = self.view_df
+        vcol, un_col = self.voltage_col, self.nominal_col
+        station_col = detect_station_column(df) if not df.empty else None
+        if not station_col or not vcol or vcol not in df.columns or not un_col or un_col not in df.columns:
+            return None
+        key = (self._view_version, vcol, un_col)
+        if self._sweep_cache is None or self._sweep_cache[:3] != key:
+            self._sweep_cache = key + (ThresholdSweep.build(df, station_col, vcol, un_col),)
+        return self._sweep_cache[3]
+
+    def _render_sensitivity_on_gui(self):
+        """Tab Độ nhạy: số TBA / số lần vi phạm khi quét ngưỡng THẤP và CAO,
+        tổng (hàng trên) và theo Zone_Bx (hàng dưới), kèm vạch ngưỡng đang dùng."""
+        if getattr(self, "sens_wrap", None) is None:
+            return
 
-        fig.colorbar(im, ax=ax, fraction=0.046, pad=0.04, label="U (kV)")
-        fig.tight_layout()
+        self._tab_figure("sens", self.sens_wrap, (10.0, 6.0))
 
-        canvas = FigureCanvasTkAgg(fig, master=self.hm_wrap)
-        canvas.get_tk_widget().pack(fill="both", expand=True)
-        canvas.draw()
+        if self.view_df.empty:
+            self._tab_show("sens", "Chưa có dữ liệu để phân tích độ nhạy.")
+            return
+        sweep = self._get_sweep()
+        if sweep is None or len(sweep.stations) == 0:
+            self._tab_show("sens", "Thiếu cột U / Uđd / TBA hợp lệ để phân tích độ nhạy.")
+            return
 
-        # giữ tham chiếu tránh bị GC
-        self._hm_fig = fig
-        self._hm_canvas = canvas
+        low_thr, high_thr = self._ui_thresholds()
+        sides = []
+        for side, (a, b), cur, name in (("low", SWEEP_LOW_RANGE, low_thr, "THẤP (≤ t%)"),
+                                        ("high", SWEEP_HIGH_RANGE, high_thr, "CAO (≥ t%)")):
+            thr = np.arange(a, b + SWEEP_STEP / 2, SWEEP_STEP)
+            times, n_tba = sweep.curve(thr, side)
+            zc = sweep.zone_curves(thr, side)
+            zc = zc.loc[zc.max(axis=1).sort_values(ascending=False).index[:6]]
+            sides.append((thr, times, n_tba, zc, cur, name))
+
+        def draw(fig, art):
+            # (thread nền) 2×2: tổng (trên) + theo zone (dưới); vẽ lại khi dữ liệu/ngưỡng đổi
+            fig.clear()
+            for col, (thr, times, n_tba, zc, cur, name) in enumerate(sides):
+                ax = fig.add_subplot(2, 2, col + 1)
+                ax.plot(thr, n_tba, color="#2563eb", lw=1.8, label="Số TBA")
+                ax.set_ylabel("Số TBA vi phạm", color="#2563eb")
+                ax2 = ax.twinx()
+                ax2.plot(thr, times, color="#ef4444", lw=1.2, ls="--", label="Số lần")
+                ax2.set_ylabel("Số lần vi phạm", color="#ef4444")
+                ax.axvline(cur, color="#6b7280", lw=1, ls=":")
+                ax.set_title(f"Vi phạm {name}", fontsize=11)
+                ax.grid(True, linestyle="--", alpha=0.3)
+
+                axz = fig.add_subplot(2, 2, col + 3)
+                for zone, row in zc.iterrows():
+                    axz.plot(thr, row.to_numpy(), lw=1.2, label=str(zone))
+                axz.axvline(cur, color="#6b7280", lw=1, ls=":")
+                axz.set_xlabel("Ngưỡng t (% Uđd)")
+                axz.set_ylabel("Số TBA vi phạm")
+                axz.grid(True, linestyle="--", alpha=0.3)
+                if len(zc):
+                    axz.legend(fontsize=8, loc="best")
+            fig.tight_layout()
+
+        self._tab_draw("sens", draw)
+
+    def _heatmap_options(self):
+        """(stat, period) từ điều khiển tab Heatmap; period None = tự gộp theo độ dài."""
+        stat_lbl = self.hm_stat_var.get() if getattr(self, "hm_stat_var", None) is not None else ""
+        per_lbl = self.hm_period_var.get() if getattr(self, "hm_period_var", None) is not None else ""
+        stat = next((k for k, v in HEATMAP_STATS.items() if v == stat_lbl), "mean")
+        period = next((k for k, v in HEATMAP_PERIODS.items() if v == per_lbl), None)
+        return stat, period
 
     def _render_dist_on_gui(self):
-        """Vẽ histogram + boxplot trực tiếp vào tab Phân phối."""
+        """Vẽ histogram + boxplot trực tiếp vào tab Phân phối (cập nhật artist tại chỗ)."""
         if getattr(self, "dist_wrap", None) is None:
             return
 
-        for w in self.dist_wrap.winfo_children():
-            w.destroy()
+        self._tab_figure("dist", self.dist_wrap, (7.0, 4.2))
 
         if self.view_df.empty:
-            ctk.CTkLabel(self.dist_wrap, text="Chưa có dữ liệu để vẽ phân phối.",
-                         font=("Segoe UI", 12), text_color="#6b7280")\
-                .pack(anchor="w", padx=12, pady=12)
+            self._tab_show("dist", "Chưa có dữ liệu để vẽ phân phối.")
             return
 
         vcol = self.voltage_col
         if not vcol or vcol not in self.view_df.columns:
-            ctk.CTkLabel(self.dist_wrap, text="Chưa xác định được cột U để vẽ phân phối.",
-                         font=("Segoe UI", 12), text_color="#6b7280")\
-                .pack(anchor="w", padx=12, pady=12)
+            self._tab_show("dist", "Chưa xác định được cột U để vẽ phân phối.")
             return
 
-        v = pd.to_numeric(self.view_df[vcol], errors="coerce").dropna()
-        if v.empty:
-            ctk.CTkLabel(self.dist_wrap, text="Không có giá trị U hợp lệ.",
-                         font=("Segoe UI", 12), text_color="#6b7280")\
-                .pack(anchor="w", padx=12, pady=12)
+        summary = self._dist_summary(bins=30)
+        if summary is None:
+            self._tab_show("dist", "Không có giá trị U hợp lệ.")
             return
-
-        import matplotlib.pyplot as plt
-        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-
-        fig = plt.Figure(figsize=(7.0, 4.2), dpi=100)
-        ax1 = fig.add_subplot(121)
-        ax2 = fig.add_subplot(122)
-
-        ax1.hist(v.values, bins=30)
-        ax1.set_title("Histogram U", fontsize=11)
-        ax1.set_xlabel("U (kV)")
-        ax1.set_ylabel("Số lần")
-
-        ax2.boxplot(v.values, vert=True, showmeans=True)
-        ax2.set_title("Boxplot U", fontsize=11)
-        ax2.set_ylabel("U (kV)")
-
-        fig.suptitle(f"Phân phối U ({vcol})", fontsize=12)
-        fig.tight_layout()
-
-        canvas = FigureCanvasTkAgg(fig, master=self.dist_wrap)
-        canvas.get_tk_widget().pack(fill="both", expand=True)
-        canvas.draw()
-
-        self._dist_fig = fig
-        self._dist_canvas = canvas
+        counts, edges, stats = summary[:3]
+
+        def draw(fig, art):
+            # (thread nền) histogram + boxplot tạo 1 lần, sau đó cập nhật tại chỗ
+            if art.get("hist") is None:
+                ax1 = fig.add_subplot(121)
+                ax2 = fig.add_subplot(122)
+                _, _, art["hist"] = ax1.hist(edges[:-1], bins=edges, weights=counts)
+                ax1.set_title("Histogram U", fontsize=11)
+                ax1.set_xlabel("U (kV)")
+                ax1.set_ylabel("Số lần")
+
+                art["box"] = ax2.bxp([stats], vert=True, showmeans=True)
+                ax2.set_title("Boxplot U", fontsize=11)
+                ax2.set_ylabel("U (kV)")
+                art["suptitle"] = fig.suptitle("", fontsize=12)
+                art["axes"] = (ax1, ax2)
+            else:
+                ax1, ax2 = art["axes"]
+                # 30 bar cố định: chỉ đổi vị trí/độ rộng/chiều cao
+                for rect, c, x0, x1 in zip(art["hist"], counts, edges[:-1], edges[1:]):
+                    rect.set_x(x0)
+                    rect.set_width(x1 - x0)
+                    rect.set_height(c)
+                ax1.set_xlim(edges[0], edges[-1])
+                ax1.set_ylim(0, max(1, int(counts.max())) * 1.05)
+                self._update_boxplot_artists(art["box"], stats)
+                ax2.relim()
+                ax2.autoscale_view()
+
+            art["suptitle"].set_text(f"Phân phối U ({vcol})")
+            fig.tight_layout()
+
+        self._tab_draw("dist", draw)
+
+    @staticmethod
+    def _update_boxplot_artists(parts, s):
+        """Cập nhật các Line2D của boxplot (1 hộp) theo thống kê mới (dạng bxp), không
+        vẽ lại axes. Vị trí/độ rộng hộp giữ nguyên như lúc bxp() tạo ra."""
+        bx = np.asarray(parts["boxes"][0].get_xdata(), dtype=float)
+        cx = np.asarray(parts["caps"][0].get_xdata(), dtype=float)
+        lo, hi = float(bx.min()), float(bx.max())
+        cap_lo, cap_hi = float(cx.min()), float(cx.max())
+        pos = (lo + hi) / 2
+        parts["boxes"][0].set_data([lo, hi, hi, lo, lo], [s["q1"], s["q1"], s["q3"], s["q3"], s["q1"]])
+        parts["medians"][0].set_data([lo, hi], [s["med"], s["med"]])
+        parts["whiskers"][0].set_data([pos, pos], [s["q1"], s["whislo"]])
+        parts["whiskers"][1].set_data([pos, pos], [s["q3"], s["whishi"]])
+        parts["caps"][0].set_data([cap_lo, cap_hi], [s["whislo"], s["whislo"]])
+        parts["caps"][1].set_data([cap_lo, cap_hi], [s["whishi"], s["whishi"]])
+        fl = np.asarray(s["fliers"], dtype=float)
+        parts["fliers"][0].set_data(np.full(fl.shape, pos), fl)
+        if parts.get("means"):
+            parts["means"][0].set_data([pos], [s["mean"]])
 
 
     def _build_table(self, parent):
@@ -1236,8 +3828,9 @@ class App(ctk.CTk):
             cols = self.table["columns"]
             lines = ["\t".join(cols)]
             for iid in sels:
-                vals = [self.table.set(iid, c) for c in cols]
-                lines.append("\t".join(vals))
+                # đọc cả dòng trong 1 lần gọi Tk thay vì từng ô
+                vals = self.table.item(iid, "values")
+                lines.append("\t".join(str(v) for v in vals))
             text = "\n".join(lines)
             self.clipboard_clear()
             self.clipboard_append(text)
@@ -1265,6 +3858,7 @@ class App(ctk.CTk):
         import pandas as pd
         self.df = pd.DataFrame()
         self.view_df = pd.DataFrame()
+        self._on_dataset_changed()
         self._refresh_table()
         self._update_stats_and_chart()
         self._log("🧹 Đã xóa toàn bộ dữ liệu.")
@@ -1273,9 +3867,11 @@ class App(ctk.CTk):
         if not messagebox.askyesno("Xóa dữ liệu", "Bạn có chắc muốn xóa toàn bộ dữ liệu đã nạp và cache?"):
             return
         self.df = pd.DataFrame(); self.view_df = pd.DataFrame()
-        try:
-            if os.path.exists(CACHE_PATH): os.remove(CACHE_PATH)
-        except Exception: pass
+        self._on_dataset_changed()
+        self._session_writer.discard()
+        clear_session_cache()
+        shutil.rmtree(REPORT_CACHE_DIR, ignore_errors=True)
+        self._report_cache = {}
         try: self.table.delete(*self.table.get_children())
         except Exception: pass
         self._draw_chart_empty()
@@ -1310,11 +3906,13 @@ class App(ctk.CTk):
                 combined = new_df.copy()
             else:
                 combined = pd.concat([self.df, new_df], ignore_index=True, sort=False)
+                combined["_source_path"] = combined["_source_path"].astype("category")
 
             # Khử trùng toàn cục theo toàn bộ cột trừ "so tt"
             subset_all = [c for c in combined.columns if c != "so tt"]
             if subset_all:
-                combined = combined.drop_duplicates(subset=subset_all, keep="first").reset_index(drop=True)
+                with PERF.span("dedup", rows=len(combined)):
+                    combined = combined.drop_duplicates(subset=subset_all, keep="first").reset_index(drop=True)
 
             # Đánh lại so tt đẹp
             if "so tt" in combined.columns:
@@ -1327,137 +3925,7 @@ class App(ctk.CTk):
             # 2) ÁNH XẠ Zone_Bx (TRIỆT: dọn cột cũ + ép kiểu zone_code)
             # ==========================================================
             try:
-                db_path = get_db_path()
-
-                if "TRẠM BIẾN ÁP" not in self.df.columns:
-                    self._log("⚠️ Không tìm thấy cột 'TRẠM BIẾN ÁP' để ánh xạ Zone_Bx.")
-                elif not os.path.exists(db_path):
-                    self._log(f"⚠️ Không tìm thấy file DB_VietSub.xlsx tại: {db_path}")
-                else:
-                    # ====== MAP Zone_Bx (TRIỆT LỖI zone_code <NA>) ======
-                    buses_df = pd.read_excel(db_path, sheet_name="Buses")
-                    try:
-                        zone_df = pd.read_excel(db_path, sheet_name="Zones")
-                    except Exception:
-                        zone_df = pd.read_excel(db_path, sheet_name=1)
-
-                    zone_df = zone_df.rename(columns={"zone_name_vi": "Zone_Bx"})
-
-                    # --- helper: dò cột theo danh sách ứng viên ---
-                    def _pick_col(df, candidates):
-                        cols = {c.lower(): c for c in df.columns}
-                        for cand in candidates:
-                            if cand in df.columns:
-                                return cand
-                            if cand.lower() in cols:
-                                return cols[cand.lower()]
-                        return None
-
-                    # --- helper: ép zone_code an toàn (không rớt NA nếu dữ liệu kiểu "15.0", "15 ") ---
-                    def _coerce_zone_code(s):
-                        # s: Series
-                        x = s.copy()
-                        # ưu tiên numeric
-                        out = pd.to_numeric(x, errors="coerce")
-                        # các giá trị numeric ok
-                        ok = out.notna()
-                        # phần còn lại: xử lý string "15.0", "15 ", "015"
-                        if (~ok).any():
-                            t = x[~ok].astype(str).str.strip()
-                            t = t.str.replace(".0", "", regex=False)
-                            t = t.str.replace(",", ".", regex=False)
-                            t2 = pd.to_numeric(t, errors="coerce")
-                            out.loc[~ok] = t2
-                        return out.astype("Int64")
-
-                    # --- dò đúng tên cột trong DB (tránh DB đặt khác 'zone_code', 'Sym') ---
-                    bus_sym_col  = _pick_col(buses_df, ["Sym", "SYM", "sym"])
-                    bus_zone_col = _pick_col(buses_df, ["zone_code", "Zone_code", "ZONE_CODE", "zone", "Zone", "ZONE", "zone_id", "Zone_ID", "ZONE_ID"])
-                    zone_sym_col  = _pick_col(zone_df, ["Sym", "SYM", "sym"])
-                    zone_zone_col = _pick_col(zone_df, ["zone_code", "Zone_code", "ZONE_CODE", "zone", "Zone", "ZONE", "zone_id", "Zone_ID", "ZONE_ID"])
-
-                    if bus_sym_col is None or bus_zone_col is None:
-                        self._log(f"⚠️ DB 'Buses' thiếu cột Sym/zone_code (Sym={bus_sym_col}, zone={bus_zone_col}).")
-                    else:
-                        # chuẩn hóa Sym + zone_code trong buses_df
-                        buses_df = buses_df.copy()
-                        buses_df[bus_sym_col] = buses_df[bus_sym_col].astype(str).str.strip().str.upper()
-                        buses_df[bus_zone_col] = _coerce_zone_code(buses_df[bus_zone_col])
-
-                        if zone_sym_col is None or zone_zone_col is None:
-                            self._log(f"⚠️ DB 'Zones' thiếu cột Sym/zone_code (Sym={zone_sym_col}, zone={zone_zone_col}).")
-                        else:
-                            zone_df = zone_df.copy()
-                            zone_df[zone_sym_col] = zone_df[zone_sym_col].astype(str).str.strip().str.upper()
-                            zone_df[zone_zone_col] = _coerce_zone_code(zone_df[zone_zone_col])
-
-                            # ===== FIX TRIỆT ĐỂ: zone_code trong Buses là công thức -> pandas đọc ra <NA> =====
-                            # Nếu zone_code của Buses bị <NA> hàng loạt (do công thức mất cached result sau khi openpyxl save),
-                            # thì suy ra zone_code theo Sym từ sheet Zones (Zones đang là giá trị số ổn định).
-                            try:
-                                bus_zone_na = buses_df[bus_zone_col].notna().sum()
-                                if bus_zone_na == 0 or bus_zone_na < 10:
-                                    # map Sym -> zone_code từ Zones
-                                    sym2zone = zone_df.set_index(zone_sym_col)[zone_zone_col].to_dict()
-                                    buses_df[bus_zone_col] = buses_df[bus_sym_col].map(sym2zone)
-                                    buses_df[bus_zone_col] = _coerce_zone_code(buses_df[bus_zone_col])
-                                    self._log("ℹ️ zone_code(Buses) là công thức bị mất giá trị -> đã suy ra lại từ sheet Zones.")
-                            except Exception as _e:
-                                self._log(f"⚠️ Không suy ra được zone_code từ Zones: {_e}")
-
-                            # --- chuẩn hóa key join __jk như code của bạn ---
-                            import re, unicodedata
-
-                            def _norm_key(s: str) -> str:
-                                s = str(s).strip().lower()
-                                s = unicodedata.normalize("NFD", s)
-                                s = "".join(ch for ch in s if unicodedata.category(ch) != "Mn")
-                                s = s.replace("đ", "d").replace("Đ", "d")
-                                s = re.sub(r"\b\d{2,3}\s*kv\b", " ", s)
-                                s = re.sub(r"\b(tba|tram bien ap|nm|tdn|td|xm|nmd|nmdn|nmt|nha may|xi mang|kcn)\b", " ", s)
-                                s = re.sub(r"\b\d+[a-z]?\b", " ", s)
-                                s = re.sub(r"[,/()\-]", " ", s)
-                                s = re.sub(r"\s+", " ", s).strip()
-                                return s
-
-                            # Dọn cột cũ để tránh Sym_x/Sym_y / zone_code_x
-                            for col in ["__jk", "Sym", "zone_code", "Zone_Bx"]:
-                                if col in self.df.columns:
-                                    self.df.drop(columns=[col], inplace=True, errors="ignore")
-
-                            buses_df["__jk"] = buses_df["TBA_SCADA"].astype(str).map(_norm_key)
-                            self.df["__jk"]  = self.df["TRẠM BIẾN ÁP"].astype(str).map(_norm_key)
-
-                            # --- merge __jk -> Sym, zone_code (đặt tên chuẩn Sym/zone_code) ---
-                            bus_map = buses_df[["__jk", bus_sym_col, bus_zone_col]].drop_duplicates(subset=["__jk"]).copy()
-                            bus_map = bus_map.rename(columns={bus_sym_col: "Sym", bus_zone_col: "zone_code"})
-
-                            self.df = self.df.merge(bus_map, on="__jk", how="left")
-
-                            # --- merge Sym + zone_code -> Zone_Bx ---
-                            zone_map = zone_df[[zone_sym_col, zone_zone_col, "Zone_Bx"]].drop_duplicates(subset=[zone_sym_col, zone_zone_col]).copy()
-                            zone_map = zone_map.rename(columns={zone_sym_col: "Sym", zone_zone_col: "zone_code"})
-
-                            self.df["Sym"] = self.df["Sym"].astype(str).str.strip().str.upper()
-                            self.df["zone_code"] = _coerce_zone_code(self.df["zone_code"])
-
-                            self.df = self.df.merge(zone_map, on=["Sym", "zone_code"], how="left")
-
-                            # dọn cột tạm
-                            self.df.drop(columns=["__jk"], inplace=True, errors="ignore")
-
-                        # Báo cáo gọn
-                        if "Zone_Bx" in self.df.columns:
-                            missing_rows = self.df[self.df["Zone_Bx"].isna()]
-                            if not missing_rows.empty:
-                                num_missing = int(missing_rows["TRẠM BIẾN ÁP"].nunique())
-                                sample = ", ".join(sorted(missing_rows["TRẠM BIẾN ÁP"].dropna().astype(str).unique()[:5]))
-                                self._log(
-                                    f"⚠️ Còn {num_missing} trạm chưa ánh xạ Zone_Bx (vd: {sample}…). "
-                                    f"Dùng nút '📤 Xuất TBA lỗi' để xuất danh sách chi tiết."
-                                )
-                            else:
-                                self._log("[ok] Đã ánh xạ thành công tất cả TBA sang Zone_Bx.")
+                self.df = attach_zone_bx(self.df, get_db_path(), log=self._log)
             except Exception as e:
                 self._log(f"⚠️ Lỗi khi gắn Zone_Bx: {e}")
 
@@ -1465,11 +3933,13 @@ class App(ctk.CTk):
             # 3) REFRESH UI
             # ==========================================================
             self.view_df = self.df.copy()
+            self._on_dataset_changed()
             self._populate_detects()
             self._refresh_table()
             self._update_stats_and_chart()
             self._cache_df()
             self._save_cfg()
+            self._write_summaries_async(list(paths))
 
             self._log(f"Đã nạp thêm {len(paths)} file, tổng {len(self.df)} dòng.")
 
@@ -1479,6 +3949,182 @@ class App(ctk.CTk):
 
 
 
+    def _write_summaries_async(self, paths):
+        """Lưu summary gộp được cạnh từng file vừa nạp (chạy nền)."""
+        df = self.df
+        vcol, un_col, dt_col = self.voltage_col, self.nominal_col, self.dt_col
+        station_col = detect_station_column(df)
+        if df.empty or "_source_path" not in df.columns or not vcol or not station_col:
+            return
+
+        def _job():
+            db_sig = _file_signature(get_db_path())
+            written = 0
+            for p in paths:
+                part = df[df["_source_path"] == os.path.abspath(p)]
+                if part.empty:
+                    continue
+                if write_file_summary(p, summarize_frame(part, station_col, vcol, un_col, dt_col), db_sig):
+                    written += 1
+            return written
+
+        self._run_in_background(_job, lambda n: safe_print(f"[summary] Đã lưu {n} summary."),
+                                lambda e: safe_print(f"[summary] Lỗi lưu summary: {e}"))
+
+    def _multi_period_report(self):
+        """Báo cáo nhiều kỳ (quý/năm): gộp summary từng file thay vì nạp toàn bộ dữ liệu thô."""
+        initial = self.last_dir if os.path.isdir(self.last_dir) else os.path.expanduser("~")
+        paths = filedialog.askopenfilenames(
+            title="Chọn các file (tháng) cần tổng hợp",
+            initialdir=initial,
+            filetypes=[("Excel files", "*.xls *.xlsx"), ("All files", "*.*")]
+        )
+        if not paths:
+            return
+        paths = list(dict.fromkeys(p for p in paths if p))
+        self._log(f"⏳ Đang gộp summary {len(paths)} file...")
+
+        def _job():
+            return merge_summaries(ensure_file_summaries(paths, get_db_path()))
+
+        def _done(result):
+            agg, sketches = result
+            if agg.empty:
+                messagebox.showwarning("Rỗng", "Không có dữ liệu hợp lệ trong các file đã chọn.")
+                return
+            self._show_multi_period_summary(agg, sketches, len(paths))
+
+        self._run_in_background(_job, _done, lambda e: messagebox.showerror("Lỗi tổng hợp", str(e)))
+
+    def _show_multi_period_summary(self, agg, sketches, n_files):
+        k = VoltageCube.kpis(agg)
+        total = QuantileSketch()
+        for sk in sketches.values():
+            total.merge(sk)
+        p5, p50, p95 = total.quantiles([0.05, 0.5, 0.95])
+
+        days = agg["day"].dropna()
+        d0, d1 = (days.min(), days.max()) if not days.empty else (pd.NaT, pd.NaT)
+        if pd.notna(d0):
+            time_label = f"{d0.strftime('%d/%m/%Y')} - {d1.strftime('%d/%m/%Y')}"
+            file_time = f"{d0.strftime('%Y-%m-%d')}_{d1.strftime('%Y-%m-%d')}"
+        else:
+            time_label, file_time = "", pd.Timestamp.today().strftime("%Y-%m-%d")
+
+        def _f(x):
+            return "—" if pd.isna(x) else f"{x:.2f}"
+
+        win = ctk.CTkToplevel(self)
+        win.title("Tổng hợp nhiều kỳ")
+        win.geometry("460x340")
+        ctk.CTkLabel(win, text="TỔNG HỢP NHIỀU KỲ", font=("Segoe UI", 18, "bold"),
+                     text_color="#1a2857").pack(pady=(16, 6))
+        ctk.CTkLabel(win, justify="left", font=("Segoe UI", 13), text=(
+            f"Số file: {n_files}    Thời gian: {time_label or '—'}\n"
+            f"Số dòng: {k['rows']:,}    Tổng TBA: {k['tba']}\n"
+            f"Umin={_f(k['umin'])}  Utb={_f(k['utb'])}  Umax={_f(k['umax'])}\n"
+            f"P5={_f(p5)}  P50={_f(p50)}  P95={_f(p95)}\n"
+            f"Số lần THẤP (≤{REPORT_LOW_PCT:g}%): {int(agg['n_low'].sum()):,}    "
+            f"CAO (≥{REPORT_HIGH_PCT:g}%): {int(agg['n_high'].sum()):,}"
+        )).pack(anchor="w", padx=20, pady=6)
+
+        def _open_report():
+            win.destroy()
+            df_high, df_low = VoltageCube.zone_report_tables(agg)
+            self._open_zone_report_dashboard(
+                ZoneReport.build(df_high, df_low, time_label, file_time, db_path=get_db_path()))
+
+        ctk.CTkButton(win, text="📈 Mở báo cáo Zone_Bx", command=_open_report).pack(pady=(12, 6))
+        ctk.CTkButton(win, text="📊 So sánh các tháng",
+                      command=lambda: self._show_period_comparison(agg)).pack(pady=(0, 12))
+        self._log(f"[OK] Đã gộp {n_files} file ({k['rows']:,} dòng) từ summary.")
+
+    def _show_period_comparison(self, agg):
+        """So sánh các tháng trong summary đã gộp: biểu đồ cột cạnh nhau theo Zone_Bx + bảng Δ, xuất Excel."""
+        zone_tbl, station_tbl = comparison_tables(agg)
+        periods = sorted(zone_tbl["Kỳ"].unique()) if not zone_tbl.empty else []
+        if len(periods) < 2:
+            messagebox.showwarning("Chưa đủ kỳ", "Cần dữ liệu của ít nhất 2 tháng để so sánh.")
+            return
+
+        from matplotlib.figure import Figure
+
+        win = ctk.CTkToplevel(self)
+        win.title(f"So sánh các kỳ: {', '.join(periods)}")
+        win.geometry("1180x800")
+
+        # --- Biểu đồ cột nhóm: mỗi Zone_Bx 1 cụm, mỗi kỳ 1 cột ---
+        fig = Figure(figsize=(11.5, 4.2), dpi=100)
+        zones = sorted(zone_tbl["Zone_Bx"].unique())
+        x = np.arange(len(zones))
+        width = 0.8 / len(periods)
+        for ax, metric, title in ((fig.add_subplot(1, 2, 1), "Số lần Cao", "Số lần vi phạm CAO theo Zone_Bx"),
+                                  (fig.add_subplot(1, 2, 2), "Số lần Thấp", "Số lần vi phạm THẤP theo Zone_Bx")):
+            wide = zone_tbl.pivot(index="Zone_Bx", columns="Kỳ", values=metric).reindex(index=zones, columns=periods)
+            for i, p in enumerate(periods):
+                ax.bar(x + (i - (len(periods) - 1) / 2) * width, wide[p].to_numpy(), width, label=p)
+            ax.set_xticks(x)
+            ax.set_xticklabels(zones, rotation=45, ha="right", fontsize=8)
+            ax.set_title(title, fontsize=11)
+            ax.grid(axis="y", alpha=0.3)
+            ax.legend(fontsize=8)
+        with MPL_LOCK:
+            fig.tight_layout()
+        canvas = tk_figure_canvas(fig, win)
+        canvas.draw()
+        canvas.get_tk_widget().pack(fill="x", padx=10, pady=(10, 4))
+
+        # --- Bảng so sánh (Zone_Bx / TBA) ---
+        bar = ctk.CTkFrame(win, fg_color="transparent")
+        bar.pack(fill="x", padx=10)
+        level_var = tk.StringVar(value="Zone_Bx")
+        wrap = ctk.CTkFrame(win)
+        wrap.pack(fill="both", expand=True, padx=10, pady=(4, 10))
+        tree = ttk.Treeview(wrap, show="headings")
+        ysb = ttk.Scrollbar(wrap, orient="vertical", command=tree.yview)
+        xsb = ttk.Scrollbar(wrap, orient="horizontal", command=tree.xview)
+        tree.configure(yscrollcommand=ysb.set, xscrollcommand=xsb.set)
+        ysb.pack(side="right", fill="y")
+        xsb.pack(side="bottom", fill="x")
+        tree.pack(fill="both", expand=True)
+
+        def _cell(v):
+            if v is None or v is pd.NA or (isinstance(v, float) and np.isnan(v)):
+                return ""
+            if isinstance(v, float):
+                return f"{v:.2f}"
+            return str(v)
+
+        def _show(*_):
+            tbl = zone_tbl if level_var.get() == "Zone_Bx" else station_tbl
+            cols = [str(c) for c in tbl.columns]
+            tree.delete(*tree.get_children())
+            tree.configure(columns=cols)
+            for c in cols:
+                tree.heading(c, text=c)
+                tree.column(c, width=110 if c.startswith("Δ") or c in COMPARE_METRICS.values() else 150,
+                            anchor="center", stretch=False)
+            for row in tbl.itertuples(index=False, name=None):
+                tree.insert("", "end", values=[_cell(v) for v in row])
+
+        def _export():
+            path = filedialog.asksaveasfilename(
+                title="Xuất bảng so sánh", defaultextension=".xlsx",
+                initialfile=f"So sánh {periods[0]}_{periods[-1]}.xlsx",
+                filetypes=[("Excel", "*.xlsx")])
+            if not path:
+                return
+            self._run_in_background(
+                lambda: write_xlsx_sheets(path, [("ZONE_COMPARE", zone_tbl), ("TBA_COMPARE", station_tbl)]),
+                lambda p: self._log(f"[OK] Đã xuất bảng so sánh: {p}"),
+                lambda e: messagebox.showerror("Lỗi xuất", str(e)))
+
+        ctk.CTkSegmentedButton(bar, values=["Zone_Bx", "TBA"], variable=level_var,
+                               command=_show).pack(side="left")
+        ctk.CTkButton(bar, text="📥 Xuất Excel", width=120, command=_export).pack(side="right")
+        _show()
+        self._log(f"[OK] So sánh {len(periods)} kỳ: {', '.join(periods)}.")
+
     def _populate_detects(self):
         if self.df.empty:
             return
@@ -1533,94 +4179,46 @@ class App(ctk.CTk):
 
 
 
+    def _current_filters(self) -> dict:
+        """Bộ lọc trên giao diện, dạng tham số của apply_view_filters."""
+        low_pct, high_pct = self._ui_thresholds()
+        time_on = self.use_time_filter.get()
+        return dict(
+            station_text=self.station_text.get(),
+            unom=self.unom_val_cmb.get().strip() if self.use_unom_filter.get() else None,
+            date_from=self.from_entry.get_date() if time_on else None,
+            date_to=self.to_entry.get_date() if time_on else None,
+            low_pct=low_pct if self.use_low_filter.get() else None,
+            high_pct=high_pct if self.use_high_filter.get() else None,
+            zones=sorted(getattr(self, "zone_selected", set()) or []),
+            nominal_col=self.nominal_col, dt_col=self.dt_col, compare_col=self.compare_col,
+        )
+
     def _apply_filters(self):
         if self.df.empty: return
-        df = self.df.copy()
         vcol = self.vcol_cmb.get().strip()
         self.voltage_col = vcol or self.voltage_col
 
-        # station
-        text = _norm_text(self.station_text.get())
-        station_col = detect_station_column(df)
-        if text and station_col:
-            col_norm = df[station_col].astype(str).map(_norm_text)
-            df = df[col_norm.str.contains(re.escape(text), na=False)].copy()
-
-        # Uđd value filter (exact) if enabled
-        if self.use_unom_filter.get():
-            nom_col = self.nominal_col
-            nom_val = self.unom_val_cmb.get().strip()
-            if nom_col and nom_col in df.columns and nom_val:
-                df = df[df[nom_col].astype(str) == nom_val].copy()
-
-        # time filter if enabled (inclusive end day)
-        if self.use_time_filter.get():
-            dt_col = self.dt_col or detect_datetime_column(df)
-            if dt_col:
-                start = pd.to_datetime(self.from_entry.get_date())
-                end   = pd.to_datetime(self.to_entry.get_date())
-                dt = pd.to_datetime(df[dt_col], errors="coerce", dayfirst=True)
-                df = df.assign(__dt=dt).dropna(subset=["__dt"])
-                if pd.notna(start): df = df[df["__dt"] >= start]
-                if pd.notna(end):   df = df[df["__dt"] <= (end + pd.Timedelta(days=1) - pd.Timedelta(seconds=1))]
-                df = df.drop(columns=["__dt"], errors="ignore")
-
-        # low/high relative filters
-        # --- Lọc U THẤP / U CAO theo GIÁ TRỊ U THỰC TẾ ---
-        # --- Lọc U THẤP / U CAO so với CỘT SO SÁNH (%) (độc lập với cột U dùng vẽ) ---
-        low_on, high_on = self.use_low_filter.get(), self.use_high_filter.get()
+        filters = self._current_filters()
+        df, cube_args = apply_view_filters(self.df, log=self._log, **filters)
+        self._view_filter_key = json.dumps(filters, default=str, sort_keys=True, ensure_ascii=False)
         comp_col = self.compare_col or detect_compare_column(df)
 
-        if (low_on or high_on) and comp_col and comp_col in df.columns:
-            cmp_series = pd.to_numeric(df[comp_col], errors="coerce")
-            df = df.assign(__cmp=cmp_series).dropna(subset=["__cmp"])
-
-            def _to_float(s, default=None):
-                try:
-                    return float(str(s).replace(",", "."))
-                except Exception:
-                    return default
-
-            low_thr  = _to_float(self.low_pct_str.get(),  None)  # ví dụ 95
-            high_thr = _to_float(self.high_pct_str.get(), None)  # ví dụ 110
-
-            if low_on and low_thr is not None:
-                df = df[df["__cmp"] <= low_thr]
-            if high_on and high_thr is not None:
-                df = df[df["__cmp"] >= high_thr]
-
-            df = df.drop(columns=["__cmp"], errors="ignore")
-        elif (low_on or high_on):
-            self._log("⚠️ Không tìm thấy cột so sánh (ví dụ 'SO SÁNH (%)'). Vui lòng kiểm tra dữ liệu.")
-
-        # Lọc theo vùng Zone_Bx (multi-select)
-        zones = list(getattr(self, "zone_selected", set()) or [])
-        if zones and "Zone_Bx" in df.columns:
-            df = df[df["Zone_Bx"].isin(zones)]
-
-
-        # renumber so tt
-        if "so tt" in df.columns: df = df.drop(columns=["so tt"], errors="ignore")
-        df.insert(0, "so tt", np.arange(1, len(df)+1))
-
         self.view_df = df
+        self._view_cube_args = cube_args
+        self._view_version += 1
         if comp_col:
             self._log(f"Đang lọc theo cột so sánh: {comp_col}")
         self._refresh_table()
         self._update_stats_and_chart()
-        # nếu đang đứng ở Heatmap/Phân phối thì render lại luôn
+        # tab đang hiện vẽ lại ngay (nếu bẩn); các tab khác vẽ lười khi được chọn
         try:
-            cur_tab = self.dashboard_tabs.get()
-            if cur_tab == "Heatmap":
-                self._render_heatmap_on_gui()
-            elif cur_tab == "Phân phối":
-                self._render_dist_on_gui()
-            elif cur_tab == "Báo cáo":
-                self._render_report_zone_charts_on_gui()
+            self._render_tab_if_dirty(self.dashboard_tabs.get())
         except Exception:
             pass
 
-        self._cache_df(); self._save_cfg()
+        # lọc không đổi self.df -> không ghi lại cache dữ liệu, chỉ lưu cấu hình bộ lọc
+        self._save_cfg()
 
     def _maybe_apply_filters(self, *_):
         """Chỉ apply khi Auto đang bật."""
@@ -1732,8 +4330,9 @@ class App(ctk.CTk):
             self.zone_badge_lbl.configure(text=(f"{n} zone" if n else "Tất cả"))
 
     def _display_df(self, df: pd.DataFrame) -> pd.DataFrame:
-        return df.drop(columns=[c for c in ["_source_file","_sheet"] if c in df.columns], errors="ignore")
+        return df.drop(columns=[c for c in ["_source_file","_source_path","_sheet"] if c in df.columns], errors="ignore")
 
+    @PERF.traced("table")
     def _refresh_table(self):
         df_disp = self._display_df(self.view_df.head(5000))
         # ===== FORMAT CỘT NGÀY: dd-mm-yyyy =====
@@ -1746,22 +4345,30 @@ class App(ctk.CTk):
             except Exception:
                 pass
 
+        # ma trận hiển thị (chuỗi) dựng 1 lần bằng vector hóa, dùng chung cho insert + autofit
+        matrix = df_disp.astype(str).values.tolist()
+        if "Zone_Bx" in df_disp.columns:
+            zone_missing = df_disp["Zone_Bx"].isna().tolist()
+        else:
+            zone_missing = [True] * len(matrix)
+        self._fill_table(list(df_disp.columns), matrix, zone_missing)
+
+    def _fill_table(self, columns, matrix, zone_missing):
+        """Đổ ma trận chuỗi vào bảng; giữ lại làm snapshot cho lần khởi động ấm sau."""
+        self._table_snapshot = (columns, matrix, zone_missing)
         self.table.delete(*self.table.get_children())
 
         # Thiết lập cột
-        self.table["columns"] = list(df_disp.columns)
+        self.table["columns"] = columns
 
         self.table.tag_configure("zone_missing", background="#ffe6e6", foreground="red")
 
-        for c in df_disp.columns:
+        for c in columns:
             self.table.heading(c, text=c)
             self.table.column(c, width=90, stretch=True)
 
-        for _, row in df_disp.iterrows():
-            values = [str(x) for x in row.tolist()]
-            zone_val = row.get("Zone_Bx", None)
-
-            if pd.isna(zone_val):
+        for values, missing in zip(matrix, zone_missing):
+            if missing:
                 self.table.insert("", "end", values=values, tags=("zone_missing",))
             else:
                 self.table.insert("", "end", values=values)
@@ -1769,7 +4376,7 @@ class App(ctk.CTk):
         # enable sort by clicking heading
         try:
             self._table_bind_heading_sort()
-            self._autofit_table_columns()
+            self._autofit_table_columns(columns, matrix)
         except Exception:
             pass
 
@@ -1777,12 +4384,13 @@ class App(ctk.CTk):
         for idx, iid in enumerate(self.table.get_children("")):
             self.table.item(iid, tags=("even" if idx % 2 == 0 else "odd"))
 
-    def _autofit_table_columns(self, max_width=420, min_width=60, padding=14):
+    def _autofit_table_columns(self, columns=None, matrix=None, max_width=420, min_width=60, padding=14):
         """
-        Auto-fit column width cho ttk.Treeview dựa trên:
-        - độ dài tiêu đề cột
-        - độ dài nội dung các ô
-        Giới hạn min/max để tránh cột quá to.
+        Auto-fit column width cho ttk.Treeview dựa trên thống kê độ dài chuỗi:
+        - độ rộng tiêu đề cột (đo font 1 lần / cột)
+        - P95 độ dài nội dung × độ rộng glyph trung bình
+        Kết quả được cache theo tập cột; chỉ tính lại khi tập cột đổi
+        hoặc khi nạp dataset mới (xem _invalidate_table_widths).
         """
         import tkinter.font as tkfont
 
@@ -1790,25 +4398,153 @@ class App(ctk.CTk):
             return
 
         tree = self.table
-        font = tkfont.Font(font=("Segoe UI", 10))
-
-        for col in tree["columns"]:
-            # độ rộng theo heading
-            header_text = col
-            width = font.measure(header_text) + padding
-
-            # độ rộng theo nội dung (lấy sample để nhanh)
-            for iid in tree.get_children("")[:200]:  # limit 200 rows
-                cell = tree.set(iid, col)
-                if cell is None:
-                    continue
-                w = font.measure(str(cell)) + padding
-                if w > width:
-                    width = w
+        if columns is None:
+            columns = list(tree["columns"])
+        key = tuple(str(c) for c in columns)
 
-            width = max(min_width, min(width, max_width))
+        cached = getattr(self, "_col_width_cache", None)
+        if cached is None or cached[0] != key:
+            if matrix is None:
+                return
+            font = tkfont.Font(font=("Segoe UI", 10))
+            # glyph trung bình: đo 1 lần trên chuỗi mẫu (số + chữ thường/hoa)
+            sample = "0123456789.,-abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+            glyph_w = font.measure(sample) / len(sample)
+
+            widths = {}
+            arr = np.array(matrix, dtype=object).reshape(len(matrix), len(columns)) if matrix else None
+            for j, col in enumerate(columns):
+                width = font.measure(str(col)) + padding
+                if arr is not None:
+                    lens = np.fromiter((len(s) for s in arr[:, j]), dtype=np.int32, count=arr.shape[0])
+                    p95 = float(np.percentile(lens, 95)) if lens.size else 0.0
+                    width = max(width, int(p95 * glyph_w) + padding)
+                widths[col] = max(min_width, min(width, max_width))
+            self._col_width_cache = (key, widths)
+
+        for col, width in self._col_width_cache[1].items():
             tree.column(col, width=width, stretch=False)
 
+    def _invalidate_table_widths(self):
+        """Bỏ cache độ rộng cột (gọi khi dataset thay đổi)."""
+        self._col_width_cache = None
+
+    def _on_dataset_changed(self):
+        """Dataset (self.df) vừa đổi: bỏ mọi cache dẫn xuất."""
+        self._invalidate_table_widths()
+        self._cubes = {}
+        self._violations = {}
+        self._sketches = {}
+        self._view_cube_args = {}
+        self._view_version += 1
+        self._data_version += 1
+        self._view_filter_key = ""
+        self._data_sigs = {}
+
+    # ---------- Voltage cube ----------
+    def _ui_thresholds(self):
+        """(low_pct, high_pct) từ ô nhập; mặc định 95 / 110."""
+        def _to_float(s, default):
+            try:
+                return float(str(s).replace(",", "."))
+            except Exception:
+                return default
+        return _to_float(self.low_pct_str.get(), REPORT_LOW_PCT), _to_float(self.high_pct_str.get(), REPORT_HIGH_PCT)
+
+    def _get_cube(self) -> Optional[VoltageCube]:
+        """Cube thống kê U của self.df (không phụ thuộc ngưỡng); dựng 1 lần rồi dùng lại."""
+        if self.df.empty or not self.voltage_col or self.voltage_col not in self.df.columns:
+            return None
+        key = (self.voltage_col, self.nominal_col, self.dt_col)
+        cube = self._cubes.get(key)
+        if cube is None:
+            station_col = detect_station_column(self.df)
+            if not station_col:
+                return None
+            cube = VoltageCube.build(self.df, station_col, self.voltage_col, self.nominal_col, self.dt_col)
+            self._cubes[key] = cube
+        return cube
+
+    def _get_violations(self, low_pct: float, high_pct: float) -> Optional[pd.DataFrame]:
+        """Bảng vi phạm của self.df cho cặp ngưỡng (xem VoltageCube.violations);
+        giữ VIOLATION_CACHE_SIZE cặp ngưỡng dùng gần nhất."""
+        if (self.df.empty or not self.voltage_col or self.voltage_col not in self.df.columns
+                or not self.nominal_col or self.nominal_col not in self.df.columns):
+            return None
+        key = (self.voltage_col, self.nominal_col, self.dt_col, float(low_pct), float(high_pct))
+        table = self._violations.pop(key, None)
+        if table is None:
+            station_col = detect_station_column(self.df)
+            if not station_col:
+                return None
+            table = VoltageCube.violations(self.df, station_col, self.voltage_col, self.nominal_col,
+                                           self.dt_col, low_pct, high_pct)
+        self._violations[key] = table
+        while len(self._violations) > VIOLATION_CACHE_SIZE:
+            self._violations.pop(next(iter(self._violations)))
+        return table
+
+    def _get_sketches(self) -> Optional[DistSketches]:
+        """Sketch phân phối U của self.df; dựng 1 lần rồi dùng lại cho mọi bộ lọc."""
+        if self.df.empty or not self.voltage_col or self.voltage_col not in self.df.columns:
+            return None
+        key = (self.voltage_col, self.nominal_col, self.dt_col)
+        sk = self._sketches.get(key)
+        if sk is None:
+            station_col = detect_station_column(self.df)
+            if not station_col:
+                return None
+            sk = DistSketches.build(self.df, station_col, self.voltage_col, self.nominal_col, self.dt_col)
+            self._sketches[key] = sk
+        return sk
+
+    def _dist_summary(self, bins: int = 30):
+        """(counts, edges, box_stats, n) của U trong view hiện tại.
+        Ưu tiên sketch + cube (không đụng dòng thô); bộ lọc không quy đổi được -> tính trên view_df."""
+        from matplotlib import cbook
+        vcol = self.voltage_col
+        args = self._view_cube_args
+        sub = self._cube_view() if args is not None else None
+        sketches = self._get_sketches() if sub is not None else None
+        if sketches is not None:
+            k = VoltageCube.kpis(sub)
+            if not np.isfinite(k["utb"]):
+                return None
+            sk = sketches.merged(sketches.select(**args), k["umin"], k["umax"])
+            counts, edges = sk.histogram(bins, (k["umin"], k["umax"]) if k["umax"] > k["umin"] else None)
+            return counts, edges, sk.box_stats(k["utb"]), sk.count
+
+        v = pd.to_numeric(self.view_df[vcol], errors="coerce").dropna().to_numpy(dtype=float)
+        if v.size == 0:
+            return None
+        counts, edges = np.histogram(v, bins=bins)
+        return counts, edges, cbook.boxplot_stats(v)[0], int(v.size)
+
+    def _cube_view(self) -> Optional[pd.DataFrame]:
+        """Phần cube thống kê tương ứng view_df hiện tại; None nếu bộ lọc không quy về chiều cube."""
+        args = self._view_cube_args
+        if args is None:
+            return None
+        cube = self._get_cube()
+        if cube is None:
+            return None
+        return cube.select(**args)
+
+    def _violation_view(self, low_pct: float, high_pct: float) -> Optional[pd.DataFrame]:
+        """Bảng vi phạm (U so với k·Uđd) của view_df hiện tại: lấy từ bảng của self.df nếu bộ lọc
+        quy về chiều cube, không thì gộp thẳng view_df theo cùng quy tắc. None nếu thiếu cột."""
+        args = self._view_cube_args
+        if args is not None:
+            table = self._get_violations(low_pct, high_pct)
+            return select_dims(table, **args) if table is not None else None
+        df = self.view_df
+        station_col = detect_station_column(df)
+        if (not station_col or not self.voltage_col or self.voltage_col not in df.columns
+                or not self.nominal_col or self.nominal_col not in df.columns):
+            return None
+        return VoltageCube.violations(df, station_col, self.voltage_col, self.nominal_col,
+                                      self.dt_col, low_pct, high_pct)
+
     def _export_missing_tba(self):
         if self.df.empty or "Zone_Bx" not in self.df.columns:
             messagebox.showwarning("Thiếu dữ liệu", "Chưa có dữ liệu hoặc chưa gắn được Zone_Bx.")
@@ -1842,6 +4578,82 @@ class App(ctk.CTk):
             messagebox.showinfo("[OK] Đã lưu", f"Đã lưu danh sách {len(df_out)} TBA lỗi vào:\n{save_path}")
         except Exception as e:
             messagebox.showerror("Lỗi khi xuất", str(e))
+
+    def _run_in_background(self, job, on_done=None, on_error=None, poll_ms=100):
+        """Chạy job() trên thread nền; on_done(result)/on_error(exc) được gọi lại
+        trên main thread (Tk) qua polling after(), không đụng Tk từ thread nền."""
+        import threading, queue
+
+        q = queue.Queue(maxsize=1)
+
+        def _worker():
+            try:
+                q.put(("ok", job()))
+            except Exception as e:
+                q.put(("err", e))
+
+        def _poll():
+            try:
+                status, payload = q.get_nowait()
+            except queue.Empty:
+                self.after(poll_ms, _poll)
+                return
+            if status == "ok":
+                if on_done: on_done(payload)
+            elif on_error:
+                on_error(payload)
+            else:
+                self._log(f"⚠️ Lỗi tác vụ nền: {payload}")
+
+        threading.Thread(target=_worker, daemon=True).start()
+        self.after(poll_ms, _poll)
+
+    def _export_view_df(self):
+        """Xuất toàn bộ view_df (sau lọc) ra CSV / XLSX / Parquet trên thread nền."""
+        if self.view_df.empty:
+            messagebox.showwarning("Rỗng", "Không có dữ liệu để xuất.")
+            return
+        if getattr(self, "_export_busy", False):
+            self._log("⏳ Đang xuất dữ liệu, vui lòng đợi...")
+            return
+
+        initial = self.last_dir if os.path.isdir(self.last_dir) else os.path.expanduser("~")
+        save_path = filedialog.asksaveasfilename(
+            title="Xuất dữ liệu đang lọc",
+            initialdir=initial,
+            defaultextension=".csv",
+            filetypes=[("CSV", "*.csv"), ("Excel files", "*.xlsx"), ("Parquet", "*.parquet")]
+        )
+        if not save_path:
+            return
+        self.last_dir = os.path.dirname(save_path)
+
+        # giữ tham chiếu frame hiện tại (view_df chỉ bị gán lại, không sửa tại chỗ) -> không cần copy
+        df = self.view_df
+        progress_state = {"done": 0, "total": len(df)}
+
+        def _progress(done, total):
+            progress_state["done"] = done
+
+        def _tick():
+            if not getattr(self, "_export_busy", False):
+                return
+            done, total = progress_state["done"], progress_state["total"]
+            self.status_var.set(f"⏳ Đang xuất {done:,}/{total:,} dòng...")
+            self.after(300, _tick)
+
+        def _done(path):
+            self._export_busy = False
+            self._log(f"[OK] Đã xuất {len(df):,} dòng: {path}")
+
+        def _fail(e):
+            self._export_busy = False
+            messagebox.showerror("Lỗi khi xuất", str(e))
+
+        self._export_busy = True
+        self._run_in_background(lambda: export_frame_streaming(df, save_path, _progress), _done, _fail)
+        _tick()
+
     def _update_kpi_cards(self):
         """Cập nhật KPI cards + dòng thống kê dựa trên view_df hiện tại."""
         df = self.view_df if hasattr(self, "view_df") and not self.view_df.empty else self.df
@@ -1851,10 +4663,6 @@ class App(ctk.CTk):
 
         try:
             if df is not None and not df.empty:
-                station_col = detect_station_column(df)
-                if station_col and station_col in df.columns:
-                    so_tba = int(df[station_col].nunique())
-
                 # ưu tiên cột đang chọn để vẽ; fallback tự dò
                 vcol = None
                 vsel = ""
@@ -1869,10 +4677,27 @@ class App(ctk.CTk):
                 else:
                     vcol = pick_voltage_col(df)
 
-                if vcol and vcol in df.columns:
-                    v = pd.to_numeric(df[vcol], errors="coerce").dropna()
-                    if not v.empty:
-                        umin, utb, umax = float(v.min()), float(v.mean()), float(v.max())
+                # trả lời từ cube nếu bộ lọc hiện tại quy về được chiều cube
+                sub = None
+                if vcol and vcol == self.voltage_col:
+                    if df is self.view_df:
+                        sub = self._cube_view()
+                    else:
+                        cube = self._get_cube()
+                        sub = cube.table if cube is not None else None
+
+                if sub is not None:
+                    k = VoltageCube.kpis(sub)
+                    so_tba, umin, utb, umax = k["tba"], k["umin"], k["utb"], k["umax"]
+                else:
+                    station_col = detect_station_column(df)
+                    if station_col and station_col in df.columns:
+                        so_tba = int(df[station_col].nunique())
+
+                    if vcol and vcol in df.columns:
+                        v = pd.to_numeric(df[vcol], errors="coerce").dropna()
+                        if not v.empty:
+                            umin, utb, umax = float(v.min()), float(v.mean()), float(v.max())
         except Exception as e:
             safe_print("KPI update error:", e)
 
@@ -1914,8 +4739,25 @@ class App(ctk.CTk):
 
         self._draw_chart()
 
+    def _chart_artists(self):
+        """Line + scatter của biểu đồ tổng quan: tạo 1 lần trên self.ax, sau đó chỉ
+        set_data/set_offsets và bật/tắt hiển thị theo chế độ vẽ."""
+        if getattr(self, "_chart_line", None) is None:
+            (self._chart_line,) = self.ax.plot([], [], lw=1)
+            self._chart_scatter = self.ax.scatter([], [], s=8, alpha=0.7)
+            self.ax.grid(True, linestyle="--", alpha=0.3)
+            # zoom/pan qua toolbar -> decimate lại (nối 1 lần, không còn cla() xóa callback)
+            self.ax.callbacks.connect("xlim_changed", self._on_chart_xlim_changed)
+        return self._chart_line, self._chart_scatter
+
     def _draw_chart_empty(self):
-        self.ax.cla()
+        line, sc = self._chart_artists()
+        self._chart_full = None
+        self._chart_artist = None
+        line.set_data([], [])
+        sc.set_offsets(np.empty((0, 2)))
+        line.set_visible(False)
+        sc.set_visible(False)
         vcol = self.vcol_cmb.get().strip() if hasattr(self, "vcol_cmb") else ""
         if not vcol:
             vcol = self.voltage_col
@@ -1923,64 +4765,127 @@ class App(ctk.CTk):
         self.ax.set_title(title)
         self.ax.set_xlabel("Thời gian / Index")
         self.ax.set_ylabel("Điện áp")
-        self.canvas.draw()
+        self.canvas.draw_idle()
 
 
+    @PERF.traced("chart")
     def _draw_chart(self):
         import matplotlib.dates as mdates
 
-        self.ax.cla()
         vcol = self.vcol_cmb.get().strip() or self.voltage_col
 
-        self.ax.set_title(f"Biểu đồ {vcol}" if vcol else "Biểu đồ")
-        self.ax.set_ylabel("Điện áp")
-
-        data = self.view_df.copy()
+        data = self.view_df
         if vcol not in data.columns:
             safe_print("[x] Không tìm thấy cột U THỰC TẾ trong dữ liệu.")
-            self.canvas.draw()
+            self._draw_chart_empty()
             return
 
-        # Làm sạch dữ liệu
-        data["__v"] = pd.to_numeric(data[vcol], errors="coerce")
-        data = data.dropna(subset=["__v"])
+        # Làm sạch dữ liệu (chỉ lấy mảng cần vẽ, không copy cả view_df)
+        y = pd.to_numeric(data[vcol], errors="coerce").to_numpy(dtype=float)
+        ok = np.isfinite(y)
 
-        safe_print("[[OK]] Số điểm hợp lệ để vẽ:", len(data))
-        if data.empty:
-            self.canvas.draw()
+        safe_print("[[OK]] Số điểm hợp lệ để vẽ:", int(ok.sum()))
+        if not ok.any():
+            self._draw_chart_empty()
             return
 
         # Xử lý cột thời gian
         dt_col = detect_datetime_column(data)
         if dt_col:
-            data["__x"] = pd.to_datetime(data[dt_col], errors="coerce", dayfirst=True)
-            data = data.dropna(subset=["__x"]).sort_values("__x")
-            xvals = data["__x"].values
-            self.ax.set_xlabel(f"Thời gian ({dt_col})")
+            xdt = pd.to_datetime(data[dt_col], errors="coerce", dayfirst=True)
+            ok &= xdt.notna().to_numpy()
+            xdt = xdt[ok]
+            x = mdates.date2num(xdt.to_numpy())
 
             # Format thời gian đẹp
-            self.ax.xaxis.set_major_locator(mdates.AutoDateLocator())
-            span_days = (data["__x"].max() - data["__x"].min()).days
-            if span_days <= 2:
-                self.ax.xaxis.set_major_formatter(mdates.DateFormatter("%d-%m %H:%M"))
-            else:
-                self.ax.xaxis.set_major_formatter(mdates.DateFormatter("%d-%m"))
-            self.fig.autofmt_xdate(rotation=45)
-
+            span_days = (xdt.max() - xdt.min()).days if len(xdt) else 0
+            self._chart_axis = (f"Thời gian ({dt_col})", "%d-%m %H:%M" if span_days <= 2 else "%d-%m")
         else:
-            data = data.reset_index(drop=True)
-            xvals = data.index.values
-            self.ax.set_xlabel("Index")
+            x = np.arange(int(ok.sum()), dtype=float)
+            self._chart_axis = ("Index", None)
             safe_print("[⚠️] Không có cột thời gian — dùng index thay x.")
 
-        # Vẽ scatter hoặc line
-        if self.chart_mode.get() == "scatter":
-            self.ax.scatter(xvals, data["__v"].values, s=8, alpha=0.7)
+        y = y[ok]
+        order = np.argsort(x, kind="stable")
+        self._chart_full = (x[order], y[order])   # dữ liệu gốc để decimate lại khi zoom
+        self._plot_chart_full()
+
+    def _plot_chart_full(self):
+        """Vẽ self._chart_full (x, y đã sắp) theo trục self._chart_axis (nhãn x, định dạng ngày hoặc None).
+        Không đụng view_df, nên khởi động ấm vẽ lại được thẳng từ snapshot."""
+        import matplotlib.dates as mdates
+        import matplotlib.ticker as mticker
+
+        vcol = self.vcol_cmb.get().strip() or self.voltage_col
+        line, sc = self._chart_artists()
+        self.ax.set_title(f"Biểu đồ {vcol}" if vcol else "Biểu đồ")
+        self.ax.set_ylabel("Điện áp")
+
+        xlabel, date_fmt = self._chart_axis
+        self.ax.set_xlabel(xlabel)
+        if date_fmt:
+            self.ax.xaxis.set_major_locator(mdates.AutoDateLocator())
+            self.ax.xaxis.set_major_formatter(mdates.DateFormatter(date_fmt))
+            self.fig.autofmt_xdate(rotation=45)
         else:
-            self.ax.plot(xvals, data["__v"].values, lw=1)
+            self.ax.xaxis.set_major_locator(mticker.AutoLocator())
+            self.ax.xaxis.set_major_formatter(mticker.ScalarFormatter())
+            self.ax.tick_params(axis="x", labelrotation=0)
+
+        x, y = self._chart_full
+
+        # tạm tách artist để set_xlim bên dưới không kích hoạt decimate lần 2
+        self._chart_artist = None
+        if len(x):
+            pad = (x.max() - x.min()) * 0.02 or 1.0
+            self.ax.set_xlim(x.min() - pad, x.max() + pad)
+            ypad = (y.max() - y.min()) * 0.05 or 1.0
+            self.ax.set_ylim(y.min() - ypad, y.max() + ypad)
+
+        # Cập nhật scatter hoặc line bằng chuỗi đã decimate theo số pixel
+        xs, ys = self._chart_decimated(*self._chart_full)
+        scatter = self.chart_mode.get() == "scatter"
+        if scatter:
+            sc.set_offsets(np.column_stack([xs, ys]))
+            line.set_data([], [])
+            self._chart_artist = sc
+        else:
+            line.set_data(xs, ys)
+            sc.set_offsets(np.empty((0, 2)))
+            self._chart_artist = line
+        sc.set_visible(scatter)
+        line.set_visible(not scatter)
+
+        self.canvas.draw_idle()
 
-        self.ax.grid(True, linestyle="--", alpha=0.3)
-        self.canvas.draw()
+    def _chart_pixel_width(self) -> int:
+        try:
+            w = int(self.canvas.get_tk_widget().winfo_width())
+        except Exception:
+            w = 0
+        return w if w > 50 else 800
+
+    def _chart_decimated(self, x, y, xlim=None):
+        """Cắt theo khoảng đang xem rồi decimate min/max theo số pixel (giữ nguyên đỉnh/đáy)."""
+        if xlim is not None:
+            lo = max(int(np.searchsorted(x, xlim[0], side="left")) - 1, 0)
+            hi = min(int(np.searchsorted(x, xlim[1], side="right")) + 1, len(x))
+            x, y = x[lo:hi], y[lo:hi]
+        idx = minmax_decimate(x, y, self._chart_pixel_width())
+        return x[idx], y[idx]
+
+    def _on_chart_xlim_changed(self, ax):
+        """Zoom/pan qua toolbar: decimate lại từ dữ liệu đầy đủ cho khoảng mới."""
+        full = getattr(self, "_chart_full", None)
+        artist = getattr(self, "_chart_artist", None)
+        if full is None or artist is None:
+            return
+        xs, ys = self._chart_decimated(*full, xlim=ax.get_xlim())
+        if hasattr(artist, "set_offsets"):
+            artist.set_offsets(np.column_stack([xs, ys]))
+        else:
+            artist.set_data(xs, ys)
+        self.canvas.draw_idle()
 
 
     def _export_figure(self):
@@ -1991,7 +4896,9 @@ class App(ctk.CTk):
                                            defaultextension=".png", filetypes=[("PNG Image","*.png")])
         if not out: return
         try:
-            self.fig.savefig(out, dpi=160, bbox_inches="tight"); self._log(f"Đã lưu hình: {out}")
+            with MPL_LOCK:
+                self.fig.savefig(out, dpi=160, bbox_inches="tight")
+            self._log(f"Đã lưu hình: {out}")
             self.last_dir = os.path.dirname(out)
         except Exception as e:
             messagebox.showerror("Lỗi lưu", str(e))
@@ -2001,7 +4908,27 @@ class App(ctk.CTk):
 
     # ---- draw/update helpers ----
     def _on_close(self):
-        self._save_cfg(); self._cache_df(); self.destroy()
+        self._save_cfg(); self._cache_df()
+        writer = self._session_writer
+        if writer.flush(0):
+            self._save_session_state()
+            self.destroy()
+            return
+        # còn bản đang ghi: ẩn cửa sổ ngay, chờ ở nền (không chặn Tk); quá hạn thì bỏ, cache cũ còn nguyên
+        self.withdraw()
+        deadline = time.monotonic() + SESSION_CACHE_CLOSE_S
+
+        def _wait():
+            if writer.flush(0):
+                self._save_session_state()
+                self.destroy()
+            elif time.monotonic() >= deadline:
+                safe_print("[cache] Quá hạn ghi cache phiên khi đóng app, giữ bản cache cũ.")
+                self.destroy()
+            else:
+                self.after(100, _wait)
+
+        self.after(100, _wait)
     def detect_compare_column(df: pd.DataFrame) -> Optional[str]:
         for c in df.columns:
             low = str(c).lower()
@@ -2015,7 +4942,7 @@ class App(ctk.CTk):
             messagebox.showwarning("Thiếu dữ liệu", "Không có dữ liệu để vẽ heatmap.")
             return
 
-        df = self.view_df.copy()
+        df = self.view_df
         dt_col = self.dt_col or detect_datetime_column(df)
         vcol = self.voltage_col
 
@@ -2024,40 +4951,27 @@ class App(ctk.CTk):
             return
 
         # Ghép ngày + giờ nếu có cột Giờ riêng
-        hour_col = None
-        for c in df.columns:
-            if "giờ" in c.lower() or "hour" in c.lower():
-                hour_col = c
-                break
+        dt = build_timestamps(df, dt_col)
 
-        dt = pd.to_datetime(df[dt_col], errors="coerce", dayfirst=True)
-        if hour_col:
-            hour_val = pd.to_numeric(df[hour_col], errors="coerce").fillna(0)
-            dt += pd.to_timedelta(hour_val, unit="h")
+        # lưới 24h × ngày (tự gộp tuần/tháng nếu dài) bằng bincount, không copy view_df
+        grid, cols, period = heatmap_grid(dt.to_numpy(), dt.dt.hour.to_numpy(dtype=float, na_value=np.nan),
+                                          pd.to_numeric(df[vcol], errors="coerce").to_numpy(dtype=float))
 
-        v = pd.to_numeric(df[vcol], errors="coerce")
-        df["__date"] = dt.dt.date
-        df["__hour"] = dt.dt.hour
-        df["__v"] = v
-        tmp = df.dropna(subset=["__date", "__hour", "__v"])
-
-        if tmp.empty:
+        if grid.shape[1] == 0:
             messagebox.showwarning("Dữ liệu trống", "Không có giá trị hợp lệ để vẽ.")
             return
 
-        pivot = tmp.pivot_table(index="__hour", columns="__date", values="__v", aggfunc="mean")
-        pivot = pivot.reindex(range(24))  # đảm bảo đủ 0–23h
+        pivot = pd.DataFrame(grid, index=range(24), columns=cols)  # đủ 0–23h
 
-        import matplotlib.pyplot as plt
+        from matplotlib.figure import Figure
         import seaborn as sns
 
-        plt.figure(figsize=(12, 6))
-        ax = sns.heatmap(pivot, cmap="YlGnBu", cbar_kws={"label": "U thực tế (kV)"})
-        ax.set_title("Heatmap U thực tế trung bình theo Giờ và Ngày")
-        ax.set_xlabel("Ngày")
+        fig = Figure(figsize=(12, 6), dpi=100)
+        ax = sns.heatmap(pivot, cmap="YlGnBu", cbar_kws={"label": "U thực tế (kV)"}, ax=fig.add_subplot())
+        ax.set_title(f"Heatmap U thực tế trung bình theo Giờ và {HEATMAP_PERIODS[period]}")
+        ax.set_xlabel(HEATMAP_PERIODS[period])
         ax.set_ylabel("Giờ")
-        plt.tight_layout()
-        plt.show()
+        self._show_figure_window(fig, "Heatmap U thực tế")
 
 
     def _plot_voltage_hist_box(self):
@@ -2070,27 +4984,42 @@ class App(ctk.CTk):
             messagebox.showwarning("Thiếu cột", "Chưa xác định được cột U thực tế.")
             return
 
-        v = pd.to_numeric(self.view_df[vcol], errors="coerce").dropna()
-        if v.empty:
+        summary = self._dist_summary(bins=30)
+        if summary is None:
             messagebox.showwarning("Dữ liệu rỗng", "Không có giá trị điện áp hợp lệ.")
             return
+        counts, edges, stats = summary[:3]
 
-        import matplotlib.pyplot as plt
+        from matplotlib.figure import Figure
 
-        fig, axs = plt.subplots(1, 2, figsize=(12, 5))
+        fig = Figure(figsize=(12, 5), dpi=100)
+        axs = fig.subplots(1, 2)
         fig.suptitle(f"Phân tích phân phối U thực tế ({vcol})", fontsize=14)
 
-        axs[0].hist(v, bins=30, color="skyblue", edgecolor="black")
+        axs[0].hist(edges[:-1], bins=edges, weights=counts, color="skyblue", edgecolor="black")
         axs[0].set_title("Histogram U thực tế")
         axs[0].set_xlabel("U (kV)")
         axs[0].set_ylabel("Số lần")
 
-        axs[1].boxplot(v, vert=True, patch_artist=True, boxprops=dict(facecolor="lightgreen"))
+        axs[1].bxp([stats], vert=True, patch_artist=True, boxprops=dict(facecolor="lightgreen"))
         axs[1].set_title("Boxplot U thực tế")
         axs[1].set_ylabel("U (kV)")
+        self._show_figure_window(fig, "Phân phối U thực tế")
 
-        plt.tight_layout()
-        plt.show()
+    def _show_figure_window(self, fig, title: str):
+        """Cửa sổ riêng cho 1 figure (thay plt.show): canvas Tk vẽ dưới MPL_LOCK + toolbar."""
+        from matplotlib.backends.backend_tkagg import NavigationToolbar2Tk
+        win = ctk.CTkToplevel(self)
+        win.title(title)
+        with MPL_LOCK:
+            fig.tight_layout()
+        canvas = tk_figure_canvas(fig, win)
+        toolbar = NavigationToolbar2Tk(canvas, win, pack_toolbar=False)
+        toolbar.update()
+        toolbar.pack(side="bottom", fill="x")
+        canvas.get_tk_widget().pack(fill="both", expand=True)
+        canvas.draw()
+        win.lift()
 
     def _show_dashboard_fix_tba_loi(self):
         import pandas as pd
@@ -2287,25 +5216,10 @@ class App(ctk.CTk):
 
 
     def _show_dashboard_zone_voltage_report(self):
-        import plotly.graph_objs as go
-        import plotly.io as pio
-        import webview
-        import tempfile
-        import os
-        import pandas as pd
         self.status_var.set("⏳ Đang tạo báo cáo Dashboard...")
         self.update_idletasks()
 
-        # ===== Thêm check TBA lỗi theo DB VietSub =====
-        #db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "DB_VietSub.xlsx")
-        db_path = get_db_path()
-
-        db_buses = pd.read_excel(db_path, sheet_name="Buses")
-        tba_scada_set = set(db_buses["TBA_SCADA"].astype(str).str.strip().str.lower())
-        def is_tba_loi(tba_name):
-            return tba_name.strip().lower() not in tba_scada_set
-
-        df = self.view_df.copy()
+        df = self.view_df
         if df.empty:
             from tkinter import messagebox
             messagebox.showwarning("Rỗng", "Không có dữ liệu để hiển thị."); return
@@ -2318,319 +5232,90 @@ class App(ctk.CTk):
             messagebox.showwarning("Thiếu cột", "Không tìm thấy cột cần thiết."); return
 
         # === Lấy thời gian lọc từ widget DateEntry (from_entry, to_entry) ===
-        from_date = self.from_entry.get_date()
-        to_date   = self.to_entry.get_date()
-        def _format_date(d):
-            try:
-                return pd.to_datetime(d).strftime("%d/%m/%Y")
-            except Exception:
-                return str(d)
-        if from_date and to_date:
-            time_label = f"{_format_date(from_date)} - {_format_date(to_date)}"
-            file_time = f"{pd.to_datetime(from_date).strftime('%Y-%m-%d')}_{pd.to_datetime(to_date).strftime('%Y-%m-%d')}"
-        else:
-            time_label = ""
-            file_time = pd.Timestamp.today().strftime("%Y-%m-%d")
-
-        df["Ut"] = pd.to_numeric(df[vcol], errors="coerce")
-        df["Un"] = pd.to_numeric(df[un_col], errors="coerce")
-        df = df.dropna(subset=["Ut","Un"])
-        if "Zone_Bx" not in df.columns:
-            df["Zone_Bx"] = "(Chưa có Zone)"
-        zone_col = "Zone_Bx"
-
-
-        # ----- Tổng hợp bảng chi tiết CAO & THẤP -----
-        high_rows, low_rows = [], []
-        for zone, df_zone in df.groupby(zone_col):
-            for (tba, udinh), df_tba_udinh in df_zone.groupby([station_col, "Un"]):
-                ut = df_tba_udinh["Ut"]
-                over_mask = ut >= 1.10 * udinh
-                if sum(over_mask) > 0:
-                    umax_cao = float(ut[over_mask].max())
-                    row = {
-                        "STT": None,
-                        "Zone_Bx": zone,
-                        "TBA": tba,
-                        "Udđ": udinh,
-                        "U(kV)": umax_cao,
-                        "U(kV)/Udđ": round(umax_cao / udinh, 3),
-                        "Số lần Cao": int(sum(over_mask)),
-                        "Umin": float(ut[over_mask].min()),
-                        "Umax": umax_cao
-                    }
-                    high_rows.append(row)
-                under_mask = ut <= 0.95 * udinh
-                if sum(under_mask) > 0:
-                    umin_thap = float(ut[under_mask].min())
-                    row = {
-                        "STT": None,
-                        "Zone_Bx": zone,
-                        "TBA": tba,
-                        "Udđ": udinh,
-                        "U(kV)": umin_thap,
-                        "U(kV)/Udđ": round(umin_thap / udinh, 3),
-                        "Số lần Thấp": int(sum(under_mask)),
-                        "Umin": umin_thap,
-                        "Umax": float(ut[under_mask].max())
-                    }
-                    low_rows.append(row)
-
-        df_high = pd.DataFrame(high_rows)
-        df_low = pd.DataFrame(low_rows)
-        if not df_high.empty:
-            df_high = df_high.sort_values(["Zone_Bx", "Số lần Cao"], ascending=[True, False]).reset_index(drop=True)
-            df_high["STT"] = range(1, len(df_high)+1)
-        if not df_low.empty:
-            df_low = df_low.sort_values(["Zone_Bx", "Số lần Thấp"], ascending=[True, False]).reset_index(drop=True)
-            df_low["STT"] = range(1, len(df_low)+1)
-
-        # --- DANH SÁCH TBA LỖI ở cả CAO & THẤP ---
-        tba_loi_high = list(df_high[df_high["TBA"].apply(is_tba_loi)]["TBA"].unique())
-        tba_loi_low  = list(df_low[df_low["TBA"].apply(is_tba_loi)]["TBA"].unique())
-        tba_loi_set = set(tba_loi_high) | set(tba_loi_low)
-
-        # ==== Cảnh báo TBA lỗi (nếu còn) ====
-        if tba_loi_set:
-            tba_loi_html = "<div style='padding:10px; border:2px solid #F05; background:#FFF6E6; color:#F05; border-radius:10px; margin-bottom:18px;'>"
-            tba_loi_html += "<b>⚠️ DANH SÁCH TBA ĐANG LỖI TÊN (chưa được tổng hợp):</b><br>"
-            tba_loi_html += "<ul style='margin:8px 0 0 20px;'>"
-            for tba in sorted(tba_loi_set):
-                tba_loi_html += f"<li style='margin-bottom:3px;'><b>{tba}</b></li>"
-            tba_loi_html += "</ul>"
-            tba_loi_html += "<div style='margin-top:6px; color:#888; font-size:14px;'>Hãy sửa tên TBA này ở dashboard hiệu chỉnh để báo cáo tổng hợp đủ!</div>"
-            tba_loi_html += "</div>"
-        else:
-            tba_loi_html = ""
-
-        # --- Tổng hợp Zone_Bx cho CAO & THẤP ---
-        def zone_stat(df, num_col, label_sum, label_tba):
-            if df.empty:
-                return pd.DataFrame(columns=["Zone_Bx", label_tba, label_sum])
-            return df.groupby("Zone_Bx").agg(
-                **{label_tba: ("TBA", "nunique"),
-                   label_sum: (num_col, "sum")}
-            ).reset_index()
-
-        stat_high = zone_stat(df_high, "Số lần Cao", "Tổng số lần Cao", "Số TBA vi phạm")
-        stat_low  = zone_stat(df_low, "Số lần Thấp", "Tổng số lần Thấp", "Số TBA vi phạm")
-
-        # --- Biểu đồ Zone_Bx CAO/THẤP ---
-        fig_high1 = go.Figure()
-        fig_high1.add_trace(go.Bar(
-            x=stat_high["Zone_Bx"], y=stat_high["Số TBA vi phạm"],
-            marker_color="rgb(36,190,110)",
-            text=stat_high["Số TBA vi phạm"], textposition="auto",
-            name="Số TBA vi phạm CAO",
-            hovertemplate='<b>%{x}</b><br>Số TBA vi phạm: %{y}'
-        ))
-        fig_high1.update_layout(
-            title="Số lượng TBA có vi phạm điện áp CAO (>=110%) theo Zone_Bx",
-            xaxis_title="Zone_Bx", yaxis_title="Số TBA vi phạm",
-            height=320, font=dict(family="Arial", size=13), plot_bgcolor="#fafdff"
-        )
-        fig_high2 = go.Figure()
-        fig_high2.add_trace(go.Bar(
-            x=stat_high["Zone_Bx"], y=stat_high["Tổng số lần Cao"],
-            marker_color="rgb(0,120,250)",
-            text=stat_high["Tổng số lần Cao"], textposition="auto",
-            name="Tổng số lần vi phạm CAO",
-            hovertemplate='<b>%{x}</b><br>Tổng số lần Cao: %{y}'
-        ))
-        fig_high2.update_layout(
-            title="Tổng số lần vi phạm điện áp CAO (>=110%) theo Zone_Bx",
-            xaxis_title="Zone_Bx", yaxis_title="Tổng số lần Cao",
-            height=320, font=dict(family="Arial", size=13), plot_bgcolor="#fafdff"
-        )
-
-        fig_low1 = go.Figure()
-        fig_low1.add_trace(go.Bar(
-            x=stat_low["Zone_Bx"], y=stat_low["Số TBA vi phạm"],
-            marker_color="rgb(241,98,53)",
-            text=stat_low["Số TBA vi phạm"], textposition="auto",
-            name="Số TBA vi phạm THẤP",
-            hovertemplate='<b>%{x}</b><br>Số TBA vi phạm: %{y}'
-        ))
-        fig_low1.update_layout(
-            title="Số lượng TBA có vi phạm điện áp THẤP (<=95%) theo Zone_Bx",
-            xaxis_title="Zone_Bx", yaxis_title="Số TBA vi phạm",
-            height=320, font=dict(family="Arial", size=13), plot_bgcolor="#fafdff"
-        )
-        fig_low2 = go.Figure()
-        fig_low2.add_trace(go.Bar(
-            x=stat_low["Zone_Bx"], y=stat_low["Tổng số lần Thấp"],
-            marker_color="rgb(140, 75, 230)",
-            text=stat_low["Tổng số lần Thấp"], textposition="auto",
-            name="Tổng số lần vi phạm THẤP",
-            hovertemplate='<b>%{x}</b><br>Tổng số lần Thấp: %{y}'
-        ))
-        fig_low2.update_layout(
-            title="Tổng số lần vi phạm điện áp THẤP (<=95%) theo Zone_Bx",
-            xaxis_title="Zone_Bx", yaxis_title="Tổng số lần Thấp",
-            height=320, font=dict(family="Arial", size=13), plot_bgcolor="#fafdff"
-        )
-
-
-
-        # ======= Bảng HTML đẹp =======
-        def table_html(df, caption=""):
-            if df.empty:
-                return f"<i>Không có số liệu.</i>"
-            html = df.to_html(index=False, classes="table table-striped", border=1, float_format="%.3f")
-            return (f"<div style='font-weight:bold;margin:8px 0'>{caption}</div>{html}")
-
-        html_high_stat = table_html(stat_high, "BẢNG TK ZONE_BX: Số TBA & số lần VI PHẠM ĐIỆN ÁP CAO (>=110%)")
-        html_low_stat  = table_html(stat_low,  "BẢNG TK ZONE_BX: Số TBA & số lần VI PHẠM ĐIỆN ÁP THẤP (<=95%)")
-        html_high_detail = table_html(df_high, "BẢNG CHI TIẾT TBA VI PHẠM ĐIỆN ÁP CAO (>=110%)")
-        html_low_detail  = table_html(df_low,  "BẢNG CHI TIẾT TBA VI PHẠM ĐIỆN ÁP THẤP (<=95%)")
+        time_label, file_time = report_period_label(self.from_entry.get_date(), self.to_entry.get_date())
+
+        # Báo cáo không đổi (cùng dataset, DB VietSub, bộ lọc, kỳ) -> dùng lại, không tổng hợp lại
+        key = self._report_cache_key(vcol, un_col, station_col, time_label, file_time)
+        report = self._report_cache.pop(key, None) if key is not None else None
+        if report is None and key is not None:
+            report = ZoneReport.load_cached(key)
+        if report is None:
+            # ----- Tổng hợp bảng chi tiết CAO & THẤP -----
+            sub = None
+            if ("Zone_Bx" in df.columns and vcol == self.voltage_col and un_col == self.nominal_col
+                    and station_col == detect_station_column(self.df)):
+                sub = self._violation_view(REPORT_LOW_PCT, REPORT_HIGH_PCT)
+
+            if sub is not None:
+                df_high, df_low = VoltageCube.zone_report_tables(sub)
+            else:
+                df_high, df_low = violation_tables(df, station_col, vcol, un_col)
+            report = ZoneReport.build(df_high, df_low, time_label, file_time, db_path=get_db_path())
+            if key is not None:
+                report.save_cached(key)
+        if key is not None:
+            self._report_cache[key] = report
+            while len(self._report_cache) > REPORT_MEM_CACHE_SIZE:
+                self._report_cache.pop(next(iter(self._report_cache)))
+
+        self._open_zone_report_dashboard(report)
+
+    def _report_cache_key(self, vcol, un_col, station_col, *parts):
+        """Khóa báo cáo = chữ ký nội dung dataset (các cột báo cáo dùng) + chữ ký DB VietSub
+        + bộ lọc view_df + ngưỡng; giữ nguyên giữa các phiên nên tra được trước khi tổng hợp.
+        None = không cache."""
+        if self._view_filter_key is None:
+            return None
+        cols = tuple(c for c in dict.fromkeys((station_col, vcol, un_col, self.dt_col, "Zone_Bx"))
+                     if c and c in self.df.columns)
+        sig_key = (self._data_version,) + cols
+        if sig_key not in self._data_sigs:
+            self._data_sigs = {sig_key: frame_signature(self.df, cols)}
+        return report_cache_key(self._data_sigs[sig_key], _file_signature(get_db_path()),
+                                self._view_filter_key, REPORT_LOW_PCT, REPORT_HIGH_PCT,
+                                vcol, un_col, station_col, *parts)
+
+    def _open_zone_report_dashboard(self, report: ZoneReport):
+        """Dashboard webview cho báo cáo Zone_Bx + API xuất Excel/Word (xem ZoneReport)."""
+        import webview
 
-        fig_high1_html = pio.to_html(fig_high1, full_html=False, include_plotlyjs=True)
-        fig_high2_html = pio.to_html(fig_high2, full_html=False, include_plotlyjs=False)
-        fig_low1_html  = pio.to_html(fig_low1,  full_html=False, include_plotlyjs=False)
-        fig_low2_html  = pio.to_html(fig_low2,  full_html=False, include_plotlyjs=False)
+        file_time = report.file_time
+        html_path = report.dashboard_file()
 
-        # ==== HTML dashboard có cảnh báo TBA lỗi ====
-        html = f"""
-        <html>
-        <head>
-            <meta charset="utf-8">
-            <style>
-                body {{ font-family: Arial; margin: 16px; background: #fafdff; }}
-                .table {{ border-collapse: collapse; width: 100%; font-size: 15px; margin-bottom:18px;}}
-                .table th, .table td {{ border: 1px solid #bbb; padding: 4px 8px; }}
-                .table th {{ background: #e8e8e8; }}
-                .dash-btn {{
-                    display:inline-block; margin:12px 0; padding:7px 15px;
-                    background:#1756d9; color:#fff; border:none; border-radius:6px; font-size:15px; cursor:pointer;}}
-                h2,h3 {{margin-top:18px;}}
-            </style>
-        </head>
-        <body>
-            <h2 style="color:#1756d9">
-                BÁO CÁO PHÂN TÍCH ĐIỆN ÁP THEO ZONE_BX
-                <br><span style="font-size:18px;color:#F05;">{time_label}</span>
-            </h2>
-            {tba_loi_html}
-            {fig_high1_html}
-            {fig_high2_html}
-            {html_high_stat}
-            <hr>
-            {fig_low1_html}
-            {fig_low2_html}
-            {html_low_stat}
-            <hr>
-            {html_high_detail}
-            <hr>
-            {html_low_detail}
-            <button class="dash-btn" onclick="window.pywebview.api.export_excel()">📥 Xuất báo cáo Excel</button>
-            <button class="dash-btn" onclick="window.pywebview.api.export_word()">📝 Xuất Word báo cáo</button>
-        </body>
-        </html>
-        """
+        class Api:
+            def export_excel(self):
+                import os
+                app_dir = os.path.dirname(os.path.abspath(__file__))
+                file_path = report.to_excel(os.path.join(app_dir, f"Báo cáo {file_time}.xlsx"))
+                webview.windows[0].evaluate_js("alert('Đã xuất báo cáo Excel thành công!');")
+                os.startfile(file_path)
+
+            def export_word(self):
+                import os
+                app_dir = os.path.dirname(os.path.abspath(__file__))
+                file_path = report.to_word(os.path.join(app_dir, f"Báo cáo {file_time}.docx"))
+                webview.windows[0].evaluate_js("alert('Đã xuất báo cáo Word!');")
+                os.startfile(file_path)
+
+            def export_per_zone(self):
+                import os
+                app_dir = os.path.dirname(os.path.abspath(__file__))
+                out_dir = os.path.join(app_dir, f"Báo cáo theo Zone_Bx {file_time}")
+                errors = []
+                def log(msg):
+                    safe_print(msg)
+                    if msg.startswith("❌"):
+                        errors.append(msg)
+                files = write_zone_reports(report, out_dir, ("xlsx", "docx"), log=log)
+                msg = f"Đã xuất {len(files)} file báo cáo theo Zone_Bx!"
+                if errors:
+                    msg += "\n\nLỗi:\n" + "\n".join(errors)
+                webview.windows[0].evaluate_js(f"alert({json.dumps(msg)});")
+                os.startfile(out_dir)
 
-        # --- Lưu biểu đồ ra file PNG để chèn vào Word ---
-        chart_imgs = []
-        with tempfile.TemporaryDirectory() as tmpdir:
-            fig_high1_path = os.path.join(tmpdir, "zone_high1.png")
-            fig_high2_path = os.path.join(tmpdir, "zone_high2.png")
-            fig_low1_path = os.path.join(tmpdir, "zone_low1.png")
-            fig_low2_path = os.path.join(tmpdir, "zone_low2.png")
-            fig_high1.write_image(fig_high1_path, scale=2, width=950, height=340)
-            fig_high2.write_image(fig_high2_path, scale=2, width=950, height=340)
-            fig_low1.write_image(fig_low1_path, scale=2, width=950, height=340)
-            fig_low2.write_image(fig_low2_path, scale=2, width=950, height=340)
-            chart_imgs = [fig_high1_path, fig_high2_path, fig_low1_path, fig_low2_path]
-
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".html") as f:
-                f.write(html.encode("utf-8"))
-                html_path = f.name
-
-            class Api:
-                def export_excel(self):
-                    import os
-                    app_dir = os.path.dirname(os.path.abspath(__file__))
-                    file_path = os.path.join(app_dir, f"Báo cáo {file_time}.xlsx")
-                    with pd.ExcelWriter(file_path, engine="openpyxl") as writer:
-                        if not stat_high.empty:
-                            stat_high.to_excel(writer, sheet_name="ZONE_BX_HIGH_STAT", index=False)
-                        if not stat_low.empty:
-                            stat_low.to_excel(writer, sheet_name="ZONE_BX_LOW_STAT", index=False)
-                        if not df_high.empty:
-                            df_high.to_excel(writer, sheet_name="HIGH_VOLTAGE_DETAIL", index=False)
-                        if not df_low.empty:
-                            df_low.to_excel(writer, sheet_name="LOW_VOLTAGE_DETAIL", index=False)
-                    webview.windows[0].evaluate_js("alert('Đã xuất báo cáo Excel thành công!');")
-                    os.startfile(file_path)
-
-                def export_word(self):
-                    import os
-                    from docx import Document
-                    from docx.shared import Inches
-                    app_dir = os.path.dirname(os.path.abspath(__file__))
-                    file_path = os.path.join(app_dir, f"Báo cáo {file_time}.docx")
-                    doc = Document()
-                    # Nếu muốn cảnh báo TBA lỗi xuất ra luôn file Word, thêm đoạn này:
-                    if tba_loi_html:
-                        doc.add_paragraph("⚠️ DANH SÁCH TBA LỖI: " + ", ".join(sorted(tba_loi_set)), style="Intense Quote")
-                    doc.add_heading(f'BÁO CÁO PHÂN TÍCH ĐIỆN ÁP THEO ZONE_BX\n{time_label}', 0)
-                    doc.add_heading('Biểu đồ tổng hợp điện áp CAO', level=1)
-                    doc.add_picture(chart_imgs[0], width=Inches(6.2))
-                    doc.add_picture(chart_imgs[1], width=Inches(6.2))
-                    doc.add_paragraph()
-                    doc.add_heading('Biểu đồ tổng hợp điện áp THẤP', level=1)
-                    doc.add_picture(chart_imgs[2], width=Inches(6.2))
-                    doc.add_picture(chart_imgs[3], width=Inches(6.2))
-                    doc.add_paragraph()
-
-                    doc.add_heading('Thống kê điện áp CAO', level=1)
-                    if not stat_high.empty:
-                        t = doc.add_table(rows=1, cols=len(stat_high.columns), style='Table Grid')
-                        for j, col in enumerate(stat_high.columns):
-                            t.cell(0, j).text = str(col)
-                        for idx, row in stat_high.iterrows():
-                            cells = t.add_row().cells
-                            for j, val in enumerate(row):
-                                cells[j].text = str(val)
-                        doc.add_paragraph()
-                    doc.add_heading('Thống kê điện áp THẤP', level=1)
-                    if not stat_low.empty:
-                        t = doc.add_table(rows=1, cols=len(stat_low.columns), style='Table Grid')
-                        for j, col in enumerate(stat_low.columns):
-                            t.cell(0, j).text = str(col)
-                        for idx, row in stat_low.iterrows():
-                            cells = t.add_row().cells
-                            for j, val in enumerate(row):
-                                cells[j].text = str(val)
-                        doc.add_paragraph()
-                    doc.add_heading('Bảng chi tiết TBA vi phạm điện áp CAO', level=1)
-                    if not df_high.empty:
-                        t = doc.add_table(rows=1, cols=len(df_high.columns), style='Table Grid')
-                        for j, col in enumerate(df_high.columns):
-                            t.cell(0, j).text = str(col)
-                        for idx, row in df_high.iterrows():
-                            cells = t.add_row().cells
-                            for j, val in enumerate(row):
-                                cells[j].text = str(val)
-                        doc.add_paragraph()
-                    doc.add_heading('Bảng chi tiết TBA vi phạm điện áp THẤP', level=1)
-                    if not df_low.empty:
-                        t = doc.add_table(rows=1, cols=len(df_low.columns), style='Table Grid')
-                        for j, col in enumerate(df_low.columns):
-                            t.cell(0, j).text = str(col)
-                        for idx, row in df_low.iterrows():
-                            cells = t.add_row().cells
-                            for j, val in enumerate(row):
-                                cells[j].text = str(val)
-                        doc.add_paragraph()
-                    doc.save(file_path)
-                    webview.windows[0].evaluate_js("alert('Đã xuất báo cáo Word!');")
-                    os.startfile(file_path)
-
-            api = Api()
-            webview.create_window("Dashboard & Báo cáo tổng hợp", html_path, width=1300, height=950, js_api=api)
-            webview.start()
-            if os.path.exists(html_path):
-                os.remove(html_path)
+        api = Api()
+        webview.create_window("Dashboard & Báo cáo tổng hợp", html_path, width=1300, height=950, js_api=api)
+        webview.start()
 
 
     def _show_help(self):
@@ -2658,7 +5343,11 @@ class App(ctk.CTk):
             "   • 🧹 Xóa: Xóa dữ liệu hiện tại khỏi bảng & biểu đồ\n"
             "   • 🛠️ Hiệu chỉnh TBA lỗi: Mở dashboard web để dò/sửa TBA chưa khớp DB\n"
             "   • 📈 Dashboard: Phân tích điện áp theo Zone_Bx, có biểu đồ và xuất báo cáo Excel/Word\n"
-            "   • 📤 Xuất TBA lỗi: Xuất danh sách trạm chưa ánh xạ Zone_Bx ra file Excel\n\n"
+            "   • 🗓 Báo cáo nhiều kỳ: Chọn nhiều file tháng, gộp summary (*.dasum.pkl) để lập báo cáo quý/năm\n"
+            "     → 📊 So sánh các tháng: số lần / số ngày vi phạm, Umin/Umax và chênh lệch (Δ) theo Zone_Bx & TBA\n"
+            "   • 📤 Xuất TBA lỗi: Xuất danh sách trạm chưa ánh xạ Zone_Bx ra file Excel\n"
+            "   • 💾 Xuất dữ liệu lọc: Xuất toàn bộ dữ liệu đang lọc ra CSV / Excel / Parquet\n"
+            "   • ⏱ Hiệu năng: Thời gian từng bước (gần nhất, p50/p95), xuất Chrome trace (JSON)\n\n"
             "2. Bộ lọc dữ liệu:\n"
             "   • Lọc theo Trạm biến áp (gõ tên trạm)\n"
             "   • Lọc theo U danh định (Uđd)\n"
@@ -2690,6 +5379,57 @@ class App(ctk.CTk):
         textbox.pack(padx=20, pady=5, fill="both", expand=True)
 
         ctk.CTkButton(win, text="Đóng", command=win.destroy).pack(pady=12)
+
+    def _show_perf_panel(self):
+        """Bảng thời gian từng bước xử lý (PERF): lần gần nhất + p50/p95 cuộn, tự làm mới mỗi giây."""
+        win = getattr(self, "_perf_win", None)
+        if win is not None and win.winfo_exists():
+            win.lift()
+            return
+        win = ctk.CTkToplevel(self)
+        self._perf_win = win
+        win.title("Hiệu năng các bước xử lý")
+        win.geometry("720x420")
+
+        ctk.CTkLabel(win, text=f"Thời gian (ms) trên {PERF_HISTORY} lần gần nhất của mỗi bước",
+                     font=("Segoe UI", 13, "bold"), text_color="#1a2857").pack(anchor="w", padx=12, pady=(12, 6))
+        cols = ("Bước", "Số lần", "Gần nhất", "p50", "p95", "Max")
+        tree = ttk.Treeview(win, columns=cols, show="headings", height=12)
+        for c in cols:
+            tree.heading(c, text=c)
+            tree.column(c, width=200 if c == "Bước" else 90, anchor="w" if c == "Bước" else "e")
+        tree.pack(fill="both", expand=True, padx=12)
+
+        def _refresh():
+            if not win.winfo_exists():
+                return
+            tree.delete(*tree.get_children())
+            for r in PERF.stats():
+                tree.insert("", "end", values=(r["label"], r["n"], f"{r['last']:.1f}", f"{r['p50']:.1f}",
+                                               f"{r['p95']:.1f}", f"{r['max']:.1f}"))
+            win.after(1000, _refresh)
+
+        def _export():
+            path = filedialog.asksaveasfilename(
+                parent=win, title="Lưu Chrome trace", initialdir=self.last_dir,
+                initialfile=f"dienap_trace_{time.strftime('%Y%m%d_%H%M%S')}.json",
+                defaultextension=".json", filetypes=[("Chrome trace", "*.json")])
+            if not path:
+                return
+            try:
+                PERF.export_chrome_trace(path)
+                self._log(f"[OK] Đã lưu trace: {path} (mở bằng chrome://tracing hoặc ui.perfetto.dev)")
+            except Exception as e:
+                messagebox.showerror("Lỗi khi xuất", str(e), parent=win)
+
+        btn_row = ctk.CTkFrame(win, fg_color="transparent")
+        btn_row.pack(fill="x", padx=12, pady=12)
+        ctk.CTkButton(btn_row, text="💾 Xuất Chrome trace", command=_export, width=160).pack(side="left")
+        ctk.CTkButton(btn_row, text="Xóa số liệu", width=100,
+                      command=lambda: (PERF.clear(), tree.delete(*tree.get_children()))).pack(side="left", padx=8)
+        ctk.CTkButton(btn_row, text="Đóng", command=win.destroy, width=90).pack(side="right")
+        _refresh()
+
     def _kpi_card(self, parent, icon, label, value, color, col):
         card = ctk.CTkFrame(parent, fg_color=color, corner_radius=12, width=104, height=64)
         card.grid(row=0, column=col, padx=12, pady=0, sticky="nsew")
@@ -2707,11 +5447,168 @@ class App(ctk.CTk):
                      text_color="#fff").pack(side="top", pady=(0, 4))
 
 
+# ==================== Startup timing ====================
+# Gói import lười, theo thứ tự tính năng hay dùng; đo bằng --import-times (chạy được cả trong bản exe).
+LAZY_IMPORTS = ("matplotlib.pyplot", "matplotlib.backends.backend_tkagg", "tkcalendar", "pyarrow",
+                "openpyxl", "xlsxwriter", "plotly.graph_objs", "plotly.io", "webview", "rapidfuzz",
+                "docx", "seaborn")
+
+def measure_import_times(modules=LAZY_IMPORTS) -> List[tuple]:
+    """[(module, giây)] khi import lần lượt từng gói; None = chưa cài. Phụ thuộc dùng chung
+    được tính cho gói import trước, gói đã có trong sys.modules ra ~0."""
+    import importlib
+    out = []
+    for name in modules:
+        t0 = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except Exception:
+            out.append((name, None))
+            continue
+        out.append((name, time.perf_counter() - t0))
+    return out
+
+def format_startup_times() -> str:
+    """Các mốc khởi động đã ghi: import mức module -> cửa sổ hiện -> cache phiên nạp xong."""
+    labels = {"import": "import", "window": "cửa sổ", "cache": "cache"}
+    return " | ".join(f"{labels.get(k, k)} {v:.2f}s" for k, v in STARTUP_TIMES.items())
+
+def import_time_report(modules=LAZY_IMPORTS) -> str:
+    lines = [f"{'(import mức module: pandas, numpy, matplotlib, customtkinter)':<64}"
+             f"{STARTUP_TIMES['import'] * 1000:8.0f} ms"]
+    total = 0.0
+    for name, sec in measure_import_times(modules):
+        if sec is None:
+            lines.append(f"{name:<64}{'chưa cài':>11}")
+            continue
+        total += sec
+        lines.append(f"{name:<64}{sec * 1000:8.0f} ms")
+    lines.append(f"{'Tổng gói import lười':<64}{total * 1000:8.0f} ms")
+    return "\n".join(lines)
+
 # ==================== Entrypoint ====================
+HEADLESS_INPUT_EXTS = (".xls", ".xlsx")
+
+def collect_input_paths(inputs) -> List[str]:
+    """File Excel từ danh sách file/thư mục (thư mục: mọi .xls/.xlsx, bỏ file khóa '~$')."""
+    out = []
+    for item in ([inputs] if isinstance(inputs, str) else inputs or []):
+        p = Path(item).expanduser()
+        if p.is_dir():
+            out += sorted(str(f) for f in p.iterdir()
+                          if f.suffix.lower() in HEADLESS_INPUT_EXTS and not f.name.startswith("~$"))
+        elif p.is_file():
+            out.append(str(p))
+        else:
+            safe_print(f"⚠️ Không tìm thấy: {item}")
+    return list(dict.fromkeys(out))
+
+def run_headless_reports(cfg: dict, log=safe_print) -> List[str]:
+    """Nạp dữ liệu 1 lần rồi xuất báo cáo Zone_Bx cho từng kỳ trong cfg (không cần Tk/webview).
+
+    cfg (JSON):
+        inputs    : danh sách file / thư mục Excel
+        db_path   : DB_VietSub.xlsx (mặc định cạnh chương trình)
+        output_dir: thư mục ghi báo cáo (mặc định thư mục hiện tại)
+        formats   : ["xlsx", "docx", "html"]
+        filters   : {station, unom, date_from, date_to, low_pct, high_pct, zones}
+        periods   : [{date_from, date_to}, ...] — mỗi kỳ ghi đè date_from/date_to của filters
+        per_zone  : true -> thêm 1 bộ file cho từng Zone_Bx (thư mục con 'Zone_Bx <kỳ>')
+        self_check: true -> đối chiếu tab Độ nhạy với bảng báo cáo tại ngưỡng báo cáo, lệch thì dừng
+    """
+    paths = collect_input_paths(cfg.get("inputs"))
+    if not paths:
+        raise ValueError("Không có file đầu vào (inputs).")
+    db_path = cfg.get("db_path") or get_db_path()
+    out_dir = cfg.get("output_dir") or os.getcwd()
+    formats = cfg.get("formats") or ["xlsx", "docx", "html"]
+
+    log(f"⏳ Nạp {len(paths)} file...")
+    df = load_and_map(paths, db_path, log=log)
+    if df.empty:
+        raise ValueError("Không có dữ liệu hợp lệ từ các file đầu vào.")
+    nominal_col, dt_col = pick_nominal_col(df), detect_datetime_column(df)
+
+    written = []
+    for period in cfg.get("periods") or [{}]:
+        f = {**(cfg.get("filters") or {}), **period}
+        sub, _ = apply_view_filters(
+            df, station_text=f.get("station", ""), unom=f.get("unom"),
+            date_from=f.get("date_from"), date_to=f.get("date_to"),
+            low_pct=f.get("low_pct"), high_pct=f.get("high_pct"), zones=f.get("zones"),
+            nominal_col=nominal_col, dt_col=dt_col, log=log)
+        time_label, file_time = report_period_label(f.get("date_from"), f.get("date_to"))
+        if sub.empty:
+            log(f"⚠️ Kỳ {time_label or file_time}: không có dữ liệu sau khi lọc, bỏ qua.")
+            continue
+        if cfg.get("self_check"):
+            vcol = cfg.get("voltage_col") or pick_voltage_col(sub)
+            errors = check_sweep_consistency(sub, detect_station_column(sub), vcol, pick_nominal_col(sub))
+            if errors:
+                raise ValueError(f"Kỳ {time_label or file_time}: Độ nhạy lệch báo cáo — " + "; ".join(errors))
+            log(f"✅ Kỳ {time_label or file_time}: Độ nhạy khớp báo cáo.")
+        report = ZoneReport.from_frame(sub, time_label, file_time, db_path=db_path,
+                                       vcol=cfg.get("voltage_col"))
+        files = report.write(out_dir, formats)
+        written += files
+        log(f"✅ Kỳ {time_label or file_time}: " + ", ".join(os.path.basename(p) for p in files))
+        if cfg.get("per_zone"):
+            written += write_zone_reports(report, os.path.join(out_dir, f"Zone_Bx {file_time}"), formats, log=log)
+    return written
+
+def main_headless(argv=None) -> int:
+    """Chạy báo cáo không giao diện: python Tool_DienAp_PR_v2.4.py --config report.json"""
+    import argparse
+    parser = argparse.ArgumentParser(description="Xuất báo cáo điện áp Zone_Bx không cần giao diện.")
+    parser.add_argument("--config", help="file cấu hình JSON")
+    parser.add_argument("--inputs", nargs="+", help="ghi đè 'inputs' trong cấu hình")
+    parser.add_argument("--output-dir", help="ghi đè 'output_dir' trong cấu hình")
+    parser.add_argument("--formats", nargs="+", choices=["xlsx", "docx", "html"], help="ghi đè 'formats'")
+    parser.add_argument("--trace", help="ghi Chrome trace (JSON) các bước xử lý ra file này")
+    parser.add_argument("--import-times", action="store_true",
+                        help="in thời gian import từng gói nặng rồi thoát")
+    parser.add_argument("--self-check", action="store_true",
+                        help="kiểm tra xuất Parquet; có --config thì đối chiếu thêm tab Độ nhạy với bảng báo cáo")
+    args = parser.parse_args(argv)
+    if args.import_times:
+        safe_print(import_time_report())
+        return 0
+    if args.self_check:
+        errors = check_parquet_export()
+        if errors:
+            safe_print("❌ " + "; ".join(errors))
+            return 1
+        safe_print("✅ Xuất Parquet theo chunk: đạt.")
+    if not args.config:
+        if args.self_check:
+            return 0
+        parser.error("cần --config")
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        cfg = json.load(f)
+    if args.inputs: cfg["inputs"] = args.inputs
+    if args.output_dir: cfg["output_dir"] = args.output_dir
+    if args.formats: cfg["formats"] = args.formats
+    if args.self_check: cfg["self_check"] = True
+    try:
+        run_headless_reports(cfg)
+    except Exception as e:
+        safe_print(f"❌ {e}")
+        return 1
+    finally:
+        safe_print(PERF.report())
+        if args.trace:
+            safe_print(f"Trace: {PERF.export_chrome_trace(args.trace)}")
+    return 0
+
 def main():
+    if is_headless_argv(sys.argv[1:]):
+        sys.exit(main_headless(sys.argv[1:]))
     app = App()
     app.mainloop()
 
 if __name__ == "__main__":
+    import multiprocessing
+    multiprocessing.freeze_support()   # bản exe: tiến trình con của ProcessPoolExecutor
     main()
 